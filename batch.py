@@ -0,0 +1,169 @@
+import argparse
+import io
+import json
+import os
+import sys
+import time
+from concurrent.futures import Future, ProcessPoolExecutor, as_completed
+
+from isa import Instruction
+from control_unit import OVERFLOW_MODES, ControlUnit
+from machine import ENGINES, load_program, simulate
+from microcode import CONTROL_UNITS
+from program_cache import open_cache
+
+# Пакетный запуск множества пар (программа, ввод).
+#
+# Манифест - файл JSON Lines, по заданию на строку:
+#   {"id": "cat-1", "program": "cat.code", "input": "in.txt", "engine": "jit",
+#    "max_ticks": 100000, "max_instructions": 50000, "overflow": "wrap", "control_unit": "hardwired"}
+# Вместо "input" можно указать ввод строкой в "stdin". "id", "engine", лимиты,
+# режим переполнения и устройство управления необязательны, значения по
+# умолчанию задаются флагами командной строки. Относительные пути программы и
+# ввода отсчитываются от каталога манифеста.
+# Каждая программа декодируется один раз в основном процессе и передается
+# рабочим процессам при их запуске. Результаты выводятся в JSON Lines по мере готовности.
+# С --lockstep задания с одной программой, одинаковыми лимитами и режимом
+# переполнения моделируются вместе в lockstep.py (NumPy), в основном процессе.
+
+Program = tuple[list[Instruction], dict[int, list[int]]]
+
+# декодированные программы рабочего процесса
+_programs: dict[str, Program] = {}
+
+
+def _init_worker(programs: dict[str, Program]):
+    global _programs
+    _programs = programs
+
+
+def run_job(job: dict, programs: dict[str, Program] | None = None) -> dict:
+    program, data = (programs if programs is not None else _programs)[job['program']]
+    unit_name = job.get('control_unit', 'hardwired')
+    result = {'id': job['id'], 'program': job['program'], 'engine': job['engine'], 'control_unit': unit_name}
+    start = time.perf_counter()
+    control_unit = None
+    unit: type[ControlUnit] = CONTROL_UNITS[unit_name]
+    try:
+        if 'stdin' in job:
+            control_unit = unit(io.StringIO(job['stdin']), program, data, overflow=job.get('overflow'))
+            reason = simulate(control_unit, job['engine'], job.get('max_ticks'), job.get('max_instructions'))
+        else:
+            with open(job['input']) as inp:
+                control_unit = unit(inp, program, data, overflow=job.get('overflow'))
+                reason = simulate(control_unit, job['engine'], job.get('max_ticks'), job.get('max_instructions'))
+    except Exception as e:
+        reason = 'error'
+        result['error'] = f"{type(e).__name__}: {e}"
+    result['exit'] = reason
+    result['wall_time'] = time.perf_counter() - start
+    if control_unit is not None:
+        result['ticks'] = control_unit.tick_cnt
+        result['instructions'] = control_unit.instr_cnt
+        result['stdout'] = "".join(control_unit.datapath.output.output_buffer)
+    return result
+
+
+# base - каталог манифеста, от которого отсчитываются относительные пути
+def read_manifest(lines, defaults: dict, base: str = '') -> list[dict]:
+    jobs: list[dict] = []
+    for number, line in enumerate(lines):
+        if not line.strip():
+            continue
+        job = {**defaults, **json.loads(line)}
+        assert 'program' in job, f"Задание {number}: не указана программа"
+        assert 'input' in job or 'stdin' in job, f"Задание {number}: не указан ввод"
+        assert job['engine'] in ENGINES, f"Задание {number}: неизвестный режим {job['engine']}"
+        assert job.get('control_unit', 'hardwired') in CONTROL_UNITS, \
+            f"Задание {number}: неизвестное устройство управления {job['control_unit']}"
+        job['program'] = os.path.join(base, job['program'])
+        if 'input' in job:
+            job['input'] = os.path.join(base, job['input'])
+        job.setdefault('id', str(number))
+        jobs.append(job)
+    return jobs
+
+
+def run_lockstep_jobs(jobs: list[dict], programs: dict[str, Program]):
+    # NumPy нужен только этому режиму
+    from lockstep import run_lockstep
+
+    groups: dict[tuple, list[dict]] = {}
+    for job in jobs:
+        key = (job['program'], job.get('max_ticks'), job.get('max_instructions'), job.get('overflow'))
+        groups.setdefault(key, []).append(job)
+    for (path, max_ticks, max_instructions, overflow), group in groups.items():
+        inputs: list[str] = []
+        for job in group:
+            if 'stdin' in job:
+                inputs.append(job['stdin'])
+            else:
+                with open(job['input']) as inp:
+                    inputs.append(inp.read())
+        start = time.perf_counter()
+        program, data = programs[path]
+        results = run_lockstep(program, data, inputs, max_ticks, max_instructions, overflow)
+        # время моделирования группы делится поровну между заданиями
+        wall_time = (time.perf_counter() - start) / len(group)
+        for job, res in zip(group, results):
+            yield {'id': job['id'], 'program': path, 'engine': 'lockstep', **res, 'wall_time': wall_time}
+
+
+def run_batch(jobs: list[dict], workers: int | None = None, lockstep: bool = False, cache_dir: str | None = None):
+    cache = open_cache(cache_dir)
+    programs: dict[str, Program] = {}
+    for job in jobs:
+        if job['program'] not in programs:
+            programs[job['program']] = load_program(job['program'], cache)
+
+    if lockstep:
+        yield from run_lockstep_jobs(jobs, programs)
+        return
+
+    if workers == 1:
+        for job in jobs:
+            yield run_job(job, programs)
+        return
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(programs,)) as pool:
+        futures: list[Future] = [pool.submit(run_job, job) for job in jobs]
+        for future in as_completed(futures):
+            yield future.result()
+
+
+def main(args: list[str]):
+    parser = argparse.ArgumentParser(prog="batch.py")
+    parser.add_argument("manifest", help="файл заданий JSON Lines, '-' - stdin")
+    parser.add_argument("-o", "--output", help="файл результатов JSON Lines, по умолчанию stdout")
+    parser.add_argument("-j", "--workers", type=int, default=None, help="число процессов, по умолчанию по числу ядер")
+    parser.add_argument("--engine", choices=ENGINES, default='jit')
+    parser.add_argument("--lockstep", action="store_true",
+                        help="моделировать задания с одной программой вместе (NumPy), engine и control_unit заданий не учитываются")
+    parser.add_argument("--cache", metavar="DIR", help="каталог кэша декодированных программ (по умолчанию $CSA_CACHE_DIR)")
+    parser.add_argument("--max-ticks", type=int, default=None)
+    parser.add_argument("--max-instructions", type=int, default=None)
+    parser.add_argument("--overflow", choices=OVERFLOW_MODES, default=None, help="режим переполнения, по умолчанию config.OVERFLOW")
+    parser.add_argument("--control-unit", choices=list(CONTROL_UNITS), default='hardwired',
+                        help="устройство управления по умолчанию: hardwired - схемное, microcode - микропрограммное")
+    options = parser.parse_args(args)
+
+    defaults = {'engine': options.engine, 'max_ticks': options.max_ticks, 'max_instructions': options.max_instructions,
+                'overflow': options.overflow, 'control_unit': options.control_unit}
+    if options.manifest == '-':
+        jobs = read_manifest(sys.stdin, defaults)
+    else:
+        with open(options.manifest) as file:
+            jobs = read_manifest(file, defaults, os.path.dirname(options.manifest))
+
+    out = open(options.output, 'w') if options.output else sys.stdout
+    try:
+        for result in run_batch(jobs, options.workers, options.lockstep, options.cache):
+            out.write(json.dumps(result, ensure_ascii=False) + '\n')
+            out.flush()
+    finally:
+        if out is not sys.stdout:
+            out.close()
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
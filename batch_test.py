@@ -0,0 +1,42 @@
+import json
+import os
+
+import batch
+import translator
+from isa import data_runs
+
+# Пакетный запуск: пути манифеста относительно его каталога, устройство управления задания
+
+
+def write_program(path: str, source: str):
+    translated = translator.translate(source)
+    with open(path, 'w') as file:
+        file.write(translator.code_text(translator.machine_code(translated), data_runs(translated.data)))
+
+
+def test_manifest(tmp_path, monkeypatch, capsys):
+    root = os.path.dirname(os.path.abspath(__file__))
+    with open(os.path.join(root, 'resources', 'src', 'cat.asm')) as file:
+        source = file.read()
+    jobs = tmp_path / 'jobs'
+    (jobs / 'programs').mkdir(parents=True)
+    write_program(str(jobs / 'programs' / 'cat.code'), source)
+    (jobs / 'in.txt').write_text('abc\n')
+    manifest = [
+        {'id': 'file', 'program': 'programs/cat.code', 'input': 'in.txt'},
+        {'id': 'hardwired', 'program': 'programs/cat.code', 'stdin': 'xy\n', 'engine': 'tick'},
+        {'id': 'microcode', 'program': 'programs/cat.code', 'stdin': 'xy\n', 'engine': 'tick',
+         'control_unit': 'microcode'},
+    ]
+    (jobs / 'manifest.jsonl').write_text("".join(json.dumps(job) + '\n' for job in manifest))
+
+    # запуск из другого каталога
+    monkeypatch.chdir(tmp_path)
+    batch.main([os.path.join('jobs', 'manifest.jsonl'), '-j', '1'])
+    results = {res['id']: res for res in map(json.loads, capsys.readouterr().out.splitlines())}
+
+    assert results['file']['exit'] == 'halt' and results['file']['stdout'] == 'abc\n'
+    assert results['hardwired']['control_unit'] == 'hardwired'
+    assert results['microcode']['control_unit'] == 'microcode'
+    for key in ('exit', 'ticks', 'instructions', 'stdout'):
+        assert results['microcode'][key] == results['hardwired'][key]
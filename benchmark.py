@@ -0,0 +1,245 @@
+import argparse
+import io
+import json
+import sys
+import time
+import tracemalloc
+from typing import Callable
+
+import translator
+from optimizer import optimize
+from control_unit import ControlUnit
+from isa import data_runs
+from machine import ENGINES, simulate
+
+# Бенчмарк пропускной способности модели на сгенерированных программах.
+#
+# Для каждой нагрузки и режима моделирования измеряются время трансляции,
+# такты и инструкции в секунду (лучшее из --repeat прогонов), пиковая память
+# (tracemalloc, отдельным прогоном).
+# Результаты можно сохранить как базовую линию и сравнивать с ней: запуск
+# завершается с кодом 1, если скорость упала больше чем на --threshold.
+
+
+# --генераторы нагрузок: размер -> (исходный код, ввод)--
+def arith_loop(n: int) -> tuple[str, str]:
+    return f"""section .text:
+    .loop
+    LD DIRECT n
+    DEC
+    ST IMMEDIATE n
+    ADD DIRECT sum
+    REM IMMEDIATE 1000003
+    ST IMMEDIATE sum
+    LD DIRECT n
+    JNZ DIRECT .loop
+    HLT
+section .data:
+    n:{n}
+    sum:0
+""", ""
+
+
+def memory_walk(n: int) -> tuple[str, str]:
+    return f"""section .text:
+    LD IMMEDIATE buf
+    ST IMMEDIATE p
+    LD INDIRECT p
+    .loop
+    ADD DIRECT sum
+    ST IMMEDIATE sum
+    LD DIRECT p
+    INC
+    ST IMMEDIATE p
+    LD INDIRECT p
+    JNZ DIRECT .loop
+    HLT
+section .data:
+    buf:"{'abcdefgh' * (n // 8)}"
+    p:0
+    sum:0
+""", ""
+
+
+def io_stream(n: int) -> tuple[str, str]:
+    return """section .text:
+    .loop
+    LD DIRECT #STDIN
+    ST IMMEDIATE #STDOUT
+    JMP DIRECT .loop
+""", "abcdefghijklmnopqrstuvwxyz\n" * (n // 27)
+
+
+def data_section(n: int) -> tuple[str, str]:
+    strings = "\n".join(f'    s{i}:"{"x" * 100}"' for i in range(n // 100))
+    return f"""section .text:
+    LD DIRECT s0
+    ST IMMEDIATE #STDOUT
+    HLT
+section .data:
+{strings}
+""", ""
+
+
+# Большой исходный код для замера трансляции: count строк кода и данных,
+# метки через каждые 50 строк с переходами вперед и назад
+def large_source(count: int) -> str:
+    text: list[str] = []
+    data: list[str] = []
+    for i in range(count // 2):
+        if i % 50 == 0:
+            text.append(f"    .l{i}")
+            text.append(f"    JNZ DIRECT .l{i + 50 if i + 50 < count // 2 else 0}")
+        text.append(f"    ADD DIRECT v{i % 1000}")
+    for i in range(count // 2):
+        data.append(f"    v{i}:{i}" if i % 3 else f'    v{i}:"str, {i}"')
+    return "section .text:\n" + "\n".join(text) + "\n    HLT\nsection .data:\n" + "\n".join(data) + "\n"
+
+
+WORKLOADS: dict[str, tuple[Callable[[int], tuple[str, str]], int]] = {
+    'arith_loop': (arith_loop, 20000),
+    'memory_walk': (memory_walk, 20000),
+    'io_stream': (io_stream, 20000),
+    'data_section': (data_section, 100000),
+}
+
+
+# замеры короче этого времени слишком шумные для сравнения с базовой линией
+MIN_TIME = 0.01
+
+
+def measure(name: str, engine: str, scale: float, memory: bool, repeat: int = 3, optimized: bool = False) -> dict:
+    generator, size = WORKLOADS[name]
+    source, stdin = generator(max(1, int(size * scale)))
+
+    translate_time = run_time = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        translated = translator.translate(source)
+        if optimized:
+            optimize(translated)
+        translate_time = min(translate_time, time.perf_counter() - start)
+        program, data = translator.machine_code(translated), data_runs(translated.data)
+
+        start = time.perf_counter()
+        control_unit = ControlUnit(io.StringIO(stdin), program, data)
+        reason = simulate(control_unit, engine)
+        run_time = min(run_time, time.perf_counter() - start)
+
+    result = {
+        'workload': name,
+        'engine': engine,
+        'optimized': optimized,
+        'size': int(size * scale),
+        'exit': reason,
+        'ticks': control_unit.tick_cnt,
+        'instructions': control_unit.instr_cnt,
+        'translate_time': translate_time,
+        'run_time': run_time,
+        'ticks_per_sec': control_unit.tick_cnt / run_time if run_time else 0.0,
+        'instructions_per_sec': control_unit.instr_cnt / run_time if run_time else 0.0,
+    }
+    if memory:
+        tracemalloc.start()
+        control_unit = ControlUnit(io.StringIO(stdin), program, data)
+        simulate(control_unit, engine)
+        result['peak_memory'] = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return result
+
+
+# Время трансляции исходников разного размера. Трансляция линейна, если время
+# на строку на самом большом исходнике не больше чем в max_ratio раз выше, чем на самом маленьком
+def translate_scaling(sizes: list[int], repeat: int = 3) -> list[dict]:
+    results: list[dict] = []
+    for size in sizes:
+        source = large_source(size)
+        best = float('inf')
+        for _ in range(repeat):
+            start = time.perf_counter()
+            translator.translate(source)
+            best = min(best, time.perf_counter() - start)
+        lines = source.count("\n")
+        results.append({'lines': lines, 'translate_time': best, 'us_per_line': best / lines * 1e6})
+    return results
+
+
+# Сравнение с базовой линией, возвращает список регрессий
+def compare(results: list[dict], baseline: list[dict], threshold: float) -> list[str]:
+    base = {(r['workload'], r['engine'], r['size'], r.get('optimized', False)): r for r in baseline}
+    problems: list[str] = []
+    for r in results:
+        b = base.get((r['workload'], r['engine'], r['size'], r['optimized']))
+        if b is None:
+            continue
+        key = f"{r['workload']}/{r['engine']}"
+        if r['ticks'] != b['ticks']:
+            problems.append(f"{key}: ticks changed {b['ticks']} -> {r['ticks']}")
+        if b['run_time'] >= MIN_TIME and r['ticks_per_sec'] < b['ticks_per_sec'] * (1 - threshold):
+            problems.append(f"{key}: ticks/sec {b['ticks_per_sec']:.0f} -> {r['ticks_per_sec']:.0f}")
+        if b['translate_time'] >= MIN_TIME and r['translate_time'] > b['translate_time'] * (1 + threshold):
+            problems.append(f"{key}: translate time {b['translate_time']:.4f}s -> {r['translate_time']:.4f}s")
+    return problems
+
+
+def report(results: list[dict]) -> str:
+    lines = [f"{'workload':<14} {'engine':<6} {'ticks':>10} {'ticks/s':>12} {'instr/s':>12} {'translate,s':>12} {'peak,KiB':>10}"]
+    for r in results:
+        peak = f"{r['peak_memory'] / 1024:.0f}" if 'peak_memory' in r else '-'
+        lines.append(
+            f"{r['workload']:<14} {r['engine']:<6} {r['ticks']:>10} {r['ticks_per_sec']:>12.0f} "
+            f"{r['instructions_per_sec']:>12.0f} {r['translate_time']:>12.4f} {peak:>10}"
+        )
+    return "\n".join(lines)
+
+
+def main(args: list[str]) -> int:
+    parser = argparse.ArgumentParser(prog="benchmark.py")
+    parser.add_argument("--workloads", nargs='+', choices=list(WORKLOADS), default=list(WORKLOADS))
+    parser.add_argument("--engines", nargs='+', choices=ENGINES, default=list(ENGINES))
+    parser.add_argument("--scale", type=float, default=1.0, help="множитель размера нагрузок")
+    parser.add_argument("--repeat", type=int, default=3, help="число повторов, берется лучшее время")
+    parser.add_argument("--no-memory", action="store_true", help="не измерять пиковую память")
+    parser.add_argument("--output", help="записать результаты в JSON")
+    parser.add_argument("--save-baseline", metavar="PATH", help="сохранить результаты как базовую линию")
+    parser.add_argument("--baseline", metavar="PATH", help="сравнить с базовой линией")
+    parser.add_argument("--threshold", type=float, default=0.2, help="допустимое замедление, доля")
+    parser.add_argument("--optimize", action="store_true", help="транслировать нагрузки с оптимизацией окном")
+    parser.add_argument("--translate-scaling", nargs='*', type=int, metavar="LINES",
+                        help="только замер линейности трансляции на исходниках заданного размера")
+    options = parser.parse_args(args)
+
+    if options.translate_scaling is not None:
+        sizes = options.translate_scaling or [12500, 25000, 50000, 100000]
+        scaling = translate_scaling(sorted(sizes), options.repeat)
+        print(f"{'lines':>10} {'translate,s':>12} {'us/line':>10}")
+        for r in scaling:
+            print(f"{r['lines']:>10} {r['translate_time']:>12.4f} {r['us_per_line']:>10.2f}")
+        ratio = scaling[-1]['us_per_line'] / scaling[0]['us_per_line']
+        print(f"time per line ratio: {ratio:.2f}")
+        return 1 if ratio > 2 else 0
+
+    results = [
+        measure(name, engine, options.scale, not options.no_memory, options.repeat, options.optimize)
+        for name in options.workloads
+        for engine in options.engines
+    ]
+    print(report(results))
+
+    for path in (options.output, options.save_baseline):
+        if path is not None:
+            with open(path, 'w') as file:
+                json.dump(results, file, indent=2)
+
+    if options.baseline is not None:
+        with open(options.baseline) as file:
+            problems = compare(results, json.load(file), options.threshold)
+        for problem in problems:
+            print("REGRESSION:", problem)
+        if problems:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -1,4 +1,8 @@
 from enum import Enum
 
 # Длина машинного слова
-WORD_SIZE: int = 32
\ No newline at end of file
+WORD_SIZE: int = 32
+
+# Поведение при знаковом переполнении слова: 'wrap' - результат берется по
+# модулю 2^WORD_SIZE, 'trap' - моделирование останавливается с ошибкой
+OVERFLOW: str = 'wrap'
@@ -2,9 +2,14 @@ from __future__ import annotations
 
 import enum
 import logging
+from typing import Callable, TextIO
 
+from config import OVERFLOW, WORD_SIZE
 from isa import ArgType, Instruction, Opcode
-from datapath import DataPath
+from datapath import RAM, DataPath, EndOfInput
+from dcache import DataCache
+from interrupts import InputSchedule
+from tracing import LoggingTracer, Tracer
 
 
 class LogicError(Exception):
@@ -12,6 +17,71 @@ class LogicError(Exception):
         super().__init__(message)
 
 
+class WordOverflow(Exception):
+    def __init__(self, opcode: Opcode, value: int) -> None:
+        super().__init__(f"{opcode.name}: результат {value} не помещается в {WORD_SIZE} бит")
+
+
+# --машинное слово--
+# Значения в ACC и операнды АЛУ - знаковые слова WORD_SIZE бит
+WORD_MASK = (1 << WORD_SIZE) - 1
+SIGN_BIT = 1 << (WORD_SIZE - 1)
+WORD_MIN, WORD_MAX = -SIGN_BIT, SIGN_BIT - 1
+OVERFLOW_MODES = ('wrap', 'trap')
+
+
+def sign_extend(value: int) -> int:
+    return ((value & WORD_MASK) ^ SIGN_BIT) - SIGN_BIT
+
+
+def to_unsigned(value: int) -> int:
+    return value & WORD_MASK
+
+
+# Операции АЛУ: (acc, arg) -> значение, которое защелкивается в аккумулятор и по которому ставятся флаги
+ALU_OPERATIONS: dict[Opcode, Callable[[int, int], int]] = {
+    Opcode.INC: lambda acc, arg: acc + 1,
+    Opcode.DEC: lambda acc, arg: acc - 1,
+    Opcode.LD: lambda acc, arg: arg,
+    Opcode.ADD: lambda acc, arg: acc + arg,
+    Opcode.SUB: lambda acc, arg: acc - arg,
+    Opcode.MUL: lambda acc, arg: acc * arg,
+    Opcode.DIV: lambda acc, arg: acc // arg,
+    Opcode.REM: lambda acc, arg: acc % arg,
+    Opcode.NEG: lambda acc, arg: -acc,
+    Opcode.AND: lambda acc, arg: acc & arg,
+    Opcode.OR: lambda acc, arg: acc | arg,
+    Opcode.NOT: lambda acc, arg: acc == 0,
+}
+
+# Перенос (заем) по беззнаковым значениям слов; для MUL перенос совпадает с переполнением,
+# у остальных операций АЛУ флаг C сбрасывается
+ALU_CARRY: dict[Opcode, Callable[[int, int], bool]] = {
+    Opcode.INC: lambda acc, arg: acc == WORD_MASK,
+    Opcode.DEC: lambda acc, arg: acc == 0,
+    Opcode.ADD: lambda acc, arg: acc + arg > WORD_MASK,
+    Opcode.SUB: lambda acc, arg: acc < arg,
+    Opcode.CMP: lambda acc, arg: acc < arg,
+    Opcode.NEG: lambda acc, arg: acc != 0,
+}
+
+# Такты цикла выборки операнды (см. ControlUnit.arg_fetch)
+ARG_FETCH_TICKS: dict[ArgType, int] = {
+    ArgType.IMMEDIATE: 0,
+    ArgType.DIRECT: 1,
+    ArgType.INDIRECT: 2,
+}
+
+# Полная стоимость инструкции в тактах: выборка + выборка операнды + исполнение.
+# HLT останавливает машину внутри такта исполнения, и этот такт не засчитывается.
+# Инструкции без аргумента (arg is None) считаются как IMMEDIATE.
+INSTRUCTION_TICKS: dict[tuple[Opcode, ArgType], int] = {
+    (opcode, arg_type): 1 + ARG_FETCH_TICKS[arg_type] + (0 if opcode == Opcode.HLT else 1)
+    for opcode in Opcode
+    for arg_type in ArgType
+}
+
+
 class ControlUnit:
     class Stage(enum.Enum):
         INSTR_FETCH = 0
@@ -21,41 +91,73 @@ class ControlUnit:
     class PCMux(enum.Enum):
         INC = 1
         ARG = 2
+        # адрес обработчика прерывания или адрес возврата из него (int_addr)
+        INT = 3
 
     class ArgMux(enum.Enum):
         IMM = 1
         DATA = 2
 
-    def __init__(self, input_buffer: list[str], program: list[Instruction]) -> None:
-        self.datapath = DataPath(input_buffer)
+    def __init__(self, input_buffer: TextIO | list[str] | InputSchedule, program: list[Instruction],
+                 data: dict[int, list[int]] | None = None, output: TextIO | None = None,
+                 tracer: Tracer | None = None, overflow: str | None = None, cache: DataCache | None = None) -> None:
+        # по умолчанию текстовый лог, и только если включен уровень DEBUG
+        if tracer is None and logging.getLogger().isEnabledFor(logging.DEBUG):
+            tracer = LoggingTracer()
+        self.tracer: Tracer | None = tracer
+        self.overflow: str = OVERFLOW if overflow is None else overflow
+        assert self.overflow in OVERFLOW_MODES, f"Неизвестный режим переполнения: {self.overflow}"
+        self.datapath = DataPath(input_buffer, tracer, data, output)
 
         self.sel_arg: ControlUnit.ArgMux = ControlUnit.ArgMux.IMM
         self.sel_next: ControlUnit.PCMux = ControlUnit.PCMux.INC
 
         self.tick_cnt: int = 0
+        # число выбранных инструкций
+        self.instr_cnt: int = 0
 
         self.step_cnt: int = 0
         self.stage: ControlUnit.Stage = ControlUnit.Stage.INSTR_FETCH
 
+        # прерывания: источник событий ввода (расписание, подключается после секции preload),
+        # разрешение, ожидание в HLT, сохраненные при входе PC, ACC и флаги N, Z, V, C
+        self.events: InputSchedule | None = None
+        self.ie: bool = False
+        self.waiting: bool = False
+        self.saved: tuple[int, int, bool, bool, bool, bool] | None = None
+        self.int_addr: int = 0
+
         self.program_counter: int = -1
         self.program: list[Instruction] = program
 
-        # добавляем в память переменные и метки
-        program_offset = self.prepare_for_work()
-        self.program = self.program[self.program_counter:]
-        self.program_counter -= self.program_counter
+        # добавляем в память переменные и метки (режим совместимости с секцией preload)
+        # и выбираем маркер program
+        self.prepare_for_work()
         self.tick_cnt = 0
+        self.instr_cnt = 0
+        # кэш данных подключается после секции preload, ее обращения не учитываются
+        self.datapath.cache = cache
+        if isinstance(input_buffer, InputSchedule):
+            self.events = input_buffer
 
         self.N: bool = False
         self.Z: bool = True
-
-    def prepare_for_work(self) -> int:
-        if (self.program[0].opcode == Opcode.preload):
-            while self.program[self.program_counter].opcode != Opcode.program:
+        # переполнение (знаковое) и перенос (беззнаковый) последней операции АЛУ
+        self.V: bool = False
+        self.C: bool = False
+
+    def prepare_for_work(self):
+        if (self.program[0].opcode != Opcode.preload):
+            # с образом данных маркер program тоже выбирается до начала счета тактов,
+            # чтобы такты и число инструкций совпадали с режимом preload
+            if self.program and self.program[0].opcode == Opcode.program:
                 self.execute_next()
             return
-        else:
-            return 0
+        while self.program[self.program_counter].opcode != Opcode.program:
+            self.execute_next()
+        # программа начинается с уже выбранного маркера program
+        self.program = self.program[self.program_counter:]
+        self.program_counter = 0
 
     def get_arg(self) -> int:
         if self.sel_arg == ControlUnit.ArgMux.IMM:
@@ -74,19 +176,79 @@ class ControlUnit:
             self.program_counter += 1
         if self.sel_next == ControlUnit.PCMux.ARG:
             self.program_counter = self.get_arg()
+        if self.sel_next == ControlUnit.PCMux.INT:
+            self.program_counter = self.int_addr
+
+    # Адрес следующей инструкции, как его выберет latch_pc. Вызывается между инструкциями (этап INSTR_FETCH)
+    def next_pc(self) -> int:
+        if self.sel_next == ControlUnit.PCMux.INC:
+            return self.program_counter + 1
+        return self.get_arg() if self.sel_next == ControlUnit.PCMux.ARG else self.int_addr
+
+    # Граница инструкций (перед выборкой, только с расписанием ввода): доставка событий,
+    # пришедших к текущему такту, и вход в прерывание. Запрос держится, пока в устройстве
+    # ввода есть непрочитанные символы. Вход - в такте выборки: PC, ACC и флаги
+    # сохраняются, прерывания запрещаются, мультиплексор PC выбирает адрес обработчика
+    # из ячейки DataPath.VECTOR_ADDR. В ожидании (HLT) часы переводятся сразу на
+    # такт ближайшего события
+    def poll_interrupts(self):
+        events = self.events
+        if self.waiting:
+            self.waiting = False
+            self.tick_cnt = max(self.tick_cnt, events.next_tick())
+        events.deliver(self.tick_cnt)
+        if not self.ie or not (events.arrived or self.datapath.input.input_buffer):
+            return
+        # вектор читает контроллер прерываний, в обход шины
+        vector = RAM.read(self.datapath.mem, DataPath.VECTOR_ADDR)
+        if vector == 0:
+            raise LogicError(message="Interrupt vector is not set")
+        self.saved = (self.next_pc(), self.datapath.acc, self.N, self.Z, self.V, self.C)
+        self.ie = False
+        self.int_addr = vector
+        self.sel_next = ControlUnit.PCMux.INT
+
+    # HLT ждет прерывания, а не останавливает машину: прерывания разрешены и события еще будут
+    def can_wait(self) -> bool:
+        return self.ie and self.events is not None and len(self.events) > 0
+
+    # IRET: восстановление PC, ACC и флагов, сохраненных при входе в прерывание
+    def interrupt_return(self):
+        if self.saved is None:
+            raise LogicError(message="IRET outside of interrupt handler")
+        self.int_addr, acc, self.N, self.Z, self.V, self.C = self.saved
+        self.saved = None
+        self.datapath.set_acc_in(acc)
+        self.sel_next = ControlUnit.PCMux.INT
+        self.ie = True
+
+    # Прочитает ли ввод следующая инструкция
+    def next_reads_input(self) -> bool:
+        pc = self.next_pc()
+        if not 0 <= pc < len(self.program):
+            return False
+        instr = self.program[pc]
+        if instr.arg is None or instr.arg_type == ArgType.IMMEDIATE:
+            return False
+        # как в DataPath.fetch_operand: устройство читается только по адресу из
+        # инструкции, указатель на #STDIN лишь выставляет адрес и ввод не читает
+        return instr.arg == DataPath.INPUT_ADDR
 
     def next_stage(self):
         self.stage = ControlUnit.Stage((self.stage.value + 1) % len(ControlUnit.Stage))
         self.step_cnt = 0
 
     def instr_fetch(self) -> int:
+        if self.events is not None:
+            self.poll_interrupts()
         # rise
         self.datapath.set_acc_out(False)
         self.datapath.set_oe(False)
         self.datapath.set_wr(False)
         self.latch_pc()
-        logging.debug("")
-        logging.debug(f"Fetched: {self.program[self.program_counter]}")
+        self.instr_cnt += 1
+        if self.tracer is not None:
+            self.tracer.fetched(self.program[self.program_counter])
         # fall
         self.sel_next = ControlUnit.PCMux.INC
         self.sel_arg = ControlUnit.ArgMux.IMM
@@ -98,7 +260,8 @@ class ControlUnit:
         instr = self.program[self.program_counter]
 
         if instr.arg is None or instr.arg_type == ArgType.IMMEDIATE:
-            logging.debug("Arg fetch stage skipped")
+            if self.tracer is not None:
+                self.tracer.arg_skipped()
             self.next_stage()
             return 0
 
@@ -108,19 +271,22 @@ class ControlUnit:
             # fall
             self.sel_arg = ControlUnit.ArgMux.DATA
             self.datapath.set_oe(True)
+            # промах кэша продлевает такт
+            stall = self.datapath.cache_access(self.datapath.data_address)
 
             if instr.arg_type == ArgType.INDIRECT:
                 self.step_cnt += 1
             else:
                 self.next_stage()
 
-            return 1
+            return 1 + stall
 
         if self.step_cnt == 1 and instr.arg_type == ArgType.INDIRECT:
             # rise
             self.datapath.latch_data_addr(self.get_arg())
+            stall = self.datapath.cache_access(self.datapath.data_address)
             self.next_stage()
-            return 1
+            return 1 + stall
 
         raise LogicError(message=f"Illegal combination of step({self.step_cnt}) and ArgType({instr.arg_type.name})")
 
@@ -128,103 +294,153 @@ class ControlUnit:
         self.Z = val == 0
         self.N = val < 0
 
+    # Операция АЛУ над словами: результат по модулю 2^WORD_SIZE, флаги V и C.
+    # В режиме trap переполнение при записи в ACC останавливает моделирование
+    def alu(self, opcode: Opcode, acc: int, arg: int) -> int:
+        exact = ALU_OPERATIONS[opcode](sign_extend(acc), sign_extend(arg))
+        res = sign_extend(exact)
+        self.V = res != exact
+        carry = ALU_CARRY.get(opcode)
+        self.C = self.V if opcode == Opcode.MUL else carry is not None and carry(to_unsigned(acc), to_unsigned(arg))
+        if self.V and self.overflow == 'trap':
+            raise WordOverflow(opcode, exact)
+        return res
+
     def execute(self) -> int:
         instr = self.program[self.program_counter]
         to_acc = False
-        match instr.opcode:
-            case Opcode.INC:
-                self.datapath.set_acc_in(self.datapath.get_acc() + 1)
-                self.set_flags(self.datapath.get_acc() + 1)
-                to_acc = True
-            case Opcode.DEC:
-                self.datapath.set_acc_in(self.datapath.get_acc() - 1)
-                self.set_flags(self.datapath.get_acc() - 1)
-                to_acc = True
-            case Opcode.JMP:
-                self.sel_next = ControlUnit.PCMux.ARG
-            case Opcode.JZ:
-                if self.Z:
-                    self.sel_next = ControlUnit.PCMux.ARG
-            case Opcode.JNZ:
-                if not self.Z:
+        stall = 0
+        if instr.opcode in ALU_OPERATIONS:
+            res = self.alu(instr.opcode, self.datapath.get_acc(), self.get_arg())
+            self.datapath.set_acc_in(res)
+            self.set_flags(res)
+            to_acc = True
+        else:
+            # операции АЛУ не совпадают ни с одним вариантом ниже, сравнения для них не нужны
+            match instr.opcode:
+                case Opcode.JMP:
                     self.sel_next = ControlUnit.PCMux.ARG
-            case Opcode.SETG:
-                self.datapath.set_acc_in(not self.Z and not self.N)
-                self.set_flags(not self.Z and not self.N)
-                to_acc = True
-            case Opcode.SETL:
-                self.datapath.set_acc_in(not self.Z and self.N)
-                self.set_flags(not self.Z and self.N)
-                to_acc = True
-            case Opcode.SETE:
-                self.datapath.set_acc_in(self.Z and not self.N)
-                self.set_flags(self.Z and not self.N)
-                to_acc = True
-            case Opcode.CMP:
-                self.set_flags(self.datapath.get_acc() - self.get_arg())
-            case Opcode.LD:
-                self.datapath.set_acc_in(self.get_arg())
-                self.set_flags(self.get_arg())
-                to_acc = True
-            case Opcode.ST:
-                # rise
-                self.datapath.latch_data_addr(self.get_arg())
-                self.datapath.set_oe(False)
-                self.datapath.set_acc_out(True)
-                # fall
-                self.datapath.set_wr(True)
-            case Opcode.ADD:
-                self.datapath.set_acc_in(self.datapath.get_acc() + self.get_arg())
-                self.set_flags(self.datapath.get_acc() + self.get_arg())
-                to_acc = True
-            case Opcode.SUB:
-                self.datapath.set_acc_in(self.datapath.get_acc() - self.get_arg())
-                self.set_flags(self.datapath.get_acc() - self.get_arg())
-                to_acc = True
-            case Opcode.MUL:
-                self.datapath.set_acc_in(self.datapath.get_acc() * self.get_arg())
-                self.set_flags(self.datapath.get_acc() * self.get_arg())
-                to_acc = True
-            case Opcode.DIV:
-                self.datapath.set_acc_in(self.datapath.get_acc() // self.get_arg())
-                self.set_flags(self.datapath.get_acc() // self.get_arg())
-                to_acc = True
-            case Opcode.REM:
-                self.datapath.set_acc_in(self.datapath.get_acc() % self.get_arg())
-                self.set_flags(self.datapath.get_acc() % self.get_arg())
-                to_acc = True
-            case Opcode.NEG:
-                self.datapath.set_acc_in(-self.datapath.get_acc())
-                self.set_flags(-self.datapath.get_acc())
-                to_acc = True
-            case Opcode.AND:
-                self.datapath.set_acc_in(self.datapath.get_acc() & self.get_arg())
-                self.set_flags(self.datapath.get_acc() & self.get_arg())
-                to_acc = True
-            case Opcode.NOT:
-                res = self.datapath.get_acc() == 0
-                self.datapath.set_acc_in(res)
-                self.set_flags(res)
-                to_acc = True
-            case Opcode.OR:
-                self.datapath.set_acc_in(self.datapath.get_acc() | self.get_arg())
-                self.set_flags(self.datapath.get_acc() | self.get_arg())
-                to_acc = True
-            case Opcode.HLT:
-                raise StopIteration()
+                case Opcode.JZ:
+                    if self.Z:
+                        self.sel_next = ControlUnit.PCMux.ARG
+                case Opcode.JNZ:
+                    if not self.Z:
+                        self.sel_next = ControlUnit.PCMux.ARG
+                case Opcode.SETG:
+                    self.datapath.set_acc_in(not self.Z and not self.N)
+                    self.set_flags(not self.Z and not self.N)
+                    self.V = self.C = False
+                    to_acc = True
+                case Opcode.SETL:
+                    self.datapath.set_acc_in(not self.Z and self.N)
+                    self.set_flags(not self.Z and self.N)
+                    self.V = self.C = False
+                    to_acc = True
+                case Opcode.SETE:
+                    self.datapath.set_acc_in(self.Z and not self.N)
+                    self.set_flags(self.Z and not self.N)
+                    self.V = self.C = False
+                    to_acc = True
+                case Opcode.CMP:
+                    # CMP не пишет в ACC и не прерывается по переполнению, оно видно во флаге V
+                    acc, arg = self.datapath.get_acc(), self.get_arg()
+                    exact = sign_extend(acc) - sign_extend(arg)
+                    res = sign_extend(exact)
+                    self.V = res != exact
+                    self.C = ALU_CARRY[Opcode.CMP](to_unsigned(acc), to_unsigned(arg))
+                    self.set_flags(res)
+                case Opcode.ST:
+                    # rise
+                    self.datapath.latch_data_addr(self.get_arg())
+                    self.datapath.set_oe(False)
+                    self.datapath.set_acc_out(True)
+                    # fall
+                    self.datapath.set_wr(True)
+                    stall = self.datapath.cache_access(self.datapath.data_address, True)
+                case Opcode.HLT:
+                    if not self.can_wait():
+                        raise StopIteration()
+                    # ожидание прерывания, часы переведет poll_interrupts
+                    self.waiting = True
+                case Opcode.EI:
+                    self.ie = True
+                case Opcode.DI:
+                    self.ie = False
+                case Opcode.IRET:
+                    self.interrupt_return()
+                    to_acc = True
         if to_acc:
             self.datapath.latch_acc()
         self.next_stage()
-        return 1
+        return 1 + stall
 
+    # Исполняет такты до выборки следующей инструкции включительно
     def execute_next(self):
-        cur_op = self.program[self.program_counter].__str__()
-        #print(cur_op, ':', self.datapath.acc)
-        while (cur_op == self.program[self.program_counter].__str__()):
+        while True:
+            fetching = self.stage == ControlUnit.Stage.INSTR_FETCH
             self.tick()
+            if fetching:
+                return
+
+    # Исполнение инструкции целиком за один вызов. Сигналы DataPath выставляются в том же
+    # порядке, что и потактово, а такты начисляются по этапам сразу (с тактами промахов
+    # кэша данных); в сумме выходит INSTRUCTION_TICKS
+    def step(self):
+        if self.stage != ControlUnit.Stage.INSTR_FETCH:
+            # инструкция уже начата потактово, доводим ее до конца
+            while self.stage != ControlUnit.Stage.INSTR_FETCH:
+                self.tick()
+            return
+
+        datapath = self.datapath
+        if self.events is not None:
+            self.poll_interrupts()
+        # выборка инструкции
+        datapath.set_acc_out(False)
+        datapath.set_oe(False)
+        self.latch_pc()
+        self.instr_cnt += 1
+        self.sel_next = ControlUnit.PCMux.INC
+        self.sel_arg = ControlUnit.ArgMux.IMM
+        try:
+            instr = self.program[self.program_counter]
+        except IndexError:
+            # PC вне программы: потактово такт выборки засчитан, ошибка - на выборке операнды
+            self.tick_cnt += 1
+            self.stage = ControlUnit.Stage.ARG_FETCH
+            raise
+
+        # выборка операнды
+        arg_type = ArgType.IMMEDIATE if instr.arg is None else instr.arg_type
+        stall = 0
+        if arg_type != ArgType.IMMEDIATE:
+            try:
+                datapath.fetch_operand(instr.arg, arg_type == ArgType.INDIRECT)
+            except EndOfInput:
+                # потактово к этому моменту засчитан только такт выборки инструкции,
+                # к кэшу обращения еще не было
+                self.tick_cnt += 1
+                self.stage = ControlUnit.Stage.ARG_FETCH
+                raise
+            if datapath.cache is not None:
+                stall = datapath.cache_access(instr.arg)
+                if arg_type == ArgType.INDIRECT:
+                    stall += datapath.cache_access(datapath.data_address)
+            self.sel_arg = ControlUnit.ArgMux.DATA
+
+        # исполнение; выборка и выборка операнды засчитываются до него, как потактово,
+        # чтобы ошибка исполнения (деление на ноль, переполнение) оставила те же такты
+        self.stage = ControlUnit.Stage.EXECUTION
+        self.step_cnt = 0
+        self.tick_cnt += 1 + ARG_FETCH_TICKS[arg_type] + stall
+        if instr.opcode == Opcode.HLT and not self.can_wait():
+            raise StopIteration()
+        # execute возвращает 1 и такты промаха при записи ST
+        self.tick_cnt += self.execute()
 
     def tick(self):
-        logging.debug("%s", self)
+        if self.tracer is not None:
+            self.tracer.tick(self)
         res = 0
         match self.stage:
             case ControlUnit.Stage.INSTR_FETCH:
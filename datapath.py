@@ -1,4 +1,13 @@
-import logging
+from __future__ import annotations
+
+import io
+from array import array
+from typing import TYPE_CHECKING, TextIO
+
+if TYPE_CHECKING:
+    from dcache import DataCache
+    from interrupts import InputSchedule
+    from tracing import Tracer
 
 
 class DataBus:
@@ -6,11 +15,24 @@ class DataBus:
         self.value = 0
 
 
+class EndOfInput(Exception):
+    def __init__(self) -> None:
+        super().__init__("Input stream is exhausted")
+
+
+# Вывод копится в output_buffer. Если задан sink, буфер сбрасывается в него
+# по достижении BUFFER_SIZE символов, иначе хранится весь вывод
 class OutputDevice:
-    def __init__(self, databus: DataBus) -> None:
+    BUFFER_SIZE = 1 << 16
+
+    def __init__(self, databus: DataBus, tracer: Tracer | None = None, sink: TextIO | None = None) -> None:
         self.CS = False
         self.databus = databus
+        self.tracer = tracer
+        self.sink = sink
         self.output_buffer: list[str] = []
+        # число символов, уже сброшенных в sink
+        self.written = 0
 
     def set_cs(self, cs: bool):
         self.CS = cs
@@ -20,15 +42,32 @@ class OutputDevice:
             return
         if not self.CS:
             return
-        logging.debug(f"output: {self.output_buffer} <-- '{chr(self.databus.value)}'")
+        if self.tracer is not None:
+            self.tracer.output(self.output_buffer, chr(self.databus.value))
         self.output_buffer.append(chr(self.databus.value))
+        if self.sink is not None and len(self.output_buffer) >= self.BUFFER_SIZE:
+            self.flush()
+
+    def flush(self):
+        if self.sink is None:
+            return
+        self.sink.write("".join(self.output_buffer))
+        self.written += len(self.output_buffer)
+        self.output_buffer.clear()
+        self.sink.flush()
 
 
+# Ввод читается из потока порциями по CHUNK_SIZE символов. В input_buffer лежит
+# непрочитанный остаток текущей порции в обратном порядке
 class InputDevice:
-    def __init__(self, databus: DataBus, input_buffer: list[str]) -> None:
+    CHUNK_SIZE = 1 << 16
+
+    def __init__(self, databus: DataBus, source: TextIO | list[str] | InputSchedule, tracer: Tracer | None = None) -> None:
         self.CS = False
         self.databus = databus
-        self.input_buffer = input_buffer[::-1]
+        self.tracer = tracer
+        self.source: TextIO | InputSchedule = io.StringIO("".join(source)) if isinstance(source, list) else source
+        self.input_buffer: list[str] = []
 
     def set_cs(self, cs: bool):
         self.CS = cs
@@ -38,21 +77,93 @@ class InputDevice:
             return
         if not self.CS:
             return
+        if not self.input_buffer:
+            self.input_buffer = list(self.source.read(self.CHUNK_SIZE))[::-1]
+            if not self.input_buffer:
+                raise EndOfInput()
         self.databus.value = ord(self.input_buffer.pop())
-        logging.debug(f"input: {self.input_buffer} --> '{chr(self.databus.value)}'")
+        if self.tracer is not None:
+            self.tracer.input(self.input_buffer, chr(self.databus.value))
 
 
+# Разреженная страничная память: страницы по PAGE_SIZE слов выделяются при первой записи.
+# Значения, не помещающиеся в 64-битную ячейку страницы, хранятся отдельно в wide
 class RAM:
+    PAGE_BITS = 10
+    PAGE_SIZE = 1 << PAGE_BITS
+    PAGE_MASK = PAGE_SIZE - 1
+    CELL_TYPE = 'q'
+
     def __init__(self, databus: DataBus) -> None:
         self.CS = False
         self.OE = False
         self.databus = databus
         self.data_address = 0
-        self.mem: dict[int, int] = dict()
+        self.pages: dict[int, array] = {}
+        self.wide: dict[int, int] = {}
+        self.page_faults = 0
 
     def set_cs(self, cs: bool):
         self.CS = cs
 
+    def _page(self, page_no: int) -> array:
+        page = self.pages.get(page_no)
+        if page is None:
+            page = array(self.CELL_TYPE, [0]) * self.PAGE_SIZE
+            self.pages[page_no] = page
+            self.page_faults += 1
+        return page
+
+    def read(self, addr: int) -> int:
+        if self.wide and addr in self.wide:
+            return self.wide[addr]
+        page = self.pages.get(addr >> self.PAGE_BITS)
+        if page is None:
+            return 0
+        return page[addr & self.PAGE_MASK]
+
+    def write(self, addr: int, value: int):
+        page = self._page(addr >> self.PAGE_BITS)
+        try:
+            page[addr & self.PAGE_MASK] = value
+        except OverflowError:
+            page[addr & self.PAGE_MASK] = 0
+            self.wide[addr] = value
+            return
+        if self.wide:
+            self.wide.pop(addr, None)
+
+    def read_block(self, addr: int, count: int) -> list[int]:
+        return [self.read(addr + offset) for offset in range(count)]
+
+    def write_block(self, addr: int, words: list[int]):
+        offset = 0
+        while offset < len(words):
+            cur = addr + offset
+            start = cur & self.PAGE_MASK
+            chunk = words[offset:offset + self.PAGE_SIZE - start]
+            try:
+                self._page(cur >> self.PAGE_BITS)[start:start + len(chunk)] = array(self.CELL_TYPE, chunk)
+            except OverflowError:
+                for i, word in enumerate(chunk):
+                    self.write(cur + i, word)
+            else:
+                if self.wide:
+                    for i in range(len(chunk)):
+                        self.wide.pop(cur + i, None)
+            offset += len(chunk)
+
+    # загрузка образа сегмента данных {начальный адрес: слова} в обход шины
+    def load(self, image: dict[int, list[int]]):
+        for addr, words in image.items():
+            self.write_block(addr, words)
+
+    def resident_pages(self) -> int:
+        return len(self.pages)
+
+    def resident_bytes(self) -> int:
+        return sum(page.itemsize * len(page) for page in self.pages.values())
+
     def set_data_addr(self, addr: int):
         self.data_address = addr
         self.set_oe(self.OE)
@@ -63,31 +174,44 @@ class RAM:
             return
         if not self.CS:
             return
-        self.databus.value = self.mem.get(self.data_address, 0)
+        self.databus.value = self.read(self.data_address)
 
     def set_wr(self, wr: bool):
         if not wr:
             return
         if not self.CS:
             return
-        self.mem[self.data_address] = self.databus.value
+        self.write(self.data_address, self.databus.value)
 
 
 class DataPath:
     INPUT_ADDR = 0x10000000
     OUTPUT_ADDR = 0x10000001
+    # ячейка памяти с адресом обработчика прерывания (0 - не задан)
+    VECTOR_ADDR = 0x10000002
 
-    def __init__(self, input_buffer) -> None:
+    def __init__(self, input_buffer: TextIO | list[str] | InputSchedule, tracer: Tracer | None = None,
+                 data: dict[int, list[int]] | None = None, output: TextIO | None = None) -> None:
         self.databus = DataBus()
-        self.output = OutputDevice(self.databus)
-        self.input = InputDevice(self.databus, input_buffer)
+        self.output = OutputDevice(self.databus, tracer, output)
+        self.input = InputDevice(self.databus, input_buffer, tracer)
         self.mem = RAM(self.databus)
+        if data is not None:
+            self.mem.load(data)
 
         self.acc = 0
         self.acc_in = 0
         self.acc_out = False
 
         self.data_address = 0
+        # модель кэша данных, подключается ControlUnit; None - каждое обращение за такт
+        self.cache: DataCache | None = None
+
+    # Обращение к памяти через кэш, возвращает дополнительные такты (устройства не кэшируются)
+    def cache_access(self, addr: int, write: bool = False) -> int:
+        if self.cache is None or addr == self.INPUT_ADDR or addr == self.OUTPUT_ADDR:
+            return 0
+        return self.cache.access(addr, write)
 
     def latch_data_addr(self, addr: int):
         if addr == self.INPUT_ADDR:
@@ -131,3 +255,44 @@ class DataPath:
 
     def get_data_out(self):
         return self.databus.value
+
+    # Выборка операнды целиком: защелкнуть адрес и выставить OE, для косвенной
+    # адресации защелкнуть прочитанное значение как новый адрес
+    def fetch_operand(self, addr: int, indirect: bool = False) -> int:
+        if addr == self.INPUT_ADDR or addr == self.OUTPUT_ADDR:
+            self.latch_data_addr(addr)
+            self.set_oe(True)
+        else:
+            self._select_mem(addr)
+            self.mem.OE = True
+            self.databus.value = self.mem.read(addr)
+        if indirect:
+            addr = self.databus.value
+            if addr == self.INPUT_ADDR or addr == self.OUTPUT_ADDR:
+                self.latch_data_addr(addr)
+            else:
+                self._select_mem(addr)
+                self.databus.value = self.mem.read(addr)
+        return self.databus.value
+
+    # Запись аккумулятора по адресу, как на стадии исполнения ST
+    def store_acc(self, addr: int):
+        if addr == self.INPUT_ADDR or addr == self.OUTPUT_ADDR:
+            self.latch_data_addr(addr)
+            self.set_oe(False)
+            self.set_acc_out(True)
+            self.set_wr(True)
+            return
+        self._select_mem(addr)
+        self.mem.OE = False
+        self.acc_out = True
+        self.databus.value = self.acc
+        self.mem.write(addr, self.acc)
+
+    # то же, что latch_data_addr для адреса RAM, без последовательности сигналов
+    def _select_mem(self, addr: int):
+        self.input.CS = False
+        self.output.CS = False
+        self.mem.CS = True
+        self.mem.data_address = addr
+        self.data_address = addr
@@ -0,0 +1,147 @@
+import io
+import os
+
+import pytest
+
+import machine
+import translator
+from datapath import RAM, DataBus, EndOfInput, InputDevice, OutputDevice
+
+# --память--
+# Страницы выделяются при записи, значения шире 64 бит хранятся в RAM.wide
+
+
+def test_block_across_pages():
+    mem = RAM(DataBus())
+    start = RAM.PAGE_SIZE - 3
+    words = list(range(1, RAM.PAGE_SIZE + 10))
+    mem.write_block(start, words)
+    assert mem.resident_pages() == 3
+    assert mem.read_block(start, len(words)) == words
+    assert mem.read(start - 1) == 0
+    assert mem.read(start + len(words)) == 0
+    assert mem.read(RAM.PAGE_SIZE) == words[3]
+
+
+def test_wide_values():
+    mem = RAM(DataBus())
+    big, small = 1 << 70, -(1 << 64)
+    mem.write(5, big)
+    mem.write_block(RAM.PAGE_SIZE - 1, [1, small, 2])
+    assert mem.read(5) == big
+    assert mem.read_block(RAM.PAGE_SIZE - 1, 3) == [1, small, 2]
+    assert set(mem.wide) == {5, RAM.PAGE_SIZE}
+    # запись обычного значения поверх широкого
+    mem.write(5, 7)
+    mem.write_block(RAM.PAGE_SIZE, [3])
+    assert (mem.read(5), mem.read(RAM.PAGE_SIZE)) == (7, 3)
+    assert not mem.wide
+
+
+def test_unmapped_pages():
+    mem = RAM(DataBus())
+    assert mem.read(0x2FFFFFFF) == 0
+    assert mem.read_block(0x20000000 - 2, 4) == [0] * 4
+    assert (mem.resident_pages(), mem.page_faults) == (0, 0)
+    mem.load({0x20000000: [10, 20], 0x10000002: [30]})
+    assert mem.read_block(0x20000000 - 1, 4) == [0, 10, 20, 0]
+    assert mem.read(0x10000002) == 30
+    assert (mem.resident_pages(), mem.page_faults) == (2, 2)
+    assert mem.resident_bytes() == 2 * RAM.PAGE_SIZE * 8
+
+
+# --устройства ввода-вывода--
+class RecordingInput(io.StringIO):
+    def __init__(self, text: str) -> None:
+        super().__init__(text)
+        self.sizes: list[int] = []
+
+    def read(self, size: int = -1) -> str:
+        self.sizes.append(size)
+        return super().read(size)
+
+
+def read_all(device: InputDevice) -> str:
+    chars = []
+    device.set_cs(True)
+    with pytest.raises(EndOfInput):
+        while True:
+            device.set_oe(True)
+            chars.append(chr(device.databus.value))
+    return "".join(chars)
+
+
+def test_input_chunks(monkeypatch):
+    monkeypatch.setattr(InputDevice, 'CHUNK_SIZE', 4)
+    source = RecordingInput("abcdefghij")
+    device = InputDevice(DataBus(), source)
+    device.set_cs(True)
+    for expected in "abcde":
+        device.set_oe(True)
+        assert chr(device.databus.value) == expected
+    # вторая порция прочитана, остаток в обратном порядке
+    assert device.input_buffer == ['h', 'g', 'f']
+    assert source.sizes == [4, 4]
+    assert read_all(device) == "fghij"
+    assert source.sizes == [4, 4, 4, 4]
+
+
+def test_end_of_input():
+    device = InputDevice(DataBus(), ['a', 'b'])
+    assert read_all(device) == "ab"
+    with pytest.raises(EndOfInput):
+        device.set_oe(True)
+    assert read_all(InputDevice(DataBus(), io.StringIO(""))) == ""
+
+
+def test_input_not_selected():
+    device = InputDevice(DataBus(), io.StringIO("a"))
+    device.set_oe(True)
+    assert device.input_buffer == [] and device.databus.value == 0
+
+
+class RecordingOutput:
+    def __init__(self) -> None:
+        self.writes: list[str] = []
+
+    def write(self, text: str):
+        self.writes.append(text)
+
+    def flush(self):
+        pass
+
+
+def test_output_buffer(monkeypatch):
+    monkeypatch.setattr(OutputDevice, 'BUFFER_SIZE', 3)
+    sink = RecordingOutput()
+    device = OutputDevice(DataBus(), sink=sink)
+    device.set_cs(True)
+    for char in "abcdefg":
+        device.databus.value = ord(char)
+        device.set_wr(True)
+    assert sink.writes == ["abc", "def"]
+    assert device.output_buffer == ['g']
+    device.flush()
+    assert sink.writes == ["abc", "def", "g"]
+    assert device.output_buffer == []
+
+
+def test_output_without_sink():
+    device = OutputDevice(DataBus())
+    device.set_cs(True)
+    device.databus.value = ord('x')
+    device.set_wr(True)
+    device.flush()
+    assert device.output_buffer == ['x']
+
+
+# machine.py сбрасывает остаток буфера вывода после остановки
+def test_output_flushed_at_halt(tmp_path, monkeypatch):
+    monkeypatch.setattr(OutputDevice, 'BUFFER_SIZE', 5)
+    code, stdin = tmp_path / 'hello.code', tmp_path / 'input.txt'
+    translator.main([os.path.join(os.path.dirname(__file__), 'resources', 'src', 'hello world.asm'), str(code)])
+    stdin.write_text("")
+    stdout = RecordingOutput()
+    monkeypatch.setattr('sys.stdout', stdout)
+    machine.main([str(code), str(stdin)])
+    assert stdout.writes == ["Hello", " Worl", "d", "\n"]
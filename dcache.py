@@ -0,0 +1,188 @@
+from __future__ import annotations
+
+# Модель кэша данных между DataPath и RAM.
+#
+# Кэш хранит только теги строк (данные по-прежнему в RAM) и считает, во сколько
+# тактов обошлось обращение: попадание - 0 дополнительных тактов, промах -
+# penalty тактов на чтение строки из памяти. Наборы - списки тегов в порядке
+# использования (LRU), вытесняется самый давний.
+# write=back: запись в строку (при промахе строка загружается), грязная строка
+# при вытеснении записывается в память за penalty тактов.
+# write=through: каждая запись идет в память за penalty тактов, при промахе
+# строка не загружается.
+# Обращения к устройствам ввода-вывода кэш не проходят.
+
+WRITE_POLICIES = ('back', 'through')
+# размер диапазона адресов (в словах) для статистики обращений
+HEAT_BLOCK = 256
+
+DEFAULTS: dict[str, int | str] = {'size': 256, 'line': 8, 'ways': 2, 'write': 'back', 'penalty': 10}
+
+
+def _power_of_two(value: int) -> bool:
+    return value > 0 and value & (value - 1) == 0
+
+
+class DataCache:
+    def __init__(self, size: int = 256, line: int = 8, ways: int = 2, write: str = 'back', penalty: int = 10) -> None:
+        assert _power_of_two(line), f"Размер строки кэша должен быть степенью двойки: {line}"
+        assert ways > 0 and size % (line * ways) == 0, f"Объем кэша {size} не делится на {ways} x {line} слов"
+        assert _power_of_two(size // (line * ways)), "Число наборов кэша должно быть степенью двойки"
+        assert write in WRITE_POLICIES, f"Неизвестная политика записи: {write}"
+        assert penalty >= 0, "Штраф промаха не может быть отрицательным"
+        self.size = size
+        self.line = line
+        self.ways = ways
+        self.write = write
+        self.penalty = penalty
+        self.line_bits = line.bit_length() - 1
+        self.set_mask = size // (line * ways) - 1
+        self.sets: list[list[int]] = [[] for _ in range(self.set_mask + 1)]
+        # номера грязных строк (write=back)
+        self.dirty: set[int] = set()
+
+        self.reads = 0
+        self.writes = 0
+        self.read_misses = 0
+        self.write_misses = 0
+        self.evictions = 0
+        self.writebacks = 0
+        self.stall_ticks = 0
+        # номер диапазона HEAT_BLOCK слов -> [обращения, промахи]
+        self.heat: dict[int, list[int]] = {}
+
+    # Обращение к слову addr, возвращает число дополнительных тактов
+    def access(self, addr: int, write: bool = False) -> int:
+        number = addr >> self.line_bits
+        ways = self.sets[number & self.set_mask]
+        heat = self.heat.get(addr // HEAT_BLOCK)
+        if heat is None:
+            heat = self.heat[addr // HEAT_BLOCK] = [0, 0]
+        heat[0] += 1
+        if write:
+            self.writes += 1
+        else:
+            self.reads += 1
+
+        stall = 0
+        if number in ways:
+            if ways[-1] != number:
+                ways.remove(number)
+                ways.append(number)
+            if write:
+                if self.write == 'back':
+                    self.dirty.add(number)
+                else:
+                    stall = self.penalty
+            self.stall_ticks += stall
+            return stall
+
+        heat[1] += 1
+        if write:
+            self.write_misses += 1
+        else:
+            self.read_misses += 1
+        stall = self.penalty
+        if write and self.write == 'through':
+            # без размещения строки: только запись в память
+            self.stall_ticks += stall
+            return stall
+        if len(ways) == self.ways:
+            victim = ways.pop(0)
+            self.evictions += 1
+            if victim in self.dirty:
+                self.dirty.discard(victim)
+                self.writebacks += 1
+                stall += self.penalty
+        ways.append(number)
+        if write:
+            self.dirty.add(number)
+        self.stall_ticks += stall
+        return stall
+
+    def config(self) -> dict:
+        return {'size': self.size, 'line': self.line, 'ways': self.ways, 'write': self.write, 'penalty': self.penalty}
+
+    # Состояние для снимка: теги наборов в порядке LRU, грязные строки, счетчики
+    def state(self) -> dict:
+        return {
+            'config': self.config(),
+            'sets': [list(ways) for ways in self.sets],
+            'dirty': sorted(self.dirty),
+            'counters': [self.reads, self.writes, self.read_misses, self.write_misses,
+                         self.evictions, self.writebacks, self.stall_ticks],
+            'heat': [[block, accesses, misses] for block, (accesses, misses) in self.heat.items()],
+        }
+
+    def load_state(self, state: dict):
+        assert state['config'] == self.config(), f"Снимок сделан с другим кэшем данных: {state['config']}"
+        self.sets = [list(ways) for ways in state['sets']]
+        self.dirty = set(state['dirty'])
+        (self.reads, self.writes, self.read_misses, self.write_misses,
+         self.evictions, self.writebacks, self.stall_ticks) = state['counters']
+        self.heat = {block: [accesses, misses] for block, accesses, misses in state['heat']}
+
+    @property
+    def accesses(self) -> int:
+        return self.reads + self.writes
+
+    @property
+    def misses(self) -> int:
+        return self.read_misses + self.write_misses
+
+    @property
+    def hits(self) -> int:
+        return self.accesses - self.misses
+
+    # Диапазоны адресов по убыванию числа обращений
+    def by_range(self) -> list[dict]:
+        rows = [
+            {'start': block * HEAT_BLOCK, 'end': (block + 1) * HEAT_BLOCK, 'accesses': accesses, 'misses': misses}
+            for block, (accesses, misses) in self.heat.items()
+        ]
+        rows.sort(key=lambda row: (-row['accesses'], row['start']))
+        return rows
+
+    def to_json(self) -> dict:
+        return {
+            'config': self.config(),
+            'reads': self.reads,
+            'writes': self.writes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'read_misses': self.read_misses,
+            'write_misses': self.write_misses,
+            'evictions': self.evictions,
+            'writebacks': self.writebacks,
+            'stall_ticks': self.stall_ticks,
+            'ranges': self.by_range(),
+        }
+
+    def report(self, top: int = 20) -> str:
+        rate = 100 * self.hits / self.accesses if self.accesses else 0.0
+        lines = [
+            f"dcache: {self.size} слов, строка {self.line}, {self.ways}-way, write-{self.write}, промах {self.penalty} тактов",
+            f"reads {self.reads} writes {self.writes} hits {self.hits} ({rate:.1f}%) misses {self.misses} "
+            f"(read {self.read_misses}, write {self.write_misses}) evictions {self.evictions} "
+            f"writebacks {self.writebacks} stall ticks {self.stall_ticks}",
+            "",
+            f"{'range':<25} {'accesses':>10} {'misses':>10} {'miss %':>7}",
+        ]
+        for row in self.by_range()[:top]:
+            span = f"[{row['start']}, {row['end']})"
+            lines.append(f"{span:<25} {row['accesses']:>10} {row['misses']:>10} {100 * row['misses'] / row['accesses']:>7.1f}")
+        return "\n".join(lines)
+
+
+# Разбор описания кэша "size=256,line=8,ways=2,write=back,penalty=10";
+# отсутствующие параметры берутся из DEFAULTS
+def parse_spec(spec: str) -> DataCache:
+    params = dict(DEFAULTS)
+    for item in spec.split(','):
+        if not item.strip():
+            continue
+        key, sep, value = item.partition('=')
+        key = key.strip()
+        assert sep and key in DEFAULTS, f"Неизвестный параметр кэша: {item}"
+        params[key] = value.strip() if key == 'write' else int(value, 0)
+    return DataCache(**params)
@@ -0,0 +1,435 @@
+from __future__ import annotations
+
+import argparse
+import cmd
+import itertools
+import json
+import sys
+from typing import NamedTuple
+
+from control_unit import OVERFLOW_MODES, ControlUnit
+from datapath import RAM, EndOfInput
+from jit import BlockCompiler
+from machine import ENGINES, load_program, simulate
+from program_cache import open_cache
+
+# Отладчик над ControlUnit/DataPath.
+#
+# Точки останова ставятся на PC, на метку (по карте исходного кода от
+# translator.py --source-map) и/или с условием на ACC, флаги и счетчики.
+# Точки наблюдения ловят чтение и запись диапазона адресов RAM, имена
+# переменных берутся из таблицы символов (var_table транслятора) в той же карте.
+#
+# Пока ничего не установлено, continue моделирует обычным simulate в выбранном
+# режиме, без лишней работы на такт. С точками только по PC (режим jit) базовые
+# блоки без точек внутри исполняются целиком, точки проверяются на входе в блок.
+# Условия и точки наблюдения переводят continue на поинструкционный цикл. Точки
+# наблюдения подменяют read/write у экземпляра RAM, пока они есть, как Profiler
+# подменяет step.
+
+
+class Stop(NamedTuple):
+    reason: str
+    detail: str = ""
+
+
+class Breakpoint:
+    def __init__(self, number: int, pc: int | None, condition: str | None, where: str) -> None:
+        assert pc is not None or condition is not None, "Нужен адрес или условие"
+        self.number = number
+        self.pc = pc
+        self.condition = condition
+        self.code = None if condition is None else compile(condition, '<condition>', 'eval')
+        self.where = where
+        self.hits = 0
+
+    def __str__(self) -> str:
+        res = f"#{self.number} break"
+        if self.pc is not None:
+            res += f" {self.where}"
+        if self.condition is not None:
+            res += f" if {self.condition}"
+        return res + f" (срабатываний: {self.hits})"
+
+
+class Watchpoint:
+    def __init__(self, number: int, start: int, end: int, read: bool, write: bool, where: str) -> None:
+        self.number = number
+        self.start = start
+        self.end = end
+        self.read = read
+        self.write = write
+        self.where = where
+        self.hits = 0
+
+    def __str__(self) -> str:
+        mode = ('r' if self.read else '') + ('w' if self.write else '')
+        return f"#{self.number} watch {self.where} [{self.start}, {self.end}) {mode} (срабатываний: {self.hits})"
+
+
+class Debugger:
+    def __init__(self, control_unit: ControlUnit, source_map: dict | None = None, engine: str = 'jit') -> None:
+        assert engine in ENGINES, f"Неизвестный режим моделирования: {engine}"
+        self.control_unit = control_unit
+        self.engine = engine
+        instructions = source_map['instructions'] if source_map else []
+        self.source: dict[int, dict] = {entry['pc']: entry for entry in instructions}
+        self.symbols: dict[str, int] = dict(source_map.get('symbols', {})) if source_map else {}
+        # метка -> PC первой инструкции после нее
+        self.labels: dict[str, int] = {}
+        for entry in instructions:
+            if entry['label'] is not None and entry['offset'] == 0:
+                self.labels.setdefault(entry['label'], entry['pc'])
+        self.numbers = itertools.count(1)
+        self.breakpoints: dict[int, Breakpoint] = {}
+        self.watchpoints: dict[int, Watchpoint] = {}
+        # обращения к наблюдаемым адресам с последней проверки: (точка, 'read'/'write', адрес, значение)
+        self.hits: list[tuple[Watchpoint, str, int, int]] = []
+        # остановка на точке по PC: при продолжении она не должна сработать снова
+        self.resume_pc: int | None = None
+        self.finished: Stop | None = None
+        self.blocks: BlockCompiler | None = None
+
+    # --адреса--
+    # Число (десятичное или 0x...), имя переменной или метки
+    def address(self, text: str) -> int:
+        if text in self.labels:
+            return self.labels[text]
+        if text in self.symbols:
+            return self.symbols[text]
+        try:
+            return int(text, 0)
+        except ValueError:
+            raise ValueError(f"неизвестный адрес: {text}") from None
+
+    # Между инструкциями - следующая инструкция, иначе исполняемая
+    def where(self, pc: int | None = None) -> str:
+        cu = self.control_unit
+        if pc is None:
+            pc = cu.next_pc() if cu.stage == ControlUnit.Stage.INSTR_FETCH else cu.program_counter
+        entry = self.source.get(pc)
+        if entry is not None:
+            location = entry['text'] if entry['label'] is None else f"{entry['label']}+{entry['offset']}: {entry['text']}"
+            return f"pc {pc} (строка {entry['line']}) {location}"
+        if isinstance(pc, int) and 0 <= pc < len(cu.program):
+            return f"pc {pc}: {str(cu.program[pc]).strip()}"
+        return f"pc {pc}"
+
+    def registers(self) -> str:
+        cu = self.control_unit
+        return (f"TICK: {cu.tick_cnt} INSTR: {cu.instr_cnt} STAGE: {cu.stage.name} PC: {cu.program_counter} "
+                f"ACC: {cu.datapath.acc} N|Z|V|C: {int(cu.N)}|{int(cu.Z)}|{int(cu.V)}|{int(cu.C)}")
+
+    def namespace(self) -> dict:
+        cu = self.control_unit
+        return {
+            'acc': cu.datapath.acc, 'N': cu.N, 'Z': cu.Z, 'V': cu.V, 'C': cu.C,
+            'pc': cu.program_counter, 'tick': cu.tick_cnt, 'instr': cu.instr_cnt,
+            'mem': self.peek, **self.symbols,
+        }
+
+    # Чтение памяти в обход точек наблюдения
+    def peek(self, addr: int) -> int:
+        return RAM.read(self.control_unit.datapath.mem, addr)
+
+    def evaluate(self, expression: str):
+        return eval(compile(expression, '<expression>', 'eval'), {'__builtins__': {}}, self.namespace())
+
+    # --точки останова и наблюдения--
+    def add_breakpoint(self, location: str | None = None, condition: str | None = None) -> Breakpoint:
+        pc = None if location is None else self.address(location)
+        point = Breakpoint(next(self.numbers), pc, condition, location or "")
+        self.breakpoints[point.number] = point
+        return point
+
+    def add_watchpoint(self, location: str, count: int = 1, mode: str = 'rw') -> Watchpoint:
+        assert count > 0, "Размер диапазона должен быть положительным"
+        assert mode in ('r', 'w', 'rw'), f"Неизвестный вид точки наблюдения: {mode}"
+        start = self.address(location)
+        point = Watchpoint(next(self.numbers), start, start + count, 'r' in mode, 'w' in mode, location)
+        self.watchpoints[point.number] = point
+        self._arm_memory()
+        return point
+
+    def delete(self, number: int):
+        assert number in self.breakpoints or number in self.watchpoints, f"Нет точки #{number}"
+        self.breakpoints.pop(number, None)
+        if self.watchpoints.pop(number, None) is not None:
+            self._arm_memory()
+
+    # Подмена RAM.read/RAM.write у экземпляра памяти, пока есть точки наблюдения
+    def _arm_memory(self):
+        mem = self.control_unit.datapath.mem
+        mem.__dict__.pop('read', None)
+        mem.__dict__.pop('write', None)
+        readers = [point for point in self.watchpoints.values() if point.read]
+        writers = [point for point in self.watchpoints.values() if point.write]
+        hits = self.hits
+        if readers:
+            read = RAM.read.__get__(mem)
+
+            def watched_read(addr: int) -> int:
+                value = read(addr)
+                for point in readers:
+                    if point.start <= addr < point.end:
+                        hits.append((point, 'read', addr, value))
+                return value
+
+            mem.read = watched_read
+        if writers:
+            write = RAM.write.__get__(mem)
+
+            def watched_write(addr: int, value: int):
+                write(addr, value)
+                for point in writers:
+                    if point.start <= addr < point.end:
+                        hits.append((point, 'write', addr, value))
+
+            mem.write = watched_write
+
+    def _watch_stop(self) -> Stop:
+        lines = []
+        for point, kind, addr, value in self.hits:
+            point.hits += 1
+            lines.append(f"#{point.number} {kind} [{addr}] = {value}")
+        self.hits.clear()
+        return Stop('watchpoint', "; ".join(lines))
+
+    # --исполнение--
+    def _finish(self, reason: str, detail: str = "") -> Stop:
+        self.control_unit.datapath.output.flush()
+        self.finished = Stop(reason, detail)
+        return self.finished
+
+    def _pc_break(self, pc: int) -> Breakpoint | None:
+        for point in self.breakpoints.values():
+            if point.pc == pc and (point.code is None or self._true(point)):
+                return point
+        return None
+
+    def _true(self, point: Breakpoint) -> bool:
+        return bool(eval(point.code, {'__builtins__': {}}, self.namespace()))
+
+    # Исполнение с проверками: не больше steps инструкций (None - без ограничения).
+    # С blocks (только точки по PC) базовые блоки без точек внутри исполняются целиком
+    def _execute(self, steps: int | None, max_ticks: int | None = None, blocks: BlockCompiler | None = None) -> Stop:
+        cu = self.control_unit
+        pcs = {point.pc for point in self.breakpoints.values() if point.pc is not None}
+        conditions = [point for point in self.breakpoints.values() if point.pc is None]
+        # начало блока -> нет ли точек останова внутри блока
+        clean: dict[int, bool] = {}
+        done = 0
+        try:
+            while steps is None or done < steps:
+                if pcs and cu.stage == ControlUnit.Stage.INSTR_FETCH:
+                    pc = cu.next_pc()
+                    point = self._pc_break(pc) if pc in pcs and pc != self.resume_pc else None
+                    if point is not None:
+                        point.hits += 1
+                        self.resume_pc = pc
+                        return Stop('breakpoint', f"#{point.number}")
+                self.resume_pc = None
+                block = None if blocks is None else blocks.next_block()
+                if block is not None:
+                    if block.start not in clean:
+                        clean[block.start] = not any(block.start < pc < block.end for pc in pcs)
+                    if not clean[block.start]:
+                        block = None
+                if block is not None:
+                    blocks.execute(block)
+                else:
+                    cu.step()
+                done += 1
+                if self.hits:
+                    return self._watch_stop()
+                for point in conditions:
+                    if self._true(point):
+                        point.hits += 1
+                        return Stop('breakpoint', f"#{point.number} {point.condition}")
+                if max_ticks is not None and cu.tick_cnt >= max_ticks:
+                    return Stop('tick_limit')
+        except StopIteration:
+            return self._finish('halt')
+        except EndOfInput:
+            return self._finish('eof')
+        except Exception as e:
+            return self._finish('error', f"{type(e).__name__}: {e}")
+        finally:
+            cu.datapath.output.flush()
+        return Stop('step')
+
+    def run(self, max_ticks: int | None = None) -> Stop:
+        if self.finished is not None:
+            return self.finished
+        if self.watchpoints or any(point.pc is None for point in self.breakpoints.values()):
+            return self._execute(None, max_ticks)
+        if self.breakpoints:
+            if self.blocks is None and self.engine == 'jit':
+                self.blocks = BlockCompiler(self.control_unit)
+            return self._execute(None, max_ticks, self.blocks)
+        # ничего не установлено - обычное моделирование
+        try:
+            status = simulate(self.control_unit, self.engine, max_ticks)
+        except Exception as e:
+            return self._finish('error', f"{type(e).__name__}: {e}")
+        if status in ('halt', 'eof'):
+            return self._finish(status)
+        self.control_unit.datapath.output.flush()
+        return Stop(status)
+
+    def step(self, count: int = 1) -> Stop:
+        if self.finished is not None:
+            return self.finished
+        return self._execute(count)
+
+    def tick(self, count: int = 1) -> Stop:
+        if self.finished is not None:
+            return self.finished
+        cu = self.control_unit
+        self.resume_pc = None
+        try:
+            for _ in range(count):
+                cu.tick()
+                if self.hits:
+                    return self._watch_stop()
+        except StopIteration:
+            return self._finish('halt')
+        except EndOfInput:
+            return self._finish('eof')
+        except Exception as e:
+            return self._finish('error', f"{type(e).__name__}: {e}")
+        finally:
+            cu.datapath.output.flush()
+        return Stop('tick')
+
+
+def load_debug_map(path: str) -> dict:
+    with open(path, encoding='utf-8') as file:
+        return json.load(file)
+
+
+class DebuggerShell(cmd.Cmd):
+    intro = "Отладчик CSA, help - список команд"
+    prompt = "(csa) "
+
+    def __init__(self, debugger: Debugger, stdin=None) -> None:
+        super().__init__(stdin=stdin)
+        if stdin is not None:
+            self.use_rawinput = False
+            self.prompt = ""
+            self.intro = None
+        self.debugger = debugger
+
+    def onecmd(self, line: str) -> bool:
+        try:
+            return super().onecmd(line)
+        except (AssertionError, ValueError, SyntaxError, NameError, TypeError) as e:
+            print(f"ошибка: {e}")
+            return False
+
+    def emptyline(self) -> bool:
+        return False
+
+    def report(self, stop: Stop):
+        sys.stdout.flush()
+        text = stop.reason if not stop.detail else f"{stop.reason}: {stop.detail}"
+        print(f"\n[{text}] {self.debugger.where()}")
+        print(self.debugger.registers())
+
+    def do_break(self, arg: str):
+        """break [PC|.метка] [if УСЛОВИЕ] - точка останова перед инструкцией и/или по условию
+        на acc, N, Z, V, C, pc, tick, instr, mem(адрес) и переменные (их адреса)"""
+        location, _, condition = arg.partition(' if ')
+        if arg.startswith('if '):
+            location, condition = '', arg[3:]
+        point = self.debugger.add_breakpoint(location.strip() or None, condition.strip() or None)
+        print(point)
+
+    def do_watch(self, arg: str):
+        """watch АДРЕС|переменная [ЧИСЛО_СЛОВ] [r|w|rw] - точка наблюдения за чтением/записью RAM"""
+        words = arg.split()
+        assert words, "Нужен адрес"
+        count = int(words[1]) if len(words) > 1 and words[1].isdigit() else 1
+        mode = words[-1] if words[-1] in ('r', 'w', 'rw') and len(words) > 1 else 'rw'
+        print(self.debugger.add_watchpoint(words[0], count, mode))
+
+    def do_delete(self, arg: str):
+        """delete N - удалить точку останова или наблюдения"""
+        self.debugger.delete(int(arg))
+
+    def do_info(self, arg: str):
+        """info - список точек останова и наблюдения"""
+        for point in [*self.debugger.breakpoints.values(), *self.debugger.watchpoints.values()]:
+            print(point)
+
+    def do_continue(self, arg: str):
+        """continue [ТАКТОВ] - исполнять до точки останова, остановки машины или лимита тактов"""
+        max_ticks = self.debugger.control_unit.tick_cnt + int(arg) if arg else None
+        self.report(self.debugger.run(max_ticks))
+
+    def do_step(self, arg: str):
+        """step [N] - исполнить N инструкций"""
+        self.report(self.debugger.step(int(arg) if arg else 1))
+
+    def do_tick(self, arg: str):
+        """tick [N] - исполнить N тактов"""
+        self.report(self.debugger.tick(int(arg) if arg else 1))
+
+    def do_print(self, arg: str):
+        """print [ВЫРАЖЕНИЕ] - регистры или значение выражения"""
+        print(self.debugger.registers() if not arg else self.debugger.evaluate(arg))
+
+    def do_x(self, arg: str):
+        """x АДРЕС|переменная [ЧИСЛО_СЛОВ] - содержимое памяти"""
+        words = arg.split()
+        assert words, "Нужен адрес"
+        start = self.debugger.address(words[0])
+        count = int(words[1]) if len(words) > 1 else 1
+        words = [self.debugger.peek(start + offset) for offset in range(count)]
+        for offset in range(0, count, 8):
+            print(f"{start + offset:>10}: " + " ".join(f"{word:>10}" for word in words[offset:offset + 8]))
+
+    def do_where(self, arg: str):
+        """where - текущая инструкция"""
+        print(self.debugger.where())
+
+    def do_quit(self, arg: str) -> bool:
+        """quit - выход"""
+        return True
+
+    def do_EOF(self, arg: str) -> bool:
+        return True
+
+    do_b = do_break
+    do_c = do_continue
+    do_s = do_step
+    do_t = do_tick
+    do_p = do_print
+    do_q = do_quit
+
+
+def main(args: list[str]):
+    parser = argparse.ArgumentParser(prog="debugger.py")
+    parser.add_argument("code_file")
+    parser.add_argument("input_file")
+    parser.add_argument("--source-map", metavar="PATH", help="карта исходного кода от translator.py --source-map")
+    parser.add_argument("--engine", choices=ENGINES, default='jit', help="режим моделирования без точек останова")
+    parser.add_argument("--overflow", choices=OVERFLOW_MODES, default=None)
+    parser.add_argument("--cache", metavar="DIR", help="каталог кэша декодированных программ (по умолчанию $CSA_CACHE_DIR)")
+    parser.add_argument("-x", "--commands", metavar="PATH", help="выполнить команды из файла вместо интерактивного ввода")
+    options = parser.parse_args(args)
+
+    program, data = load_program(options.code_file, open_cache(options.cache))
+    source_map = load_debug_map(options.source_map) if options.source_map else None
+    with open(options.input_file) as inp:
+        control_unit = ControlUnit(inp, program, data, sys.stdout, overflow=options.overflow)
+        debugger = Debugger(control_unit, source_map, options.engine)
+        if options.commands is not None:
+            with open(options.commands) as commands:
+                DebuggerShell(debugger, commands).cmdloop()
+        else:
+            DebuggerShell(debugger).cmdloop()
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,133 @@
+import io
+
+import pytest
+
+import translator
+from control_unit import ControlUnit
+from datapath import RAM
+from debugger import Debugger, Stop
+from isa import data_runs
+from machine import simulate
+
+# Эхо до перевода строки через переменную x: запись и чтение x на каждом символе
+SOURCE = """section .text:
+    .loop
+    LD DIRECT #STDIN
+    ST IMMEDIATE x
+    LD DIRECT x
+    ST IMMEDIATE #STDOUT
+    CMP IMMEDIATE 10
+    JNZ DIRECT .loop
+    HLT
+section .data:
+    x: 0
+"""
+STDIN = "abc\n"
+
+
+def debugger(engine: str = 'jit') -> Debugger:
+    translated = translator.translate(SOURCE)
+    control_unit = ControlUnit(io.StringIO(STDIN), translator.machine_code(translated), data_runs(translated.data),
+                               io.StringIO())
+    source_map = {'instructions': translator.source_map(translated, SOURCE), 'symbols': translated.var_table}
+    return Debugger(control_unit, source_map, engine)
+
+
+def output(debug: Debugger) -> str:
+    device = debug.control_unit.datapath.output
+    return device.sink.getvalue() + "".join(device.output_buffer)
+
+
+def run_to_end(debug: Debugger) -> list[Stop]:
+    stops = []
+    while debug.finished is None:
+        stops.append(debug.run())
+    return stops
+
+
+# Без точек continue - обычный simulate: те же такты и вывод
+@pytest.mark.parametrize('engine', ['tick', 'instr', 'jit'])
+def test_fast_path(engine: str):
+    debug = debugger(engine)
+    assert debug.run() == Stop('halt')
+    reference = debugger(engine).control_unit
+    assert simulate(reference, engine) == 'halt'
+    assert (debug.control_unit.tick_cnt, debug.control_unit.instr_cnt) == (reference.tick_cnt, reference.instr_cnt)
+    assert output(debug) == STDIN
+
+
+@pytest.mark.parametrize('engine', ['instr', 'jit'])
+def test_pc_breakpoint(engine: str):
+    debug = debugger(engine)
+    point = debug.add_breakpoint('4')
+    stops = run_to_end(debug)
+    assert stops == [Stop('breakpoint', '#1')] * 4 + [Stop('halt')]
+    assert point.hits == 4
+    assert output(debug) == STDIN
+    reference = debugger().control_unit
+    simulate(reference, 'instr')
+    assert debug.control_unit.tick_cnt == reference.tick_cnt
+
+
+def test_label_breakpoint():
+    debug = debugger()
+    debug.add_breakpoint('.loop')
+    assert debug.labels['.loop'] == 1
+    assert debug.run() == Stop('breakpoint', '#1')
+    assert debug.control_unit.next_pc() == 1
+    assert debug.where().endswith(".loop+0: LD DIRECT #STDIN")
+    # следующий проход цикла: один символ выведен
+    assert debug.run() == Stop('breakpoint', '#1')
+    assert output(debug) == "a"
+
+
+def test_conditional_breakpoints():
+    debug = debugger()
+    debug.add_breakpoint(condition='acc == 98')
+    assert debug.run() == Stop('breakpoint', '#1 acc == 98')
+    assert output(debug) == "a"
+    # точка по метке с условием: срабатывает только при выполнении условия
+    debug = debugger()
+    debug.add_breakpoint('.loop', 'mem(x) == 99')
+    assert debug.run() == Stop('breakpoint', '#1')
+    assert output(debug) == "abc"
+    assert run_to_end(debug) == [Stop('halt')]
+
+
+def test_watchpoints():
+    debug = debugger()
+    x = debug.symbols['x']
+    mem = debug.control_unit.datapath.mem
+    write = debug.add_watchpoint('x', mode='w')
+    assert 'write' in vars(mem) and 'read' not in vars(mem)
+    assert debug.run() == Stop('watchpoint', f"#1 write [{x}] = 97")
+    read = debug.add_watchpoint('x', mode='r')
+    assert debug.run() == Stop('watchpoint', f"#2 read [{x}] = 97")
+    assert debug.run() == Stop('watchpoint', f"#1 write [{x}] = 98")
+    assert (write.hits, read.hits) == (2, 1)
+    debug.delete(1)
+    assert 'write' not in vars(mem) and 'read' in vars(mem)
+    debug.delete(2)
+    assert 'write' not in vars(mem) and 'read' not in vars(mem)
+    assert type(mem).read is RAM.read
+    assert run_to_end(debug) == [Stop('halt')]
+    assert output(debug) == STDIN
+
+
+def test_step_and_tick():
+    debug = debugger()
+    cu = debug.control_unit
+    assert debug.step(2) == Stop('step')
+    assert cu.stage == ControlUnit.Stage.INSTR_FETCH
+    instructions = cu.instr_cnt
+    assert debug.step() == Stop('step')
+    assert cu.instr_cnt == instructions + 1
+    ticks = cu.tick_cnt
+    assert debug.tick() == Stop('tick')
+    assert cu.tick_cnt == ticks + 1 and cu.stage != ControlUnit.Stage.INSTR_FETCH
+    ticks = cu.tick_cnt
+    assert debug.tick(3) == Stop('tick')
+    assert cu.tick_cnt == ticks + 3
+    assert run_to_end(debug) == [Stop('halt')]
+    assert debug.step() == Stop('halt')
+    assert output(debug) == STDIN
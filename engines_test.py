@@ -0,0 +1,124 @@
+import glob
+import io
+import os
+
+import pytest
+import yaml
+
+import translator
+from control_unit import ControlUnit
+from interrupts import parse_schedule
+from machine import load_program, simulate
+from microcode import CONTROL_UNITS
+
+# Режимы моделирования (tick, instr, jit) с любым устройством управления должны
+# давать те же результаты, что потактово со схемным: вывод, такты, число
+# инструкций и состояние машины при остановке, в том числе при остановке ошибкой.
+
+ENGINES = ('tick', 'instr', 'jit')
+CASES = sorted(glob.glob(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'golden', '*.yml')))
+
+
+def case_id(path: str) -> str:
+    return os.path.splitext(os.path.basename(path))[0]
+
+
+def load_case(path: str) -> dict:
+    with open(path, encoding='utf-8') as file:
+        return yaml.safe_load(file)
+
+# программы, которые останавливаются посреди инструкции:
+# (исходный код, ввод, режим переполнения, причина остановки)
+FAULTS = {
+    'div by zero': ("section .text:\n LD DIRECT a\n DIV DIRECT b\n HLT\nsection .data:\n a: 8\n b: 0",
+                    "", None, 'ZeroDivisionError'),
+    'rem by zero': ("section .text:\n LD IMMEDIATE 5\n ST IMMEDIATE b\n REM DIRECT a\n HLT\nsection .data:\n a: 0\n b: 0",
+                    "", None, 'ZeroDivisionError'),
+    'bad char': ("section .text:\n LD IMMEDIATE 'o'\n ST IMMEDIATE #STDOUT\n LD IMMEDIATE -1\n ST IMMEDIATE #STDOUT\n HLT",
+                 "", None, 'ValueError'),
+    'eof indirect': ("section .text:\n .loop\n LD INDIRECT #STDIN\n ST IMMEDIATE #STDOUT\n JMP DIRECT .loop",
+                     "ab", None, 'eof'),
+    'overflow trap': ("section .text:\n LD DIRECT a\n .loop\n ADD DIRECT a\n ST IMMEDIATE a\n JMP DIRECT .loop\n"
+                      "section .data:\n a: 1000", "", 'trap', 'WordOverflow'),
+    # PC вне программы: переход за ее конец и конец программы без HLT
+    'jump out of program': ("section .text:\n LD IMMEDIATE 'o'\n ST IMMEDIATE #STDOUT\n JMP IMMEDIATE 100",
+                            "", None, 'IndexError'),
+    'no hlt': ("section .text:\n LD IMMEDIATE 'o'\n ST IMMEDIATE #STDOUT", "", None, 'IndexError'),
+}
+
+
+def build(source: str, preload: bool, tmp_path) -> tuple:
+    source_path, code_path = tmp_path / 'program.asm', tmp_path / 'program.code'
+    source_path.write_text(source, encoding='utf-8')
+    translator.main([str(source_path), str(code_path)] + (['--preload'] if preload else []))
+    return load_program(str(code_path))
+
+
+def run(control_unit: ControlUnit, engine: str) -> tuple:
+    try:
+        status = simulate(control_unit, engine)
+    except Exception as e:
+        status = type(e).__name__
+    datapath = control_unit.datapath
+    return (status, control_unit.tick_cnt, control_unit.instr_cnt, "".join(datapath.output.output_buffer),
+            datapath.acc, control_unit.N, control_unit.Z, control_unit.V, control_unit.C,
+            control_unit.program_counter, control_unit.stage)
+
+
+def case_input(case: dict):
+    if 'in_schedule' in case:
+        return parse_schedule(case['in_schedule'].splitlines())
+    return io.StringIO(case['in_stdin'] + '\n')
+
+
+@pytest.mark.parametrize('preload', [True, False], ids=['preload', 'image'])
+@pytest.mark.parametrize('path', CASES, ids=case_id)
+def test_golden_programs(path: str, preload: bool, tmp_path):
+    case = load_case(path)
+    program, data = build(case['in_source'], preload, tmp_path)
+    reference = run(ControlUnit(case_input(case), program, data, io.StringIO(), overflow=case.get('overflow')), 'tick')
+    for unit_name, unit in CONTROL_UNITS.items():
+        for engine in ENGINES:
+            control_unit = unit(case_input(case), program, data, io.StringIO(), overflow=case.get('overflow'))
+            assert run(control_unit, engine) == reference, (unit_name, engine)
+
+
+@pytest.mark.parametrize('preload', [True, False], ids=['preload', 'image'])
+@pytest.mark.parametrize('name', list(FAULTS))
+def test_faults(name: str, preload: bool, tmp_path):
+    source, stdin, overflow, status = FAULTS[name]
+    program, data = build(source, preload, tmp_path)
+    reference = run(ControlUnit(io.StringIO(stdin), program, data, io.StringIO(), overflow=overflow), 'tick')
+    assert reference[0] == status
+    for unit_name, unit in CONTROL_UNITS.items():
+        for engine in ENGINES:
+            control_unit = unit(io.StringIO(stdin), program, data, io.StringIO(), overflow=overflow)
+            assert run(control_unit, engine) == reference, (unit_name, engine)
+
+
+# lockstep.py (нужен NumPy) на нескольких входах против instr
+def check_lockstep(program, data, inputs: list[str], overflow: str | None):
+    lockstep = pytest.importorskip('lockstep')
+    results = lockstep.run_lockstep(program, data, inputs, overflow=overflow)
+    for text, result in zip(inputs, results):
+        expected = run(ControlUnit(io.StringIO(text), program, data, io.StringIO(), overflow=overflow), 'instr')
+        status = expected[0] if expected[0] in ('halt', 'eof') else 'error'
+        assert (result['exit'], result['ticks'], result['instructions'], result['stdout']) == (status, *expected[1:4]), text
+        if status == 'error':
+            assert result['error'].startswith(expected[0])
+
+
+@pytest.mark.parametrize('preload', [True, False], ids=['preload', 'image'])
+@pytest.mark.parametrize('path', [path for path in CASES if 'in_schedule' not in load_case(path)], ids=case_id)
+def test_lockstep(path: str, preload: bool, tmp_path):
+    case = load_case(path)
+    program, data = build(case['in_source'], preload, tmp_path)
+    stdin = case['in_stdin']
+    check_lockstep(program, data, [stdin + '\n', '', '\n', stdin[::-1] + '\n', stdin], case.get('overflow'))
+
+
+@pytest.mark.parametrize('name', list(FAULTS))
+def test_lockstep_faults(name: str, tmp_path):
+    source, stdin, overflow, _ = FAULTS[name]
+    program, data = build(source, False, tmp_path)
+    check_lockstep(program, data, [stdin, '', stdin * 2], overflow)
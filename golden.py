@@ -0,0 +1,433 @@
+from __future__ import annotations
+
+import argparse
+import collections
+import glob
+import gzip
+import hashlib
+import io
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Iterator
+
+import yaml
+
+import translator
+from isa import Instruction, data_runs
+from control_unit import ControlUnit
+from interrupts import parse_schedule
+from machine import simulate
+from microcode import CONTROL_UNITS
+from tracing import Tracer
+
+# Golden-тесты: лог потактового моделирования сравнивается с эталоном из golden/*.yml.
+#
+# Кейс - YAML с исходным кодом (in_source), вводом (in_stdin), ожидаемым машинным
+# кодом (out_instructions) и логом. Программа транслируется с --preload, как при
+# записи эталонов. Необязательные ключи:
+#   preload      - false: трансляция с образом данных;
+#   overflow     - режим переполнения (wrap, trap);
+#   in_schedule  - расписание ввода (см. interrupts.py) вместо in_stdin;
+#   out_exit     - ожидаемое завершение: halt, eof или error: <исключение>;
+#   out_stdout   - вывод программы после строки STDOUT_SEPARATOR, как в исходных
+#                  тестах (сравнивается без завершающих переводов строки).
+# Без out_exit завершение не проверяется, но ошибка моделирования - провал кейса.
+# Лог не собирается в память: строки от трассировщика сразу
+# сравниваются с эталонными, после первого расхождения моделирование доводится
+# еще на несколько строк для контекста и прерывается. Кейсы выполняются
+# параллельно по процессам.
+#
+# Эталонный лог хранится одним из способов:
+#   out_log        - текстом в самом YAML;
+#   out_log_file   - файлом рядом с YAML, сжатым gzip;
+#   out_log_digest - без текста: число строк, sha256 блоков по DIGEST_BLOCK строк,
+#                    первые и последние строки. Расхождение внутри блока находится
+#                    с точностью до блока, в первых и последних строках - точно.
+
+PREFIX = "DEBUG:root:"
+STDOUT_SEPARATOR = "=" * 60
+DIGEST_BLOCK = 4096
+DIGEST_EXCERPT = 20
+STORES = ('inline', 'gzip', 'digest')
+
+
+class Divergence(Exception):
+    def __init__(self, line: int, expected: list[str], got: list[str], before: list[str], message: str = "") -> None:
+        super().__init__(message or "расхождение с эталоном")
+        self.line = line
+        self.expected = expected
+        self.got = got
+        self.before = before
+        self.tick: int | None = None
+
+
+# Лог в формате LoggingTracer построчно в sink, без logging
+class LogTracer(Tracer):
+    def __init__(self, sink) -> None:
+        self.sink = sink
+        self.tick_cnt: int | None = None
+
+    # строка лога может содержать перевод строки (ввод-вывод символа '\n'), в эталоне это две строки
+    def emit(self, line: str):
+        try:
+            for part in line.split('\n'):
+                self.sink.line(part)
+        except Divergence as e:
+            self.mark(e)
+            raise
+        if self.sink.divergence is not None:
+            self.mark(self.sink.divergence)
+
+    # такт расхождения - текущий такт при первой отличающейся строке
+    def mark(self, divergence: Divergence):
+        if divergence.tick is None:
+            divergence.tick = self.tick_cnt
+
+    def tick(self, control_unit):
+        self.tick_cnt = control_unit.tick_cnt
+        # такты preload до выставления флагов в текстовый лог не попадают (см. tracing.to_text)
+        if getattr(control_unit, 'N', None) is None:
+            return
+        self.emit(PREFIX + str(control_unit))
+
+    def fetched(self, instr):
+        self.emit(PREFIX)
+        self.emit(PREFIX + f"Fetched: {instr}")
+
+    def arg_skipped(self):
+        self.emit(PREFIX + "Arg fetch stage skipped")
+
+    def input(self, buffer: list[str], char: str):
+        self.emit(PREFIX + f"input: {buffer} --> '{char}'")
+
+    def output(self, buffer: list[str], char: str):
+        self.emit(PREFIX + f"output: {buffer} <-- '{char}'")
+
+
+# --сравнение со строками эталона--
+class LineChecker:
+    def __init__(self, expected: Iterator[str], context: int = 5) -> None:
+        self.expected = expected
+        self.context = context
+        self.lines = 0
+        self.before: collections.deque[str] = collections.deque(maxlen=context)
+        # первое расхождение, после него собирается контекст
+        self.divergence: Divergence | None = None
+
+    def line(self, text: str):
+        self.lines += 1
+        if self.divergence is not None:
+            self.divergence.got.append(text)
+            if len(self.divergence.got) > self.context:
+                raise self.divergence
+            return
+        expected = next(self.expected, None)
+        if expected == text:
+            self.before.append(text)
+            return
+        following = [] if expected is None else [expected, *(line for _, line in zip(range(self.context), self.expected))]
+        self.divergence = Divergence(self.lines, following, [text], list(self.before))
+
+    def finish(self):
+        if self.divergence is not None:
+            raise self.divergence
+        rest = [line for _, line in zip(range(self.context + 1), self.expected)]
+        if rest:
+            raise Divergence(self.lines + 1, rest, [], list(self.before), "лог короче эталона")
+
+
+def _block_digest(lines: list[str]) -> str:
+    digest = hashlib.sha256()
+    for line in lines:
+        digest.update(line.encode())
+        digest.update(b'\n')
+    return digest.hexdigest()[:16]
+
+
+# Сводка лога для хранения без текста
+class DigestWriter:
+    def __init__(self, block: int = DIGEST_BLOCK, excerpt: int = DIGEST_EXCERPT) -> None:
+        self.block = block
+        self.excerpt = excerpt
+        self.lines = 0
+        self.blocks: list[str] = []
+        self.current: list[str] = []
+        self.head: list[str] = []
+        self.tail: collections.deque[str] = collections.deque(maxlen=excerpt)
+        self.divergence: Divergence | None = None
+
+    def line(self, text: str):
+        self.lines += 1
+        if len(self.head) < self.excerpt:
+            self.head.append(text)
+        self.tail.append(text)
+        self.current.append(text)
+        if len(self.current) == self.block:
+            self.blocks.append(_block_digest(self.current))
+            self.current = []
+
+    def finish(self):
+        if self.current:
+            self.blocks.append(_block_digest(self.current))
+            self.current = []
+
+    def to_dict(self) -> dict:
+        return {'lines': self.lines, 'block': self.block, 'blocks': self.blocks,
+                'head': self.head, 'tail': list(self.tail)}
+
+
+# Сравнение со сводкой: первые строки - построчно, дальше - по хэшам блоков
+class DigestChecker(DigestWriter):
+    def __init__(self, digest: dict, context: int = 5) -> None:
+        super().__init__(digest['block'], len(digest['head']))
+        self.expected = digest
+        self.context = context
+        self.before: collections.deque[str] = collections.deque(maxlen=context)
+
+    def line(self, text: str):
+        index = self.lines
+        head = self.expected['head']
+        if index < len(head) and head[index] != text:
+            self.divergence = Divergence(index + 1, head[index:index + self.context + 1], [text], list(self.before))
+            raise self.divergence
+        super().line(text)
+        self.before.append(text)
+        blocks = self.expected['blocks']
+        if not self.current:
+            number = len(self.blocks) - 1
+            if number >= len(blocks) or blocks[number] != self.blocks[number]:
+                self._block_divergence(number)
+
+    def _block_divergence(self, number: int, lines: list[str] | None = None):
+        start = number * self.block + 1
+        got = lines if lines is not None else list(self.before)
+        raise Divergence(start, [], got, [],
+                         f"расхождение в блоке строк {start}-{start + self.block - 1} (в эталоне только хэш блока)")
+
+    def finish(self):
+        lines = self.current
+        super().finish()
+        expected = self.expected
+        if self.lines != expected['lines'] or self.blocks != expected['blocks']:
+            # сначала точное место по последним строкам, если оно в них попадает
+            tail = list(self.tail)
+            offset = self.lines - len(tail)
+            exp_offset = expected['lines'] - len(expected['tail'])
+            if offset == exp_offset:
+                for i, (got, exp) in enumerate(zip(tail, expected['tail'])):
+                    if got != exp:
+                        raise Divergence(offset + i + 1, expected['tail'][i:], tail[i:i + self.context + 1],
+                                         tail[max(0, i - self.context):i])
+            for number, block in enumerate(self.blocks):
+                if number >= len(expected['blocks']) or expected['blocks'][number] != block:
+                    self._block_divergence(number, lines[-self.context:])
+            raise Divergence(self.lines + 1, [], [], tail[-self.context:],
+                             f"лог: {self.lines} строк, в эталоне {expected['lines']}")
+
+
+# --кейсы--
+def load_case(path: str) -> dict:
+    with open(path, encoding='utf-8') as file:
+        return yaml.safe_load(file)
+
+
+def log_file(path: str) -> str:
+    return os.path.splitext(path)[0] + '.log.gz'
+
+
+def expected_lines(path: str, case: dict) -> Iterator[str]:
+    if 'out_log' in case:
+        lines = case['out_log'].split('\n')
+        yield from lines[:-1] if lines[-1] == '' else lines
+        return
+    with gzip.open(os.path.join(os.path.dirname(path), case['out_log_file']), 'rt', encoding='utf-8', newline='\n') as file:
+        for line in file:
+            yield line.rstrip('\n')
+
+
+def build(case: dict) -> tuple[str, list[Instruction], dict[int, list[int]]]:
+    translated = translator.translate(case['in_source'], case.get('preload', True))
+    instructions = translator.machine_code(translated)
+    data = {} if translated.use_preload else data_runs(translated.data)
+    return translator.code_text(instructions, data), instructions, data
+
+
+# машинный код в эталонах местами с отступами, сравнивается построчно без них
+def _code_lines(text: str) -> list[str]:
+    return [line.strip() for line in text.splitlines() if line.strip()]
+
+
+def stdout_text(control_unit: ControlUnit) -> str:
+    return STDOUT_SEPARATOR + "\n" + "".join(control_unit.datapath.output.output_buffer)
+
+
+# Моделирование кейса с выводом лога в sink
+def simulate_case(case: dict, sink, control: str = 'hardwired') -> tuple[str, str, ControlUnit]:
+    text, instructions, data = build(case)
+    tracer = LogTracer(sink)
+    if 'in_schedule' in case:
+        source = parse_schedule(case['in_schedule'].splitlines())
+    else:
+        # как в исходных тестах: ввод - строка in_stdin с переводом строки
+        source = io.StringIO(case['in_stdin'] + '\n')
+    control_unit = CONTROL_UNITS[control](source, instructions, data, tracer=tracer, overflow=case.get('overflow'))
+    try:
+        status = simulate(control_unit, 'tick')
+    except Divergence:
+        raise
+    except Exception as e:
+        # лог до ошибки уже сравнен, ошибка - завершение кейса
+        status = f"error: {type(e).__name__}"
+    try:
+        sink.finish()
+    except Divergence as e:
+        tracer.mark(e)
+        raise
+    return status, text, control_unit
+
+
+def run_case(path: str, context: int = 5, control: str = 'hardwired') -> dict:
+    start = time.perf_counter()
+    result: dict = {'case': path}
+    try:
+        case = load_case(path)
+        if 'out_log_digest' in case:
+            sink = DigestChecker(case['out_log_digest'], context)
+        else:
+            sink = LineChecker(expected_lines(path, case), context)
+        try:
+            status, text, control_unit = simulate_case(case, sink, control)
+        except Divergence as e:
+            result.update(status='fail', line=e.line, tick=e.tick, message=str(e),
+                          before=e.before, expected=e.expected, got=e.got)
+        else:
+            result.update(status='ok', exit=status, ticks=control_unit.tick_cnt)
+            if 'out_instructions' in case and _code_lines(text) != _code_lines(case['out_instructions']):
+                result.update(status='fail', message="машинный код отличается от out_instructions")
+            elif 'out_stdout' in case and stdout_text(control_unit).rstrip('\n') != case['out_stdout'].rstrip('\n'):
+                result.update(status='fail', message="вывод программы отличается от out_stdout")
+            elif status != case.get('out_exit', status) or ('out_exit' not in case and status.startswith('error')):
+                result.update(status='fail', message=f"завершение {status}, ожидалось {case.get('out_exit', 'без ошибки')}")
+        result['lines'] = sink.lines
+    except Exception as e:
+        result.update(status='error', message=f"{type(e).__name__}: {e}")
+    result['time'] = round(time.perf_counter() - start, 3)
+    return result
+
+
+# --перезапись эталонов--
+class _GzipSink:
+    def __init__(self, path: str) -> None:
+        self.file = gzip.open(path, 'wt', encoding='utf-8', newline='\n')
+        self.lines = 0
+        self.divergence = None
+
+    def line(self, text: str):
+        self.lines += 1
+        self.file.write(text + '\n')
+
+    def finish(self):
+        self.file.close()
+
+
+class _TextSink:
+    def __init__(self) -> None:
+        self.buffer = io.StringIO()
+        self.lines = 0
+        self.divergence = None
+
+    def line(self, text: str):
+        self.lines += 1
+        self.buffer.write(text + '\n')
+
+    def finish(self):
+        pass
+
+
+def _str_presenter(dumper: yaml.SafeDumper, value: str):
+    if '\n' in value:
+        return dumper.represent_scalar('tag:yaml.org,2002:str', value, style='|')
+    return dumper.represent_scalar('tag:yaml.org,2002:str', value)
+
+
+class _Dumper(yaml.SafeDumper):
+    pass
+
+
+_Dumper.add_representer(str, _str_presenter)
+
+
+def update_case(path: str, store: str = 'inline') -> dict:
+    start = time.perf_counter()
+    case = load_case(path)
+    for key in ('out_log', 'out_log_file', 'out_log_digest'):
+        case.pop(key, None)
+    if store == 'gzip':
+        sink = _GzipSink(log_file(path))
+    elif store == 'digest':
+        sink = DigestWriter()
+    else:
+        sink = _TextSink()
+    status, text, control_unit = simulate_case(case, sink)
+    case['out_instructions'] = text
+    case['out_stdout'] = stdout_text(control_unit)
+    if 'out_exit' in case or status.startswith('error'):
+        case['out_exit'] = status
+    if store == 'gzip':
+        case['out_log_file'] = os.path.basename(log_file(path))
+    elif store == 'digest':
+        case['out_log_digest'] = sink.to_dict()
+    else:
+        case['out_log'] = sink.buffer.getvalue()
+    if store != 'gzip' and os.path.exists(log_file(path)):
+        os.remove(log_file(path))
+    with open(path, 'w', encoding='utf-8') as file:
+        yaml.dump(case, file, Dumper=_Dumper, sort_keys=False, allow_unicode=True, width=1 << 16)
+    return {'case': path, 'status': 'updated', 'store': store, 'lines': sink.lines, 'ticks': control_unit.tick_cnt,
+            'time': round(time.perf_counter() - start, 3)}
+
+
+def format_result(result: dict) -> str:
+    name = os.path.splitext(os.path.basename(result['case']))[0]
+    if result['status'] in ('ok', 'updated'):
+        return f"{name}: {result['status']} ({result['lines']} строк, {result['ticks']} тактов, {result.get('time', 0)} с)"
+    lines = [f"{name}: {result['status']}: {result['message']}"]
+    if 'line' in result:
+        lines[0] = f"{name}: {result['status']}: строка {result['line']}, такт {result['tick']}: {result['message']}"
+        lines += ["    " + line for line in result['before']]
+        lines += ["  - " + line for line in result['expected']]
+        lines += ["  + " + line for line in result['got']]
+    return "\n".join(lines)
+
+
+def main(args: list[str]):
+    parser = argparse.ArgumentParser(prog="golden.py")
+    parser.add_argument("cases", nargs='*', help="файлы кейсов, по умолчанию golden/*.yml")
+    parser.add_argument("-j", "--workers", type=int, default=None, help="число процессов, по умолчанию по числу ядер")
+    parser.add_argument("--context", type=int, default=5, help="строк контекста вокруг расхождения")
+    parser.add_argument("--update", action="store_true", help="перезаписать эталоны по текущему моделированию")
+    parser.add_argument("--store", choices=STORES, default='inline', help="как хранить лог при --update")
+    parser.add_argument("--control-unit", choices=list(CONTROL_UNITS), default='hardwired',
+                        help="проверяемое устройство управления (эталоны пишутся hardwired)")
+    options = parser.parse_args(args)
+
+    cases = options.cases or sorted(glob.glob(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'golden', '*.yml')))
+    assert cases, "Нет golden-кейсов"
+    failed = 0
+    with ProcessPoolExecutor(max_workers=options.workers) as pool:
+        if options.update:
+            futures = [pool.submit(update_case, path, options.store) for path in cases]
+        else:
+            futures = [pool.submit(run_case, path, options.context, options.control_unit) for path in cases]
+        for future in as_completed(futures):
+            result = future.result()
+            failed += result['status'] not in ('ok', 'updated')
+            print(format_result(result), flush=True)
+    print(f"{len(cases) - failed} из {len(cases)} кейсов прошли")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
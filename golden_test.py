@@ -0,0 +1,73 @@
+import glob
+import io
+import logging
+import os
+
+import pytest
+import yaml
+
+from control_unit import ControlUnit
+from golden import build, expected_lines, format_result, load_case, run_case
+from interrupts import parse_schedule
+from machine import simulate
+from microcode import CONTROL_UNITS
+from tracing import LoggingTracer
+
+# golden.py под pytest: каждый кейс golden/*.yml с каждым устройством управления
+
+CASES = sorted(glob.glob(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'golden', '*.yml')))
+
+
+def case_id(path: str) -> str:
+    return os.path.splitext(os.path.basename(path))[0]
+
+
+@pytest.mark.parametrize('control', list(CONTROL_UNITS))
+@pytest.mark.parametrize('path', CASES, ids=case_id)
+def test_golden(path: str, control: str):
+    result = run_case(path, control=control)
+    assert result['status'] == 'ok', format_result(result)
+
+
+def test_stdout_mismatch(tmp_path):
+    case = load_case(CASES[0])
+    case['out_stdout'] = case['out_stdout'].rstrip('\n') + "!"
+    path = tmp_path / 'case.yml'
+    path.write_text(yaml.safe_dump(case), encoding='utf-8')
+    result = run_case(str(path))
+    assert (result['status'], result['message']) == ('fail', "вывод программы отличается от out_stdout")
+
+
+# Строки logging в формате исходных тестов (logging.BASIC_FORMAT), формируются при выводе записи
+class Lines(logging.Handler):
+    def __init__(self) -> None:
+        super().__init__()
+        self.setFormatter(logging.Formatter(logging.BASIC_FORMAT))
+        self.lines: list[str] = []
+
+    def emit(self, record: logging.LogRecord):
+        self.lines += self.format(record).split('\n')
+
+
+# Эталоны записаны через logging: LoggingTracer дает тот же лог, что golden.LogTracer
+@pytest.mark.parametrize('path', [path for path in CASES if 'out_log_digest' not in load_case(path)], ids=case_id)
+def test_logging_tracer(path: str, caplog):
+    case = load_case(path)
+    _, instructions, data = build(case)
+    if 'in_schedule' in case:
+        source = parse_schedule(case['in_schedule'].splitlines())
+    else:
+        source = io.StringIO(case['in_stdin'] + '\n')
+    lines = Lines()
+    logging.getLogger().addHandler(lines)
+    try:
+        with caplog.at_level(logging.DEBUG):
+            # с уровнем DEBUG ControlUnit сам подключает LoggingTracer, выборка маркера при создании - уже в логе
+            control_unit = ControlUnit(source, instructions, data, overflow=case.get('overflow'))
+            assert isinstance(control_unit.tracer, LoggingTracer)
+            simulate(control_unit, 'tick')
+    except Exception as e:
+        assert case.get('out_exit') == f"error: {type(e).__name__}"
+    finally:
+        logging.getLogger().removeHandler(lines)
+    assert lines.lines == list(expected_lines(path, case))
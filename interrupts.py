@@ -0,0 +1,90 @@
+from __future__ import annotations
+
+import heapq
+import json
+from typing import Iterable
+
+# Ввод по расписанию: символы приходят в заданные такты.
+#
+# Расписание - текст, в каждой строке "<такт>: <строка JSON>", например
+# 1500: "hi\n". Символы строки приходят в указанный такт по порядку; пустые
+# строки и строки, начинающиеся с #, пропускаются, порядок строк не важен.
+# Ожидающие события хранятся в куче по (такт, порядковый номер). ControlUnit
+# на границе инструкций переносит пришедшие к текущему такту символы в буфер
+# устройства (deliver) и по ним запрашивает прерывание; в ожидании (HLT при
+# разрешенных прерываниях) часы переводятся сразу на next_tick.
+# Для InputDevice расписание - поток: read отдает пришедшие символы, если их
+# нет, а события еще будут - символ с кодом 0 (опрос без ожидания), если
+# событий больше нет - конец ввода.
+
+
+class InputSchedule:
+    def __init__(self, events: Iterable[tuple[int, str]] = ()) -> None:
+        # куча (такт, порядковый номер, символ)
+        self.events: list[tuple[int, int, str]] = []
+        self.seq = 0
+        # пришедшие и еще не прочитанные устройством символы
+        self.arrived: list[str] = []
+        for tick, text in events:
+            self.push(tick, text)
+
+    def push(self, tick: int, text: str):
+        assert tick >= 0, f"Такт события не может быть отрицательным: {tick}"
+        for char in text:
+            heapq.heappush(self.events, (tick, self.seq, char))
+            self.seq += 1
+
+    def __len__(self) -> int:
+        return len(self.events)
+
+    def next_tick(self) -> int | None:
+        return self.events[0][0] if self.events else None
+
+    # Перенос событий с тактом не позже tick в пришедшие, возвращает их число
+    def deliver(self, tick: int) -> int:
+        count = 0
+        events = self.events
+        while events and events[0][0] <= tick:
+            self.arrived.append(heapq.heappop(events)[2])
+            count += 1
+        return count
+
+    def read(self, size: int = -1) -> str:
+        if not self.arrived:
+            return '\0' if self.events else ''
+        if size < 0 or size >= len(self.arrived):
+            res, self.arrived = self.arrived, []
+        else:
+            res, self.arrived = self.arrived[:size], self.arrived[size:]
+        return "".join(res)
+
+    # Состояние для снимка: ожидающие события по порядку и пришедшие символы
+    def state(self) -> dict:
+        return {
+            'events': [[tick, char] for tick, _, char in sorted(self.events)],
+            'arrived': "".join(self.arrived),
+        }
+
+    def load_state(self, state: dict):
+        self.events = []
+        self.seq = 0
+        for tick, char in state['events']:
+            self.push(tick, char)
+        self.arrived = list(state['arrived'])
+
+
+def parse_schedule(lines: Iterable[str]) -> InputSchedule:
+    schedule = InputSchedule()
+    for number, line in enumerate(lines, 1):
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        tick, sep, text = line.partition(':')
+        assert sep and tick.strip().isdecimal(), f"{number}: у события формат <такт>: \"<символы>\""
+        try:
+            value = json.loads(text)
+        except json.JSONDecodeError:
+            value = None
+        assert isinstance(value, str), f"{number}: символы события - строка JSON в кавычках"
+        schedule.push(int(tick), value)
+    return schedule
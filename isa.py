@@ -1,5 +1,7 @@
 import enum
+import mmap
 import re
+import struct
 
 from config import WORD_SIZE 
 
@@ -36,6 +38,10 @@ class Opcode(enum.StrEnum):
     OR = 'OR'
     # ---
     CMP = 'CMP'
+    # прерывания (без операнды); в конце списка, чтобы номера opcode в бинарном формате не менялись
+    EI = 'EI'
+    DI = 'DI'
+    IRET = 'IRET'
 
 class ArgType(enum.StrEnum):
     IMMEDIATE = "IMMEDIATE"
@@ -66,3 +72,113 @@ def parce_instruction(string: str) -> Instruction:
         arg: int = int(string.split(" ")[2])
         return Instruction(opcode=opcode, arg_type=arg_type, arg=arg)
     return Instruction(opcode=Opcode(string[:-1]))
+
+
+# --образ сегмента данных--
+# Образ хранится как {начальный адрес: подряд идущие слова}, в текстовом
+# машинном коде это строки вида "<addr>: <word> <word> ..." в секции "data:"
+DATA_SECTION = 'data:'
+
+
+def data_runs(words: dict[int, int]) -> dict[int, list[int]]:
+    runs: dict[int, list[int]] = {}
+    start, prev = None, None
+    for addr in sorted(words):
+        if prev is None or addr != prev + 1:
+            start = addr
+            runs[start] = []
+        runs[start].append(int(words[addr]))
+        prev = addr
+    return runs
+
+
+def format_data_run(addr: int, words: list[int]) -> str:
+    return f"{addr}: " + " ".join(map(str, words))
+
+
+def parce_data_run(string: str) -> tuple[int, list[int]]:
+    addr, words = string.split(':')
+    return int(addr), [int(word) for word in words.split()]
+
+
+# --бинарный формат машинного кода--
+# Заголовок: сигнатура, версия, размер слова, число инструкций, число блоков данных.
+# Инструкция: номер opcode, тип аргумента (BINARY_NO_ARG если аргумента нет), аргумент в WORD_SIZE бит.
+# Блок данных: начальный адрес и число слов, затем сами слова, все по WORD_SIZE бит
+BINARY_MAGIC = b'CSAB'
+BINARY_VERSION = 2
+BINARY_NO_ARG = 0xFF
+
+_OPCODES: list[Opcode] = list(Opcode)
+_ARG_TYPES: list[ArgType] = list(ArgType)
+_OPCODE_INDEX: dict[Opcode, int] = {op: i for i, op in enumerate(_OPCODES)}
+_ARG_TYPE_INDEX: dict[ArgType, int] = {t: i for i, t in enumerate(_ARG_TYPES)}
+
+_WORD_FORMAT = {8: 'b', 16: 'h', 32: 'i', 64: 'q'}[WORD_SIZE]
+_HEADER = struct.Struct('<4sBBII')
+_RECORD = struct.Struct('<BB' + _WORD_FORMAT)
+_RUN_HEADER = struct.Struct('<' + _WORD_FORMAT + 'I')
+_WORD_BYTES = struct.calcsize(_WORD_FORMAT)
+
+
+def _check_word(value: int, what: str):
+    assert -(1 << (WORD_SIZE - 1)) <= value < (1 << (WORD_SIZE - 1)), f"{what} не помещается в слово"
+
+
+def encode_instructions(instructions: list[Instruction], data: dict[int, list[int]] | None = None) -> bytes:
+    data = data or {}
+    out = bytearray(_HEADER.pack(BINARY_MAGIC, BINARY_VERSION, WORD_SIZE, len(instructions), len(data)))
+    for instr in instructions:
+        if instr.arg is None:
+            out += _RECORD.pack(_OPCODE_INDEX[instr.opcode], BINARY_NO_ARG, 0)
+            continue
+        arg = int(instr.arg)
+        _check_word(arg, f"Аргумент инструкции {instr}")
+        out += _RECORD.pack(_OPCODE_INDEX[instr.opcode], _ARG_TYPE_INDEX[instr.arg_type], arg)
+    for addr, words in data.items():
+        _check_word(addr, f"Адрес {addr}")
+        for word in words:
+            _check_word(word, f"Значение {word} по адресу {addr}")
+        out += _RUN_HEADER.pack(addr, len(words))
+        out += struct.pack(f'<{len(words)}{_WORD_FORMAT}', *words)
+    return bytes(out)
+
+
+def decode_instructions(buffer) -> tuple[list[Instruction], dict[int, list[int]]]:
+    magic, version, word_size, count, run_count = _HEADER.unpack_from(buffer, 0)
+    assert magic == BINARY_MAGIC, "Неверная сигнатура бинарного файла"
+    assert version == BINARY_VERSION, f"Неподдерживаемая версия бинарного формата: {version}"
+    assert word_size == WORD_SIZE, f"Размер слова {word_size} не совпадает с WORD_SIZE={WORD_SIZE}"
+    body = memoryview(buffer)[_HEADER.size:_HEADER.size + count * _RECORD.size]
+    res: list[Instruction] = []
+    for opcode, arg_type, arg in _RECORD.iter_unpack(body):
+        if arg_type == BINARY_NO_ARG:
+            res.append(Instruction(opcode=_OPCODES[opcode]))
+        else:
+            res.append(Instruction(opcode=_OPCODES[opcode], arg=arg, arg_type=_ARG_TYPES[arg_type]))
+    body.release()
+
+    data: dict[int, list[int]] = {}
+    offset = _HEADER.size + count * _RECORD.size
+    for _ in range(run_count):
+        addr, length = _RUN_HEADER.unpack_from(buffer, offset)
+        offset += _RUN_HEADER.size
+        data[addr] = list(struct.unpack_from(f'<{length}{_WORD_FORMAT}', buffer, offset))
+        offset += length * _WORD_BYTES
+    return res, data
+
+
+def is_binary(path: str) -> bool:
+    with open(path, 'rb') as file:
+        return file.read(len(BINARY_MAGIC)) == BINARY_MAGIC
+
+
+def write_binary(path: str, instructions: list[Instruction], data: dict[int, list[int]] | None = None):
+    with open(path, 'wb') as file:
+        file.write(encode_instructions(instructions, data))
+
+
+def read_binary(path: str) -> tuple[list[Instruction], dict[int, list[int]]]:
+    with open(path, 'rb') as file:
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            return decode_instructions(mapped)
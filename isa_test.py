@@ -0,0 +1,77 @@
+import struct
+
+import pytest
+
+from config import WORD_SIZE
+from isa import (BINARY_MAGIC, BINARY_VERSION, ArgType, Instruction, Opcode, decode_instructions,
+                 encode_instructions, is_binary, read_binary, write_binary)
+
+# Бинарный формат машинного кода: разбор закодированного дает те же инструкции и образ данных
+
+WORD_MIN = -(1 << (WORD_SIZE - 1))
+WORD_MAX = (1 << (WORD_SIZE - 1)) - 1
+
+ARGS = (0, 1, -1, 48, WORD_MIN, WORD_MAX)
+# все opcode со всеми типами адресации и без аргумента
+PROGRAM = [Instruction(op, arg, arg_type) for op in Opcode for arg_type in ArgType for arg in ARGS] \
+    + [Instruction(op) for op in Opcode]
+DATA = {0x20000000: [72, 0, WORD_MIN, WORD_MAX], 0x10000002: [5], 7: [-1] * 3000}
+
+
+# у инструкции без аргумента тип адресации не хранится
+def fields(program: list[Instruction]) -> list[tuple]:
+    return [(i.opcode, i.arg, None if i.arg is None else i.arg_type) for i in program]
+
+
+def test_round_trip():
+    program, data = decode_instructions(encode_instructions(PROGRAM, DATA))
+    assert fields(program) == fields(PROGRAM)
+    assert data == DATA
+    assert all(i.arg is None or isinstance(i.arg_type, ArgType) for i in program)
+
+
+def test_empty():
+    assert decode_instructions(encode_instructions([])) == ([], {})
+
+
+def test_mmap(tmp_path):
+    path = str(tmp_path / 'program.bin')
+    write_binary(path, PROGRAM, DATA)
+    assert is_binary(path)
+    program, data = read_binary(path)
+    assert fields(program) == fields(PROGRAM)
+    assert data == DATA
+
+
+def test_text_is_not_binary(tmp_path):
+    path = tmp_path / 'program.code'
+    path.write_text("program:\nHLT  [DIRECT]    0\n")
+    assert not is_binary(str(path))
+
+
+@pytest.mark.parametrize('arg', [WORD_MIN - 1, WORD_MAX + 1])
+def test_wide_argument(arg: int):
+    with pytest.raises(AssertionError, match="не помещается в слово"):
+        encode_instructions([Instruction(Opcode.LD, arg, ArgType.IMMEDIATE)])
+    with pytest.raises(AssertionError, match="не помещается в слово"):
+        encode_instructions([], {0: [arg]})
+
+
+def test_bad_magic():
+    raw = encode_instructions(PROGRAM)
+    with pytest.raises(AssertionError, match="сигнатура"):
+        decode_instructions(b'CSAX' + raw[len(BINARY_MAGIC):])
+
+
+def test_bad_version():
+    raw = bytearray(encode_instructions(PROGRAM))
+    struct.pack_into('<B', raw, len(BINARY_MAGIC), BINARY_VERSION + 1)
+    with pytest.raises(AssertionError, match="версия"):
+        decode_instructions(bytes(raw))
+
+
+def test_bad_word_size():
+    raw = bytearray(encode_instructions(PROGRAM))
+    struct.pack_into('<B', raw, len(BINARY_MAGIC) + 1, WORD_SIZE // 2)
+    with pytest.raises(AssertionError, match="Размер слова"):
+        decode_instructions(bytes(raw))
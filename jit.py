@@ -0,0 +1,284 @@
+from __future__ import annotations
+
+from typing import Callable
+
+from isa import ArgType, Instruction, Opcode
+from control_unit import ARG_FETCH_TICKS, INSTRUCTION_TICKS, SIGN_BIT, WORD_MASK, ControlUnit, WordOverflow, sign_extend
+from datapath import DataPath
+
+# Компиляция программы по базовым блокам в функции Python.
+#
+# Блок начинается с произвольного адреса и заканчивается на переходе, HLT,
+# конце программы или перед началом другого блока (лидера). Каждый блок
+# транслируется в исходный код функции, которая работает с ACC и флагами в
+# локальных переменных, а в память ходит через DataPath.fetch_operand/store_acc,
+# поэтому ввод-вывод и состояние памяти совпадают с потактовым моделированием.
+# Адреса переходов по меткам берутся из памяти данных (JMP DIRECT .label),
+# поэтому блоки компилируются лениво по фактическому адресу входа.
+# Арифметика - как ControlUnit.alu: операнды и результат - знаковые слова
+# WORD_SIZE бит, флаги V и C в локальных переменных v и c.
+# EI/DI/IRET и весь код при вводе по расписанию (прерывания приходят на
+# границах инструкций) исполняются интерпретатором.
+
+# Выражения АЛУ, повторяют ALU_OPERATIONS из control_unit
+_ALU_SOURCE: dict[Opcode, str] = {
+    Opcode.INC: "acc + 1",
+    Opcode.DEC: "acc - 1",
+    Opcode.LD: "arg",
+    Opcode.ADD: "acc + arg",
+    Opcode.SUB: "acc - arg",
+    Opcode.MUL: "acc * arg",
+    Opcode.DIV: "acc // arg",
+    Opcode.REM: "acc % arg",
+    Opcode.NEG: "-acc",
+    Opcode.AND: "acc & arg",
+    Opcode.OR: "acc | arg",
+    Opcode.NOT: "acc == 0",
+}
+
+# Перенос по беззнаковым значениям (повторяют ALU_CARRY), у MUL перенос равен переполнению
+_CARRY_SOURCE: dict[Opcode, str] = {
+    Opcode.INC: f"acc & {WORD_MASK} == {WORD_MASK}",
+    Opcode.DEC: "acc == 0",
+    Opcode.ADD: f"(acc & {WORD_MASK}) + (arg & {WORD_MASK}) > {WORD_MASK}",
+    Opcode.SUB: f"acc & {WORD_MASK} < arg & {WORD_MASK}",
+    Opcode.CMP: f"acc & {WORD_MASK} < arg & {WORD_MASK}",
+    Opcode.NEG: "acc != 0",
+    Opcode.MUL: "v",
+}
+
+# Флаги хранятся как значение f, по которому они ставились: N = f < 0, Z = f == 0
+_SET_SOURCE: dict[Opcode, str] = {
+    Opcode.SETG: "f > 0",
+    Opcode.SETL: "f < 0",
+    Opcode.SETE: "f == 0",
+}
+
+_JUMPS = (Opcode.JMP, Opcode.JZ, Opcode.JNZ)
+_INTERRUPTS = (Opcode.EI, Opcode.DI, Opcode.IRET)
+
+
+class Block:
+    def __init__(self, start: int, end: int, ticks: int, source: str, fn: Callable[[ControlUnit, DataPath], None],
+                 input_reads: int = 0) -> None:
+        self.start = start
+        self.end = end
+        self.ticks = ticks
+        self.source = source
+        self.fn = fn
+        # сколько символов ввода блок может прочитать (косвенные операнды считаются все)
+        self.input_reads = input_reads
+        self.executions = 0
+
+    @property
+    def instructions(self) -> int:
+        return self.end - self.start
+
+
+class BlockCompiler:
+    def __init__(self, control_unit: ControlUnit) -> None:
+        self.control_unit = control_unit
+        self.program: list[Instruction] = control_unit.program
+        self.blocks: dict[int, Block] = {}
+        self.trap = control_unit.overflow == 'trap'
+        self.leaders: set[int] = self._find_leaders()
+        # шаги, исполненные интерпретатором (вход вне программы и т.п.)
+        self.fallback_steps = 0
+
+    def _find_leaders(self) -> set[int]:
+        leaders = {0}
+        for i, instr in enumerate(self.program):
+            if instr.opcode in _INTERRUPTS:
+                leaders.update((i, i + 1))
+            if instr.opcode in _JUMPS:
+                leaders.add(i + 1)
+                if instr.arg_type == ArgType.IMMEDIATE and instr.arg is not None:
+                    leaders.add(int(instr.arg))
+        return leaders
+
+    def executed_instructions(self) -> int:
+        return sum(block.executions * block.instructions for block in self.blocks.values())
+
+    def executed_ticks(self) -> int:
+        return sum(block.executions * block.ticks for block in self.blocks.values())
+
+    # Блок, с которого продолжится исполнение, или None, если следующий шаг - интерпретатором
+    def next_block(self) -> Block | None:
+        cu = self.control_unit
+        if cu.stage != ControlUnit.Stage.INSTR_FETCH or cu.program is not self.program or cu.events is not None:
+            return None
+        pc = cu.next_pc()
+        block = self.blocks.get(pc)
+        if block is None:
+            if not (isinstance(pc, int) and 0 <= pc < len(self.program)):
+                # такой адрес интерпретатор обработает так же, как потактово
+                return None
+            if self.program[pc].opcode in _INTERRUPTS:
+                return None
+            block = self.compile(pc)
+        return block
+
+    def execute(self, block: Block):
+        block.executions += 1
+        block.fn(self.control_unit, self.control_unit.datapath)
+
+    # Исполнение одного базового блока
+    def step(self):
+        block = self.next_block()
+        if block is None:
+            self.fallback_steps += 1
+            self.control_unit.step()
+            return
+        self.execute(block)
+
+    def compile(self, start: int) -> Block:
+        lines: list[str] = [
+            "def block(cu, dp):",
+            "    fetch_operand = dp.fetch_operand",
+            "    acc = dp.acc",
+            "    f = 0 if cu.Z else (-1 if cu.N else 1)",
+            "    v, c = cu.V, cu.C",
+        ]
+        # тело блока исполняется под одним try; перед операцией, которая может
+        # бросить исключение (ввод, деление, вывод, переполнение), номер точки
+        # записывается в at, а обработчик по faults[at] записывает состояние,
+        # как потактово: (PC, такты, инструкции, этап, был ли АЛУ)
+        body: list[str] = []
+        faults: list[tuple[int, int, int, ControlUnit.Stage, bool]] = []
+        ticks = 0
+        input_reads = 0
+        alu_used = False
+        pc = start
+        last: Instruction | None = None
+        while True:
+            instr = self.program[pc]
+            arg_type = ArgType.IMMEDIATE if instr.arg is None else instr.arg_type
+            cost = INSTRUCTION_TICKS[instr.opcode, arg_type]
+            body.append(f"# {pc}: {instr}")
+
+            if arg_type == ArgType.IMMEDIATE:
+                body.append(f"arg = {0 if instr.arg is None else int(instr.arg)}")
+            else:
+                indirect = arg_type == ArgType.INDIRECT
+                if indirect or int(instr.arg) == DataPath.INPUT_ADDR:
+                    input_reads += 1
+                    # при EndOfInput засчитан только такт выборки этой инструкции
+                    body.append(f"at = {len(faults)}")
+                    faults.append((pc, ticks + 1, pc - start + 1, ControlUnit.Stage.ARG_FETCH, alu_used))
+                body.append(f"arg = fetch_operand({int(instr.arg)}, {indirect})")
+
+            op = instr.opcode
+            if op in (Opcode.DIV, Opcode.REM, Opcode.ST) or (self.trap and op in _ALU_SOURCE):
+                # ошибка исполнения: засчитаны выборка и выборка операнды
+                body.append(f"at = {len(faults)}")
+                faults.append((pc, ticks + 1 + ARG_FETCH_TICKS[arg_type], pc - start + 1,
+                               ControlUnit.Stage.EXECUTION, alu_used))
+            if op in _ALU_SOURCE:
+                # ACC всегда хранит знаковое слово, операнду приводим к слову
+                if arg_type == ArgType.IMMEDIATE:
+                    body.append(f"b = {sign_extend(0 if instr.arg is None else int(instr.arg))}")
+                else:
+                    body.append(f"b = ((arg & {WORD_MASK}) ^ {SIGN_BIT}) - {SIGN_BIT}")
+                body.append(f"r = {_ALU_SOURCE[op].replace('arg', 'b')}")
+                body.append(f"w = ((r & {WORD_MASK}) ^ {SIGN_BIT}) - {SIGN_BIT}")
+                body.append("v = w != r")
+                body.append(f"c = {_CARRY_SOURCE.get(op, 'False')}")
+                if self.trap:
+                    body.append("if v:")
+                    body.append(f"    raise WordOverflow(OPCODES[{op.value!r}], r)")
+                body.append("acc = w")
+                body.append("f = acc")
+                alu_used = True
+            elif op in _SET_SOURCE:
+                body.append(f"acc = {_SET_SOURCE[op]}")
+                body.append("f = acc")
+                body.append("v = c = False")
+                alu_used = True
+            elif op == Opcode.CMP:
+                body.append(f"r = acc - (((arg & {WORD_MASK}) ^ {SIGN_BIT}) - {SIGN_BIT})")
+                body.append(f"f = ((r & {WORD_MASK}) ^ {SIGN_BIT}) - {SIGN_BIT}")
+                body.append("v = f != r")
+                body.append(f"c = {_CARRY_SOURCE[op]}")
+            elif op == Opcode.ST:
+                body.append("dp.acc = acc")
+                body.append("dp.store_acc(arg)")
+
+            ticks += cost
+            last = instr
+            pc += 1
+            if op == Opcode.HLT or op in _JUMPS or pc >= len(self.program) or pc in self.leaders:
+                break
+
+        if faults:
+            lines.append("    try:")
+            lines += ["        " + line for line in body]
+            lines += [
+                "    except Exception:",
+                "        pc, ticks, instructions, stage, alu_used = faults[at]",
+                "        dp.acc = acc",
+                "        cu.N = f < 0",
+                "        cu.Z = f == 0",
+                "        cu.V = v",
+                "        cu.C = c",
+                "        cu.program_counter = pc",
+                "        cu.tick_cnt += ticks",
+                "        cu.instr_cnt += instructions",
+                "        if alu_used:",
+                "            dp.acc_in = acc",
+                "        cu.stage = stage",
+                "        raise",
+            ]
+        else:
+            lines += ["    " + line for line in body]
+
+        assert last is not None
+        lines += self._sync(pc - 1, ticks, pc - start, alu_used, "    ")
+        if last.opcode == Opcode.HLT:
+            lines.append("    cu.stage = STAGE_EXECUTION")
+            lines.append("    raise StopIteration()")
+        elif last.opcode in _JUMPS:
+            condition = {Opcode.JMP: "True", Opcode.JZ: "f == 0", Opcode.JNZ: "f != 0"}[last.opcode]
+            lines.append(f"    cu.sel_next = PC_ARG if {condition} else PC_INC")
+        else:
+            lines.append("    cu.sel_next = PC_INC")
+
+        # сигналы, которые потактово остались бы выставлены после последней инструкции
+        fetched = last.arg is not None and last.arg_type != ArgType.IMMEDIATE
+        lines.append(f"    cu.sel_arg = {'ARG_DATA' if fetched else 'ARG_IMM'}")
+        if last.opcode != Opcode.ST:
+            lines.append("    dp.acc_out = False")
+            if not fetched:
+                lines.append("    dp.set_oe(False)")
+
+        source = "\n".join(lines) + "\n"
+        namespace = {
+            "PC_INC": ControlUnit.PCMux.INC,
+            "PC_ARG": ControlUnit.PCMux.ARG,
+            "ARG_IMM": ControlUnit.ArgMux.IMM,
+            "ARG_DATA": ControlUnit.ArgMux.DATA,
+            "STAGE_EXECUTION": ControlUnit.Stage.EXECUTION,
+            "WordOverflow": WordOverflow,
+            "OPCODES": Opcode,
+            "faults": tuple(faults),
+        }
+        exec(compile(source, f"<block {start}>", "exec"), namespace)
+        block = Block(start, pc, ticks, source, namespace["block"], input_reads)
+        self.blocks[start] = block
+        return block
+
+    # Запись локального состояния блока обратно в ControlUnit/DataPath
+    @staticmethod
+    def _sync(pc: int, ticks: int, instructions: int, alu_used: bool, indent: str) -> list[str]:
+        lines = [
+            "dp.acc = acc",
+            "cu.N = f < 0",
+            "cu.Z = f == 0",
+            "cu.V = v",
+            "cu.C = c",
+            f"cu.program_counter = {pc}",
+            f"cu.tick_cnt += {ticks}",
+            f"cu.instr_cnt += {instructions}",
+        ]
+        if alu_used:
+            lines.append("dp.acc_in = acc")
+        return [indent + line for line in lines]
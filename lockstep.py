@@ -0,0 +1,380 @@
+from __future__ import annotations
+
+import io
+from typing import Callable
+
+import numpy as np
+
+from isa import ArgType, Instruction, Opcode
+from config import WORD_SIZE
+from control_unit import INSTRUCTION_TICKS, SIGN_BIT, WORD_MASK, ControlUnit
+from datapath import DataPath
+from machine import simulate
+
+# Синхронное моделирование одной программы на множестве входов (NumPy).
+#
+# Состояние N экземпляров машины (ACC, шина данных, PC, флаги N/Z, счетчики,
+# позиция ввода, память) хранится в массивах. За шаг каждый работающий
+# экземпляр исполняет одну инструкцию: экземпляры группируются по PC, и
+# инструкция исполняется для всей группы сразу. Остановленные экземпляры
+# маскируются. Память - столбцы по адресам, которые встречаются в программе
+# и образе данных; новые адреса (косвенная адресация) добавляются по мере
+# обращения.
+#
+# Арифметика - как ControlUnit.alu, по модулю 2^WORD_SIZE (при WORD_SIZE <= 32
+# результат в int64 точный, иначе int64 переполняется по модулю 2^64, что дает
+# тот же остаток). Флаги V и C не хранятся: их не читает ни одна инструкция.
+# Инструкцию, которую так исполнить нельзя (деление на ноль, вывод символа вне
+# Unicode, PC вне программы, переполнение в режиме trap), экземпляр исполняет
+# уже в скалярном ControlUnit: перед ней его состояние переносится в
+# ControlUnit, и моделирование продолжается в режиме instr. Поэтому вывод,
+# такты и число инструкций совпадают со скалярным моделированием, лимиты
+# проверяются после каждой инструкции, как в режиме instr.
+# Ввод - строки без расписания, поэтому прерываний нет: EI/DI ничего не меняют,
+# а IRET (ошибка вне обработчика) исполняется скалярно.
+
+RUNNING, HALT, EOF, TICK_LIMIT, INSTRUCTION_LIMIT, SCALAR = range(6)
+_REASONS = {HALT: 'halt', EOF: 'eof', TICK_LIMIT: 'tick_limit', INSTRUCTION_LIMIT: 'instruction_limit'}
+
+_JUMPS = (Opcode.JMP, Opcode.JZ, Opcode.JNZ)
+_SETS = (Opcode.SETG, Opcode.SETL, Opcode.SETE)
+
+# Операции АЛУ над массивами (повторяют ALU_OPERATIONS)
+_ALU: dict[Opcode, Callable[[np.ndarray, np.ndarray], np.ndarray]] = {
+    Opcode.LD: lambda acc, arg: arg,
+    Opcode.ADD: lambda acc, arg: acc + arg,
+    Opcode.SUB: lambda acc, arg: acc - arg,
+    Opcode.MUL: lambda acc, arg: acc * arg,
+    Opcode.DIV: lambda acc, arg: np.floor_divide(acc, arg),
+    Opcode.REM: lambda acc, arg: np.remainder(acc, arg),
+    Opcode.AND: lambda acc, arg: acc & arg,
+    Opcode.OR: lambda acc, arg: acc | arg,
+    Opcode.INC: lambda acc, arg: acc + 1,
+    Opcode.DEC: lambda acc, arg: acc - 1,
+    Opcode.NEG: lambda acc, arg: -acc,
+    Opcode.NOT: lambda acc, arg: (acc == 0).astype(np.int64),
+}
+# операции, результат которых может не поместиться в слово
+_OVERFLOWING = (Opcode.ADD, Opcode.SUB, Opcode.MUL, Opcode.DIV, Opcode.INC, Opcode.DEC, Opcode.NEG)
+# при WORD_SIZE <= 32 результат в int64 точный и переполнение определяется точно
+_EXACT = WORD_SIZE <= 32
+
+
+def _sign_extend(x: np.ndarray) -> np.ndarray:
+    if WORD_SIZE == 64:
+        return x
+    return ((x & WORD_MASK) ^ SIGN_BIT) - SIGN_BIT
+
+
+class Lockstep:
+    def __init__(self, program: list[Instruction], data: dict[int, list[int]] | None, inputs: list[str],
+                 overflow: str | None = None) -> None:
+        self.source_program = program
+        self.data = data
+        self.inputs = inputs
+        # секция preload не зависит от ввода, ее исполняет один эталонный экземпляр
+        self.template = ControlUnit([], program, data, overflow=overflow)
+        self.trap = self.template.overflow == 'trap'
+        if self.template.stage != ControlUnit.Stage.INSTR_FETCH:
+            # после preload выбран маркер program, его исполнение засчитывается в такты программы
+            self.template.step()
+        self.program: list[Instruction] = self.template.program
+        self.decoded = [self._decode(instr) for instr in self.program]
+
+        n = len(inputs)
+        self.count = n
+        template_dp = self.template.datapath
+        self.acc = np.full(n, int(template_dp.acc), dtype=np.int64)
+        self.bus = np.full(n, int(template_dp.databus.value), dtype=np.int64)
+        # адрес следующей выбираемой инструкции
+        self.pc = np.full(n, self.template.program_counter + 1, dtype=np.int64)
+        self.N = np.zeros(n, dtype=bool)
+        self.Z = np.ones(n, dtype=bool)
+        self.ticks = np.full(n, self.template.tick_cnt, dtype=np.int64)
+        self.instructions = np.full(n, self.template.instr_cnt, dtype=np.int64)
+        self.status = np.full(n, RUNNING, dtype=np.int8)
+
+        # ввод всех экземпляров подряд в одном массиве кодов символов
+        lengths = np.array([len(text) for text in inputs], dtype=np.int64)
+        self.in_start = np.concatenate(([0], np.cumsum(lengths)[:-1])).astype(np.int64) if n else lengths
+        self.in_len = lengths
+        self.in_pos = np.zeros(n, dtype=np.int64)
+        codes = [ord(ch) for text in inputs for ch in text]
+        self.in_codes = np.array(codes or [0], dtype=np.int64)
+
+        self.output: list[list[int]] = [[] for _ in range(n)]
+        # результаты экземпляров, доисполненных в ControlUnit
+        self.scalar: dict[int, dict] = {}
+        self.max_ticks: int | None = None
+        self.max_instructions: int | None = None
+
+        # память: адрес -> столбец, адреса отсортированы для searchsorted
+        self.keys = np.zeros(0, dtype=np.int64)
+        self.slots = np.zeros(0, dtype=np.int64)
+        self.mem = np.zeros((n, 0), dtype=np.int64)
+        self.columns = 0
+        addresses: set[int] = set()
+        for addr, words in (data or {}).items():
+            addresses.update(range(addr, addr + len(words)))
+        for instr in program:
+            if instr.arg is not None:
+                addresses.add(int(instr.arg))
+        addresses.difference_update((DataPath.INPUT_ADDR, DataPath.OUTPUT_ADDR))
+        self._add_columns(np.array(sorted(addresses), dtype=np.int64))
+
+    @staticmethod
+    def _decode(instr: Instruction) -> tuple[Opcode, int, ArgType, int]:
+        arg_type = ArgType.IMMEDIATE if instr.arg is None else instr.arg_type
+        arg = 0 if instr.arg is None else int(instr.arg)
+        return instr.opcode, arg, arg_type, INSTRUCTION_TICKS[instr.opcode, arg_type]
+
+    # --память--
+    def _add_columns(self, addresses: np.ndarray):
+        if len(addresses) == 0:
+            return
+        need = self.columns + len(addresses)
+        if need > self.mem.shape[1]:
+            grown = np.zeros((self.count, max(need, 2 * self.mem.shape[1])), dtype=np.int64)
+            grown[:, :self.columns] = self.mem[:, :self.columns]
+            self.mem = grown
+        base = self.template.datapath.mem
+        values = [base.read(int(addr)) for addr in addresses]
+        assert all(-(1 << 63) <= value < (1 << 63) for value in values), "Значение в памяти не помещается в 64 бита"
+        new_slots = np.arange(self.columns, need, dtype=np.int64)
+        self.mem[:, self.columns:need] = np.array(values, dtype=np.int64)
+        self.columns = need
+        keys = np.concatenate((self.keys, addresses))
+        slots = np.concatenate((self.slots, new_slots))
+        order = np.argsort(keys, kind='stable')
+        self.keys, self.slots = keys[order], slots[order]
+
+    # Столбцы памяти для адресов, новые адреса получают столбцы
+    def _columns(self, addresses: np.ndarray) -> np.ndarray:
+        if len(self.keys) == 0:
+            self._add_columns(np.unique(addresses))
+        pos = np.searchsorted(self.keys, addresses)
+        clipped = np.minimum(pos, len(self.keys) - 1)
+        found = (pos < len(self.keys)) & (self.keys[clipped] == addresses)
+        if not found.all():
+            self._add_columns(np.unique(addresses[~found]))
+            return self._columns(addresses)
+        return self.slots[clipped]
+
+    # --исполнение--
+    # Выборка операнды без побочных эффектов: значение, кто читает ввод, у кого ввод кончился
+    def _operand(self, idx: np.ndarray, arg: int, indirect: bool) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        size = len(idx)
+        reading = np.zeros(size, dtype=bool)
+        eof = np.zeros(size, dtype=bool)
+        if arg == DataPath.INPUT_ADDR:
+            pos = self.in_pos[idx]
+            eof = pos >= self.in_len[idx]
+            reading = ~eof
+            value = np.where(eof, 0, self.in_codes[np.where(eof, 0, self.in_start[idx] + pos)])
+        elif arg == DataPath.OUTPUT_ADDR:
+            # чтение по адресу вывода не меняет шину
+            value = self.bus[idx]
+        else:
+            column = self._columns(np.array([arg]))[0]
+            value = self.mem[idx, column]
+        if indirect:
+            # адрес ввода-вывода на втором шаге только выбирается, значение на шине остается адресом
+            mem = (value != DataPath.INPUT_ADDR) & (value != DataPath.OUTPUT_ADDR) & ~eof
+            if mem.any():
+                value = value.copy()
+                columns = self._columns(value[mem])
+                value[mem] = self.mem[idx[mem], columns]
+        return value, reading, eof
+
+    # Экземпляры, для которых инструкцию нужно исполнить скалярно
+    def _hazards(self, op: Opcode, acc: np.ndarray, operand: np.ndarray, target: np.ndarray | None,
+                 exact: np.ndarray | None, result: np.ndarray | None) -> np.ndarray:
+        hazards = np.zeros(len(acc), dtype=bool)
+        if op in (Opcode.DIV, Opcode.REM):
+            hazards |= operand == 0
+        if op == Opcode.IRET:
+            hazards[:] = True
+        if op == Opcode.ST:
+            assert target is not None
+            hazards |= (target == DataPath.OUTPUT_ADDR) & ((acc < 0) | (acc >= 0x110000))
+        if self.trap and op in _OVERFLOWING:
+            if _EXACT:
+                hazards |= result != exact
+            else:
+                # оценка в float64 с запасом, точно переполнение проверит ControlUnit
+                with np.errstate(all='ignore'):
+                    estimate = _ALU[op](acc.astype(np.float64), operand.astype(np.float64))
+                hazards |= np.abs(estimate) >= float(1 << (WORD_SIZE - 2))
+        return hazards
+
+    def _execute(self, pc: int, idx: np.ndarray):
+        op, arg, arg_type, cost = self.decoded[pc]
+        fetched = arg_type != ArgType.IMMEDIATE
+        if fetched:
+            value, reading, eof = self._operand(idx, arg, arg_type == ArgType.INDIRECT)
+            if eof.any():
+                # как в ControlUnit.step: засчитан только такт выборки инструкции
+                done = idx[eof]
+                self.instructions[done] += 1
+                self.ticks[done] += 1
+                self.status[done] = EOF
+                keep = ~eof
+                idx, value, reading = idx[keep], value[keep], reading[keep]
+        else:
+            value = np.full(len(idx), arg, dtype=np.int64)
+            reading = np.zeros(len(idx), dtype=bool)
+
+        acc = self.acc[idx]
+        target = None
+        if op == Opcode.ST:
+            target = value if fetched else np.full(len(idx), arg, dtype=np.int64)
+        # операнда АЛУ - знаковое слово, ACC всегда хранит слово
+        operand = _sign_extend(value)
+        exact = result = None
+        if op in _ALU or op == Opcode.CMP:
+            with np.errstate(all='ignore'):
+                exact = _ALU[Opcode.SUB if op == Opcode.CMP else op](acc, operand)
+            result = _sign_extend(exact)
+        hazards = self._hazards(op, acc, operand, target, exact, result)
+        if hazards.any():
+            for i in idx[hazards]:
+                self._to_scalar(int(i))
+            keep = ~hazards
+            idx, value, reading, acc = idx[keep], value[keep], reading[keep], acc[keep]
+            if target is not None:
+                target = target[keep]
+            if result is not None:
+                result = result[keep]
+        if len(idx) == 0:
+            return
+
+        if reading.any():
+            self.in_pos[idx[reading]] += 1
+        if fetched:
+            self.bus[idx] = value
+        self.ticks[idx] += cost
+        self.instructions[idx] += 1
+        next_pc = np.full(len(idx), pc + 1, dtype=np.int64)
+
+        if op in _SETS:
+            Z, N = self.Z[idx], self.N[idx]
+            cond = {Opcode.SETG: ~Z & ~N, Opcode.SETL: ~Z & N, Opcode.SETE: Z & ~N}[op]
+            result = cond.astype(np.int64)
+        elif op == Opcode.CMP:
+            assert result is not None
+            self.Z[idx] = result == 0
+            self.N[idx] = result < 0
+            result = None
+        elif op == Opcode.ST:
+            assert target is not None
+            self._store(idx, acc, target)
+        elif op in _JUMPS:
+            taken = {
+                Opcode.JMP: np.ones(len(idx), dtype=bool),
+                Opcode.JZ: self.Z[idx],
+                Opcode.JNZ: ~self.Z[idx],
+            }[op]
+            next_pc = np.where(taken, value, next_pc)
+        elif op == Opcode.HLT:
+            self.status[idx] = HALT
+
+        if result is not None:
+            self.acc[idx] = result
+            self.Z[idx] = result == 0
+            self.N[idx] = result < 0
+        self.pc[idx] = next_pc
+
+    def _store(self, idx: np.ndarray, acc: np.ndarray, target: np.ndarray):
+        self.bus[idx] = acc
+        out = target == DataPath.OUTPUT_ADDR
+        for i, code in zip(idx[out], acc[out]):
+            self.output[i].append(int(code))
+        mem = ~out & (target != DataPath.INPUT_ADDR)
+        if mem.any():
+            # столбцы выделяются до обращения к self.mem: при выделении массив заменяется
+            columns = self._columns(target[mem])
+            self.mem[idx[mem], columns] = acc[mem]
+
+    # Перенос экземпляра в ControlUnit и скалярное моделирование до остановки
+    def _to_scalar(self, i: int):
+        self.status[i] = SCALAR
+        cu = ControlUnit(io.StringIO(self.inputs[i][int(self.in_pos[i]):]), self.source_program, self.data,
+                         overflow=self.template.overflow)
+        mem = cu.datapath.mem
+        for addr, slot in zip(self.keys.tolist(), self.slots.tolist()):
+            value = int(self.mem[i, slot])
+            if mem.read(addr) != value:
+                mem.write(addr, value)
+        cu.datapath.acc = int(self.acc[i])
+        cu.datapath.databus.value = int(self.bus[i])
+        cu.datapath.output.output_buffer = [chr(code) for code in self.output[i]]
+        cu.N, cu.Z = bool(self.N[i]), bool(self.Z[i])
+        cu.tick_cnt = int(self.ticks[i])
+        cu.instr_cnt = int(self.instructions[i])
+        cu.program_counter = int(self.pc[i]) - 1
+        cu.stage = ControlUnit.Stage.INSTR_FETCH
+        cu.step_cnt = 0
+        cu.sel_next = ControlUnit.PCMux.INC
+        cu.sel_arg = ControlUnit.ArgMux.IMM
+        result: dict = {}
+        try:
+            result['exit'] = simulate(cu, 'instr', self.max_ticks, self.max_instructions)
+        except Exception as e:
+            result['exit'] = 'error'
+            result['error'] = f"{type(e).__name__}: {e}"
+        result['ticks'] = cu.tick_cnt
+        result['instructions'] = cu.instr_cnt
+        result['stdout'] = "".join(cu.datapath.output.output_buffer)
+        self.scalar[i] = result
+
+    # Одна инструкция для всех работающих экземпляров, False если работающих не осталось
+    def step(self) -> bool:
+        active = np.flatnonzero(self.status == RUNNING)
+        if len(active) == 0:
+            return False
+        pcs = self.pc[active]
+        order = np.argsort(pcs, kind='stable')
+        active, pcs = active[order], pcs[order]
+        bounds = np.flatnonzero(np.diff(pcs)) + 1
+        for start, end in zip(np.concatenate(([0], bounds)), np.concatenate((bounds, [len(pcs)]))):
+            pc = int(pcs[start])
+            group = active[start:end]
+            if not 0 <= pc < len(self.program):
+                for i in group:
+                    self._to_scalar(int(i))
+                continue
+            self._execute(pc, group)
+
+        running = active[self.status[active] == RUNNING]
+        if self.max_ticks is not None:
+            self.status[running[self.ticks[running] >= self.max_ticks]] = TICK_LIMIT
+            running = running[self.status[running] == RUNNING]
+        if self.max_instructions is not None:
+            self.status[running[self.instructions[running] >= self.max_instructions]] = INSTRUCTION_LIMIT
+        return True
+
+    def run(self, max_ticks: int | None = None, max_instructions: int | None = None) -> list[dict]:
+        self.max_ticks, self.max_instructions = max_ticks, max_instructions
+        while self.step():
+            pass
+        return self.results()
+
+    def results(self) -> list[dict]:
+        res: list[dict] = []
+        for i in range(self.count):
+            if i in self.scalar:
+                res.append(dict(self.scalar[i]))
+                continue
+            res.append({
+                'exit': _REASONS.get(int(self.status[i]), 'running'),
+                'ticks': int(self.ticks[i]),
+                'instructions': int(self.instructions[i]),
+                'stdout': "".join(map(chr, self.output[i])),
+            })
+        return res
+
+
+def run_lockstep(program: list[Instruction], data: dict[int, list[int]] | None, inputs: list[str],
+                 max_ticks: int | None = None, max_instructions: int | None = None,
+                 overflow: str | None = None) -> list[dict]:
+    return Lockstep(program, data, inputs, overflow).run(max_ticks, max_instructions)
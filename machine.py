@@ -1,31 +1,242 @@
-import logging
+import argparse
+import io
+import json
 import sys
+from typing import Callable
+
+from isa import BINARY_MAGIC, DATA_SECTION, Instruction, decode_instructions, is_binary, parce_data_run, parce_instruction, read_binary
+from control_unit import OVERFLOW_MODES, ControlUnit
+from datapath import EndOfInput
+from dcache import parse_spec
+from interrupts import parse_schedule
+from jit import BlockCompiler
+from profiler import Profiler, load_source_map
+from pipeline import PREDICTORS, Pipeline
+from program_cache import ProgramCache, open_cache
+from microcode import CONTROL_UNITS
+import snapshot
+from tracing import RingTracer, open_trace
+
+# Режимы моделирования: потактовый, поинструкционный и по скомпилированным базовым блокам
+ENGINES = ('tick', 'instr', 'jit')
 
-from isa import Instruction, parce_instruction
-from control_unit import ControlUnit
 
 def parse_isa(lines: list[str]) -> list[Instruction]:
     res: list[Instruction] = []
     for line in lines:
         res.append(parce_instruction(line)) 
     return res
-    
-def main(args: list[str]): # основная функция
-    with open(args[0], 'r') as file:
-        program = parse_isa(file.readlines())
-    
-    with open(args[1]) as inp:
-        input_data = [*(inp.readline())]
 
-    control_unit = ControlUnit(input_data, program)
+
+# Разбор текстового машинного кода: необязательная секция образа данных, затем инструкции
+def parse_code(lines: list[str]) -> tuple[list[Instruction], dict[int, list[int]]]:
+    data: dict[int, list[int]] = {}
+    start = 0
+    if len(lines) != 0 and lines[0].strip() == DATA_SECTION:
+        start = 1
+        while start < len(lines) and ':' in lines[start] and lines[start][0].isdigit():
+            addr, words = parce_data_run(lines[start])
+            data[addr] = words
+            start += 1
+    return parse_isa(lines[start:]), data
+
+
+# Загрузка машинного кода: бинарный формат определяется по сигнатуре, иначе текстовый.
+# С кэшем программа ищется по хэшу содержимого файла и разбирается только при промахе
+def load_program(path: str, cache: ProgramCache | None = None) -> tuple[list[Instruction], dict[int, list[int]]]:
+    if cache is None:
+        if is_binary(path):
+            return read_binary(path)
+        with open(path, 'r') as file:
+            return parse_code(file.readlines())
+
+    with open(path, 'rb') as file:
+        raw = file.read()
+    key = cache.key('code', raw)
+    program = cache.get_program(key)
+    if program is not None:
+        return program
+    if raw.startswith(BINARY_MAGIC):
+        program = decode_instructions(raw)
+    else:
+        program = parse_code(io.TextIOWrapper(io.BytesIO(raw)).readlines())
+    cache.put_program(key, *program)
+    return program
+
+
+# Функция одного шага моделирования в выбранном режиме
+def stepper(control_unit: ControlUnit, engine: str = 'tick') -> Callable[[], None]:
+    assert engine in ENGINES, f"Неизвестный режим моделирования: {engine}"
+    # трасса пишется только потактово
+    if engine == 'tick' or control_unit.tracer is not None:
+        return control_unit.execute_next
+    # блоки не учитывают такты промахов кэша данных и события ввода между инструкциями
+    if engine == 'instr' or control_unit.datapath.cache is not None or control_unit.events is not None:
+        return control_unit.step
+    return BlockCompiler(control_unit).step
+
+
+# Моделирование до HLT, конца ввода или исчерпания лимита, возвращает причину остановки.
+# Лимиты проверяются между шагами, поэтому могут быть превышены на один шаг.
+# checkpoint вызывается между шагами каждые checkpoint_every тактов
+def simulate(control_unit: ControlUnit, engine: str = 'tick',
+             max_ticks: int | None = None, max_instructions: int | None = None,
+             checkpoint: Callable[[], None] | None = None, checkpoint_every: int | None = None) -> str:
+    step = stepper(control_unit, engine)
+    next_checkpoint = None
+    if checkpoint is not None:
+        assert checkpoint_every is not None and checkpoint_every > 0, "Нужен положительный интервал снимков"
+        next_checkpoint = control_unit.tick_cnt + checkpoint_every
     try:
+        if max_ticks is None and max_instructions is None and next_checkpoint is None:
+            while True:
+                step()
         while True:
-            control_unit.execute_next()
+            step()
+            if max_ticks is not None and control_unit.tick_cnt >= max_ticks:
+                return 'tick_limit'
+            if max_instructions is not None and control_unit.instr_cnt >= max_instructions:
+                return 'instruction_limit'
+            if next_checkpoint is not None and control_unit.tick_cnt >= next_checkpoint:
+                checkpoint()
+                next_checkpoint = control_unit.tick_cnt + checkpoint_every
     except StopIteration:
-        pass
-    print("".join(control_unit.datapath.output.output_buffer))
+        return 'halt'
+    except EndOfInput:
+        return 'eof'
+
+
+# Порция моделирования для кооперативного исполнения многих машин в одном потоке:
+# пока не исполнено budget тактов (может быть превышено на одну инструкцию или блок).
+# input_available - число уже принятых символов ввода, None - ввод закончен или весь
+# доступен. Если символов нет, порция заканчивается перед инструкцией, которая
+# прочитала бы ввод. С blocks исполнение по базовым блокам, блок, которому может не
+# хватить ввода, исполняется поинструкционно. Возвращает 'halt', 'eof', 'budget' или 'input'
+def run_slice(control_unit: ControlUnit, budget: int, input_available: Callable[[], int] | None = None,
+              blocks: BlockCompiler | None = None) -> str:
+    step = control_unit.step
+    deadline = control_unit.tick_cnt + budget
+    try:
+        if control_unit.stage != ControlUnit.Stage.INSTR_FETCH:
+            # инструкция начата (маркер program после preload), доводим ее до конца
+            step()
+        while control_unit.tick_cnt < deadline:
+            if blocks is not None:
+                block = blocks.next_block()
+                if block is not None and (input_available is None or block.input_reads == 0
+                                          or input_available() >= block.input_reads):
+                    blocks.execute(block)
+                    continue
+            if input_available is not None and input_available() == 0 and control_unit.next_reads_input():
+                return 'input'
+            step()
+    except StopIteration:
+        return 'halt'
+    except EndOfInput:
+        return 'eof'
+    return 'budget'
+
+
+def main(args: list[str]): # основная функция
+    parser = argparse.ArgumentParser(prog="machine.py")
+    parser.add_argument("code_file")
+    parser.add_argument("input_file")
+    parser.add_argument("--engine", choices=ENGINES, default='tick',
+                        help="tick - потактовое моделирование, instr - поинструкционное, jit - по базовым блокам")
+    parser.add_argument("--trace", metavar="PATH", help="записать трассу в файл (моделирование потактовое)")
+    parser.add_argument("--trace-format", choices=('ndjson', 'binary'), default='binary')
+    parser.add_argument("--trace-every", type=int, default=1, metavar="N", help="сохранять каждый N-й такт")
+    parser.add_argument("--trace-ring", type=int, default=None, metavar="N",
+                        help="держать в памяти записи последних N тактов и записать их только при ошибке")
+    parser.add_argument("--profile", action="store_true",
+                        help="профиль исполнения по PC и opcode в stderr (моделирование поинструкционное)")
+    parser.add_argument("--profile-json", metavar="PATH", help="записать профиль в JSON")
+    parser.add_argument("--source-map", metavar="PATH", help="карта исходного кода от translator.py --source-map")
+    parser.add_argument("--checkpoint", metavar="PATH", help="периодически сохранять снимок состояния в файл")
+    parser.add_argument("--checkpoint-every", type=int, default=1_000_000, metavar="N", help="интервал снимков в тактах")
+    parser.add_argument("--resume", metavar="PATH", help="продолжить моделирование со снимка состояния")
+    parser.add_argument("--cache", metavar="DIR", help="каталог кэша декодированных программ (по умолчанию $CSA_CACHE_DIR)")
+    parser.add_argument("--overflow", choices=OVERFLOW_MODES, default=None,
+                        help="wrap - арифметика по модулю 2^WORD_SIZE, trap - ошибка при переполнении (по умолчанию config.OVERFLOW)")
+    parser.add_argument("--dcache", metavar="SPEC", nargs='?', const='',
+                        help="модель кэша данных, например size=256,line=8,ways=2,write=back,penalty=10; статистика в stderr")
+    parser.add_argument("--dcache-json", metavar="PATH", help="записать статистику кэша данных в JSON")
+    parser.add_argument("--control-unit", choices=list(CONTROL_UNITS), default='hardwired',
+                        help="hardwired - схемное устройство управления, microcode - микропрограммное (ПЗУ микрокоманд)")
+    parser.add_argument("--input-schedule", action="store_true",
+                        help="input_file - расписание ввода (строки <такт>: \"<символы>\"), символы приходят с прерываниями")
+    parser.add_argument("--pipeline", choices=PREDICTORS, nargs='?', const='bimodal',
+                        help="модель конвейера F/A/E с политикой переходов (по умолчанию bimodal); "
+                             "такты, CPI и конфликты в stderr (моделирование поинструкционное)")
+    parser.add_argument("--pipeline-json", metavar="PATH", help="записать статистику модели конвейера в JSON")
+    options = parser.parse_args(args)
+    profiling = options.profile or options.profile_json is not None
+    pipelining = options.pipeline is not None or options.pipeline_json is not None
+    assert not ((profiling or pipelining) and options.trace is not None), "Профилирование и трасса несовместимы"
+    assert options.trace_ring is None or options.trace is not None, "--trace-ring задает буфер для --trace"
+    assert not (pipelining and (options.dcache is not None or options.dcache_json is not None)), \
+        "Модель конвейера и кэш данных несовместимы"
+
+    program, data = load_program(options.code_file, open_cache(options.cache))
+
+    tracer = None
+    if options.trace is not None:
+        if options.trace_ring is not None:
+            tracer = RingTracer(options.trace_ring, options.trace_every)
+        else:
+            tracer = open_trace(options.trace, options.trace_format, options.trace_every)
+
+    cache = None
+    if options.dcache is not None or options.dcache_json is not None:
+        cache = parse_spec(options.dcache or '')
+
+    with open(options.input_file) as inp:
+        source = parse_schedule(inp) if options.input_schedule else inp
+        control_unit = CONTROL_UNITS[options.control_unit](source, program, data, sys.stdout, tracer, options.overflow, cache)
+        profiler = None
+        if profiling:
+            profiler = Profiler(control_unit, load_source_map(options.source_map) if options.source_map else None)
+            profiler.attach()
+        pipeline = None
+        if pipelining:
+            pipeline = Pipeline(control_unit, options.pipeline or 'bimodal')
+            pipeline.attach()
+        if options.resume is not None:
+            snapshot.restore(control_unit, options.resume, data)
+        checkpoint = None
+        if options.checkpoint is not None:
+            checkpoint = lambda: snapshot.save(control_unit, options.checkpoint, data)
+        try:
+            simulate(control_unit, 'instr' if profiling or pipelining else options.engine,
+                     checkpoint=checkpoint, checkpoint_every=options.checkpoint_every)
+        except Exception:
+            if isinstance(tracer, RingTracer):
+                tracer.dump(open_trace(options.trace, options.trace_format))
+            raise
+        finally:
+            if tracer is not None:
+                tracer.close()
+    control_unit.datapath.output.flush()
+    print()
+    if profiler is not None:
+        if options.profile:
+            print(profiler.report(), file=sys.stderr)
+        if options.profile_json is not None:
+            with open(options.profile_json, 'w') as file:
+                json.dump(profiler.to_json(), file, indent=1)
+    if pipeline is not None:
+        if options.pipeline is not None:
+            print(pipeline.report(), file=sys.stderr)
+        if options.pipeline_json is not None:
+            with open(options.pipeline_json, 'w') as file:
+                json.dump(pipeline.to_json(), file, indent=1)
+    if cache is not None:
+        if options.dcache is not None:
+            print(cache.report(), file=sys.stderr)
+        if options.dcache_json is not None:
+            with open(options.dcache_json, 'w') as file:
+                json.dump(cache.to_json(), file, indent=1)
 
 
 if __name__ == "__main__":
-    assert len(sys.argv[1:]) == 2, "machine.py <code_file> <input_file>"
     main(sys.argv[1:])
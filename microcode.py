@@ -0,0 +1,405 @@
+from __future__ import annotations
+
+import argparse
+import enum
+import json
+import sys
+from typing import Callable, TextIO
+
+from isa import ArgType, Instruction, Opcode
+from control_unit import ALU_CARRY, ALU_OPERATIONS, ControlUnit, LogicError, sign_extend, to_unsigned
+from datapath import DataPath
+from dcache import DataCache
+from interrupts import InputSchedule
+from tracing import Tracer
+
+# Микропрограммное устройство управления.
+#
+# Последовательности сигналов ControlUnit.instr_fetch/arg_fetch/execute
+# записаны в ПЗУ микрокоманд: микрокоманда - битовая маска сигналов, этап и
+# номер операции АЛУ. Общая микрокоманда выборки по адресу 0 декодирует
+# выбранную инструкцию по таблице переходов (opcode, тип аргумента) -> адрес ее
+# последовательности: микрокоманды выборки операнды и микрокоманда исполнения,
+# после которой управление возвращается на выборку.
+# ПЗУ строится один раз при импорте, тогда же каждая микрокоманда компилируется
+# в функцию Python, которая выставляет ее сигналы в порядке MICRO_ORDER и
+# переходит к следующему адресу; такт - вызов одной функции по адресу.
+# Такты, сигналы DataPath, трасса и ошибки совпадают с ControlUnit.
+
+
+class Micro(enum.IntFlag):
+    # граница инструкций: события ввода и вход в прерывание (ControlUnit.poll_interrupts)
+    INTERRUPT = enum.auto()
+    ACC_OUT_OFF = enum.auto()
+    LATCH_ADDR = enum.auto()
+    OE_OFF = enum.auto()
+    WR_OFF = enum.auto()
+    LATCH_PC = enum.auto()
+    # счетчик инструкций и трасса выборки
+    FETCH = enum.auto()
+    SEL_NEXT_INC = enum.auto()
+    SEL_ARG_IMM = enum.auto()
+    SEL_ARG_DATA = enum.auto()
+    OE_ON = enum.auto()
+    # обращение к кэшу данных по защелкнутому адресу, промах продлевает такт
+    MEM_READ = enum.auto()
+    # операция АЛУ из поля ALU_SHIFT: результат в ACC_IN, флаги
+    ALU = enum.auto()
+    CMP = enum.auto()
+    SETG = enum.auto()
+    SETL = enum.auto()
+    SETE = enum.auto()
+    JUMP = enum.auto()
+    JUMP_Z = enum.auto()
+    JUMP_NZ = enum.auto()
+    EI = enum.auto()
+    DI = enum.auto()
+    # восстановление PC, ACC и флагов (ControlUnit.interrupt_return)
+    IRET = enum.auto()
+    ACC_OUT_ON = enum.auto()
+    WR_ON = enum.auto()
+    MEM_WRITE = enum.auto()
+    LATCH_ACC = enum.auto()
+    # остановка или ожидание прерывания
+    HALT = enum.auto()
+    # выборка операнды пропущена: трасса, такт не засчитывается
+    ARG_SKIP = enum.auto()
+    # следующий адрес - по таблице переходов для выбранной инструкции
+    DISPATCH = enum.auto()
+    # последняя микрокоманда инструкции, далее выборка
+    END = enum.auto()
+
+
+# Порядок сигналов внутри такта: порядок вызовов в ControlUnit
+MICRO_ORDER: tuple[Micro, ...] = tuple(Micro)
+
+STAGE_SHIFT = 32
+STAGE_MASK = 0b11
+ALU_SHIFT = 34
+ALU_MASK = 0b111111
+# номера операций АЛУ в поле ALU_SHIFT
+ALU_OPCODES: tuple[Opcode, ...] = tuple(ALU_OPERATIONS)
+
+FETCH_ADDR = 0
+# инструкция вне программы: ошибка при выборке операнды, как в ControlUnit.arg_fetch
+FAULT_ADDR = 1
+
+
+def microword(stage: ControlUnit.Stage, signals: Micro, alu: Opcode | None = None) -> int:
+    word = int(signals) | stage.value << STAGE_SHIFT
+    if alu is not None:
+        word |= ALU_OPCODES.index(alu) << ALU_SHIFT
+    return word
+
+
+def word_signals(word: int) -> Micro:
+    return Micro(word & ((1 << STAGE_SHIFT) - 1))
+
+
+def word_stage(word: int) -> ControlUnit.Stage:
+    return ControlUnit.Stage(word >> STAGE_SHIFT & STAGE_MASK)
+
+
+def word_alu(word: int) -> Opcode | None:
+    if not word & Micro.ALU:
+        return None
+    return ALU_OPCODES[word >> ALU_SHIFT & ALU_MASK]
+
+
+# Микрокоманды выборки операнды (см. ControlUnit.arg_fetch)
+def arg_sequence(arg_type: ArgType) -> list[int]:
+    stage = ControlUnit.Stage.ARG_FETCH
+    if arg_type == ArgType.IMMEDIATE:
+        return [microword(stage, Micro.ARG_SKIP)]
+    first = microword(stage, Micro.LATCH_ADDR | Micro.SEL_ARG_DATA | Micro.OE_ON | Micro.MEM_READ)
+    if arg_type == ArgType.DIRECT:
+        return [first]
+    return [first, microword(stage, Micro.LATCH_ADDR | Micro.MEM_READ)]
+
+
+# Микрокоманда исполнения (см. ControlUnit.execute)
+def execute_word(opcode: Opcode) -> int:
+    stage = ControlUnit.Stage.EXECUTION
+    if opcode in ALU_OPERATIONS:
+        return microword(stage, Micro.ALU | Micro.LATCH_ACC | Micro.END, opcode)
+    signals = {
+        Opcode.JMP: Micro.JUMP,
+        Opcode.JZ: Micro.JUMP_Z,
+        Opcode.JNZ: Micro.JUMP_NZ,
+        Opcode.SETG: Micro.SETG | Micro.LATCH_ACC,
+        Opcode.SETL: Micro.SETL | Micro.LATCH_ACC,
+        Opcode.SETE: Micro.SETE | Micro.LATCH_ACC,
+        Opcode.CMP: Micro.CMP,
+        Opcode.ST: Micro.LATCH_ADDR | Micro.OE_OFF | Micro.ACC_OUT_ON | Micro.WR_ON | Micro.MEM_WRITE,
+        Opcode.EI: Micro.EI,
+        Opcode.DI: Micro.DI,
+        Opcode.IRET: Micro.IRET | Micro.LATCH_ACC,
+        Opcode.HLT: Micro.HALT,
+    }.get(opcode, Micro(0))
+    return microword(stage, signals | Micro.END)
+
+
+# ПЗУ микрокоманд и таблица переходов (opcode, тип аргумента) -> адрес.
+# Инструкции без аргумента (тип None) исполняются как IMMEDIATE
+def build_rom() -> tuple[list[int], dict[tuple[Opcode, ArgType | None], int]]:
+    rom = [
+        microword(ControlUnit.Stage.INSTR_FETCH,
+                  Micro.INTERRUPT | Micro.ACC_OUT_OFF | Micro.OE_OFF | Micro.WR_OFF | Micro.LATCH_PC | Micro.FETCH
+                  | Micro.SEL_NEXT_INC | Micro.SEL_ARG_IMM | Micro.DISPATCH),
+        microword(ControlUnit.Stage.ARG_FETCH, Micro(0)),
+    ]
+    dispatch: dict[tuple[Opcode, ArgType | None], int] = {}
+    for opcode in Opcode:
+        for arg_type in ArgType:
+            dispatch[opcode, arg_type] = len(rom)
+            rom.extend(arg_sequence(arg_type))
+            rom.append(execute_word(opcode))
+        dispatch[opcode, None] = dispatch[opcode, ArgType.IMMEDIATE]
+    return rom, dispatch
+
+
+# --компиляция микрокоманд--
+_ARG_SOURCE: dict[ControlUnit.ArgMux, str] = {
+    ControlUnit.ArgMux.IMM: "(cu.program[cu.program_counter].arg or 0)",
+    ControlUnit.ArgMux.DATA: "dp.databus.value",
+}
+
+_SET_SOURCE: dict[Micro, str] = {
+    Micro.SETG: "not cu.Z and not cu.N",
+    Micro.SETL: "not cu.Z and cu.N",
+    Micro.SETE: "cu.Z and not cu.N",
+}
+
+
+# Исходный код функции микрокоманды по адресу addr. sel_arg - положение
+# мультиплексора аргумента перед ней (известно по последовательности), next_addr,
+# next_stage и next_step - куда перейти после нее
+def word_source(addr: int, word: int, sel_arg: ControlUnit.ArgMux | None,
+                next_addr: int | None, next_stage: ControlUnit.Stage, next_step: int) -> list[str]:
+    signals = word_signals(word)
+    lines = [f"def u{addr}(cu, dp):"]
+    for signal in MICRO_ORDER:
+        if not signals & signal:
+            continue
+        arg = _ARG_SOURCE.get(sel_arg, "cu.get_arg()")
+        match signal:
+            case Micro.INTERRUPT:
+                lines.append("    if cu.events is not None:")
+                lines.append("        cu.poll_interrupts()")
+            case Micro.ACC_OUT_OFF:
+                lines.append("    dp.set_acc_out(False)")
+            case Micro.LATCH_ADDR:
+                lines.append(f"    dp.latch_data_addr({arg})")
+            case Micro.OE_OFF:
+                lines.append("    dp.set_oe(False)")
+            case Micro.WR_OFF:
+                lines.append("    dp.set_wr(False)")
+            case Micro.LATCH_PC:
+                lines.append("    if cu.sel_next is PC_INC:")
+                lines.append("        cu.program_counter += 1")
+                lines.append("    elif cu.sel_next is PC_ARG:")
+                lines.append("        cu.program_counter = cu.get_arg()")
+                lines.append("    else:")
+                lines.append("        cu.program_counter = cu.int_addr")
+            case Micro.FETCH:
+                lines.append("    cu.instr_cnt += 1")
+                lines.append("    if cu.tracer is not None:")
+                lines.append("        cu.tracer.fetched(cu.program[cu.program_counter])")
+            case Micro.SEL_NEXT_INC:
+                lines.append("    cu.sel_next = PC_INC")
+            case Micro.SEL_ARG_IMM:
+                lines.append("    cu.sel_arg = ARG_IMM")
+                sel_arg = ControlUnit.ArgMux.IMM
+            case Micro.SEL_ARG_DATA:
+                lines.append("    cu.sel_arg = ARG_DATA")
+                sel_arg = ControlUnit.ArgMux.DATA
+            case Micro.OE_ON:
+                lines.append("    dp.set_oe(True)")
+            case Micro.MEM_READ | Micro.MEM_WRITE:
+                lines.append("    if dp.cache is not None:")
+                lines.append(f"        cu.tick_cnt += dp.cache_access(dp.data_address, {signal == Micro.MEM_WRITE})")
+            case Micro.ALU:
+                lines.append(f"    res = cu.alu({word_alu(word).name}, dp.acc, {arg})")
+                lines.append("    dp.acc_in = res")
+                lines.append("    cu.Z = res == 0")
+                lines.append("    cu.N = res < 0")
+            case Micro.CMP:
+                lines.append(f"    acc, arg = dp.acc, {arg}")
+                lines.append("    exact = sign_extend(acc) - sign_extend(arg)")
+                lines.append("    res = sign_extend(exact)")
+                lines.append("    cu.V = res != exact")
+                lines.append("    cu.C = CMP_CARRY(to_unsigned(acc), to_unsigned(arg))")
+                lines.append("    cu.Z = res == 0")
+                lines.append("    cu.N = res < 0")
+            case Micro.SETG | Micro.SETL | Micro.SETE:
+                lines.append(f"    res = {_SET_SOURCE[signal]}")
+                lines.append("    dp.acc_in = res")
+                lines.append("    cu.Z = res == 0")
+                lines.append("    cu.N = res < 0")
+                lines.append("    cu.V = cu.C = False")
+            case Micro.JUMP:
+                lines.append("    cu.sel_next = PC_ARG")
+            case Micro.JUMP_Z:
+                lines.append("    if cu.Z:")
+                lines.append("        cu.sel_next = PC_ARG")
+            case Micro.JUMP_NZ:
+                lines.append("    if not cu.Z:")
+                lines.append("        cu.sel_next = PC_ARG")
+            case Micro.EI:
+                lines.append("    cu.ie = True")
+            case Micro.DI:
+                lines.append("    cu.ie = False")
+            case Micro.IRET:
+                lines.append("    cu.interrupt_return()")
+            case Micro.ACC_OUT_ON:
+                lines.append("    dp.set_acc_out(True)")
+            case Micro.WR_ON:
+                lines.append("    dp.set_wr(True)")
+            case Micro.LATCH_ACC:
+                lines.append("    dp.latch_acc()")
+            case Micro.HALT:
+                lines.append("    if not cu.can_wait():")
+                lines.append("        raise StopIteration()")
+                lines.append("    cu.waiting = True")
+            case Micro.ARG_SKIP:
+                lines.append("    if cu.tracer is not None:")
+                lines.append("        cu.tracer.arg_skipped()")
+    if addr == FAULT_ADDR:
+        lines.append("    cu.program[cu.program_counter]")
+        lines.append("    raise LogicError('Инструкция вне программы')")
+        return lines
+    if not signals & Micro.ARG_SKIP:
+        lines.append("    cu.tick_cnt += 1")
+    lines.append(f"    cu.stage = {next_stage.name}")
+    lines.append(f"    cu.step_cnt = {next_step}")
+    if next_addr is not None:
+        lines.append(f"    cu.upc = {next_addr}")
+        return lines
+    # декодирование: адрес последовательности выбранной инструкции
+    lines.append("    try:")
+    lines.append("        instr = cu.program[cu.program_counter]")
+    lines.append("    except IndexError:")
+    lines.append(f"        cu.upc = {FAULT_ADDR}")
+    lines.append("        return")
+    lines.append("    cu.upc = DISPATCH[instr.opcode, None if instr.arg is None else instr.arg_type]")
+    return lines
+
+
+def compile_rom(rom: list[int], dispatch: dict[tuple[Opcode, ArgType | None], int]) -> list[Callable[[ControlUnit, DataPath], None]]:
+    # положение мультиплексора аргумента и шаг этапа перед каждой микрокомандой
+    sel_args: list[ControlUnit.ArgMux | None] = [None] * len(rom)
+    steps: list[int] = [0] * len(rom)
+    for (opcode, arg_type), start in dispatch.items():
+        if arg_type is None:
+            continue
+        sel_arg = ControlUnit.ArgMux.IMM
+        for offset in range(len(arg_sequence(arg_type)) + 1):
+            sel_args[start + offset] = sel_arg
+            if word_stage(rom[start + offset]) == ControlUnit.Stage.ARG_FETCH:
+                steps[start + offset] = offset
+            if word_signals(rom[start + offset]) & Micro.SEL_ARG_DATA:
+                sel_arg = ControlUnit.ArgMux.DATA
+
+    lines: list[str] = []
+    for addr, word in enumerate(rom):
+        signals = word_signals(word)
+        if signals & Micro.DISPATCH:
+            next_addr, next_stage, next_step = None, ControlUnit.Stage.ARG_FETCH, 0
+        elif signals & Micro.END or addr == FAULT_ADDR:
+            next_addr, next_stage, next_step = FETCH_ADDR, ControlUnit.Stage.INSTR_FETCH, 0
+        else:
+            next_addr, next_stage, next_step = addr + 1, word_stage(rom[addr + 1]), steps[addr + 1]
+        lines.extend(word_source(addr, word, sel_args[addr], next_addr, next_stage, next_step))
+        lines.append("")
+    namespace = {
+        'PC_INC': ControlUnit.PCMux.INC, 'PC_ARG': ControlUnit.PCMux.ARG,
+        'ARG_IMM': ControlUnit.ArgMux.IMM, 'ARG_DATA': ControlUnit.ArgMux.DATA,
+        **{stage.name: stage for stage in ControlUnit.Stage},
+        **{opcode.name: opcode for opcode in ALU_OPCODES},
+        'sign_extend': sign_extend, 'to_unsigned': to_unsigned, 'CMP_CARRY': ALU_CARRY[Opcode.CMP],
+        'LogicError': LogicError, 'DISPATCH': dispatch,
+    }
+    exec(compile("\n".join(lines), "<microcode>", "exec"), namespace)
+    return [namespace[f"u{addr}"] for addr in range(len(rom))]
+
+
+ROM, DISPATCH = build_rom()
+HANDLERS = compile_rom(ROM, DISPATCH)
+
+
+class MicroControlUnit(ControlUnit):
+    def __init__(self, input_buffer: TextIO | list[str] | InputSchedule, program: list[Instruction],
+                 data: dict[int, list[int]] | None = None, output: TextIO | None = None,
+                 tracer: Tracer | None = None, overflow: str | None = None, cache: DataCache | None = None) -> None:
+        # адрес текущей микрокоманды, нужен уже для секции preload
+        self.upc: int = FETCH_ADDR
+        super().__init__(input_buffer, program, data, output, tracer, overflow, cache)
+
+    # Адрес микрокоманды по этапу и шагу этапа (после восстановления снимка)
+    def sync(self):
+        if self.stage == ControlUnit.Stage.INSTR_FETCH:
+            self.upc = FETCH_ADDR
+            return
+        if not 0 <= self.program_counter < len(self.program):
+            self.upc = FAULT_ADDR
+            return
+        instr = self.program[self.program_counter]
+        start = DISPATCH[instr.opcode, None if instr.arg is None else instr.arg_type]
+        if self.stage == ControlUnit.Stage.ARG_FETCH:
+            self.upc = start + self.step_cnt
+        else:
+            self.upc = start + len(arg_sequence(ArgType.IMMEDIATE if instr.arg is None else instr.arg_type))
+
+    def tick(self):
+        if self.tracer is not None:
+            self.tracer.tick(self)
+        HANDLERS[self.upc](self, self.datapath)
+
+
+# Устройства управления для выбора в командной строке
+CONTROL_UNITS: dict[str, type[ControlUnit]] = {
+    'hardwired': ControlUnit,
+    'microcode': MicroControlUnit,
+}
+
+
+def describe(addr: int, word: int) -> dict:
+    signals = word_signals(word)
+    res = {'addr': addr, 'word': f"{word:#012x}", 'stage': word_stage(word).name,
+           'signals': [signal.name for signal in MICRO_ORDER if signals & signal]}
+    alu = word_alu(word)
+    if alu is not None:
+        res['alu'] = alu.name
+    return res
+
+
+def dump(file: TextIO, as_json: bool = False):
+    if as_json:
+        json.dump({
+            'rom': [describe(addr, word) for addr, word in enumerate(ROM)],
+            'dispatch': [{'opcode': opcode.name, 'arg_type': None if arg_type is None else arg_type.name, 'addr': addr}
+                         for (opcode, arg_type), addr in DISPATCH.items()],
+        }, file, indent=1)
+        file.write("\n")
+        return
+    entries: dict[int, list[str]] = {}
+    for (opcode, arg_type), addr in DISPATCH.items():
+        if arg_type is not None:
+            entries.setdefault(addr, []).append(f"{opcode.name} {arg_type.name}")
+    for addr, word in enumerate(ROM):
+        for name in entries.get(addr, []):
+            file.write(f"{name}:\n")
+        info = describe(addr, word)
+        alu = f" ALU={info['alu']}" if 'alu' in info else ""
+        file.write(f"{addr:4} {info['word']} {info['stage']:<11} {' '.join(info['signals'])}{alu}\n")
+
+
+def main(args: list[str]):
+    parser = argparse.ArgumentParser(prog="microcode.py", description="вывод ПЗУ микрокоманд")
+    parser.add_argument("--json", action="store_true", help="в JSON вместо текста")
+    options = parser.parse_args(args)
+    dump(sys.stdout, options.json)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,331 @@
+from __future__ import annotations
+
+from isa import ArgType, Instruction, Opcode
+from control_unit import ALU_OPERATIONS, INSTRUCTION_TICKS, WORD_MAX, WORD_MIN, sign_extend
+from datapath import DataPath
+
+# Оптимизация машинного кода окном (peephole) между разбором и записью.
+#
+# Переходы по меткам идут либо по адресу, разрешенному при трансляции
+# (JNZ IMMEDIATE <адрес>), либо через ячейку метки (JNZ DIRECT .loop), поэтому
+# при удалении инструкций адреса переходов и ячейки меток пересчитываются:
+# переход попадает в ту же инструкцию (или в следующую сохраненную, если она удалена).
+# Удалять инструкции можно только если поток управления известен статически:
+# все переходы - IMMEDIATE или DIRECT по ячейкам меток, ячейки меток больше нигде
+# не используются, нет косвенной адресации, записи ST DIRECT и прерываний
+# (обработчик меняет память между любыми двумя инструкциями). Иначе выполняются
+# только замены на месте.
+# Ввод-вывод (обращения к #STDIN/#STDOUT) никогда не удаляется и не переставляется,
+# меняются только такты и состояние, не видимое снаружи (шина, адрес данных).
+
+_JUMPS = (Opcode.JMP, Opcode.JZ, Opcode.JNZ)
+_INTERRUPTS = (Opcode.EI, Opcode.DI, Opcode.IRET)
+_IO = (DataPath.INPUT_ADDR, DataPath.OUTPUT_ADDR)
+# инструкции, не использующие аргумент
+_NO_OPERAND = (Opcode.HLT, Opcode.NOT, Opcode.NEG, Opcode.INC, Opcode.DEC, Opcode.SETE, Opcode.SETG, Opcode.SETL,
+               *_INTERRUPTS)
+# инструкции, читающие аргумент как значение
+_VALUE_OPERAND = (Opcode.LD, Opcode.ADD, Opcode.SUB, Opcode.MUL, Opcode.DIV, Opcode.REM, Opcode.AND, Opcode.OR, Opcode.CMP)
+
+KINDS = (
+    'operandless', 'folded_operands', 'folded_alu', 'redundant_loads', 'redundant_stores',
+    'dead_stores', 'threaded_jumps', 'removed_jumps', 'unreachable',
+)
+
+
+class Report:
+    def __init__(self, program: list[Instruction]) -> None:
+        self.counts: dict[str, int] = {kind: 0 for kind in KINDS}
+        self.instructions_before = len(program)
+        # такты считаются статически, по тексту программы (static_ticks), а не по исполнению
+        self.static_ticks_before = static_ticks(program)
+        self.instructions_after = self.instructions_before
+        self.static_ticks_after = self.static_ticks_before
+        # удаление инструкций было запрещено (поток управления не известен статически)
+        self.fixed_layout = False
+
+    def __str__(self) -> str:
+        done = ", ".join(f"{kind}: {count}" for kind, count in self.counts.items() if count)
+        return (
+            f"optimizer: instructions {self.instructions_before} -> {self.instructions_after}, "
+            f"static ticks {self.static_ticks_before} -> {self.static_ticks_after}"
+            + (" (layout fixed)" if self.fixed_layout else "")
+            + (f"; {done}" if done else "")
+        )
+
+
+# Сумма тактов всех инструкций кода, каждая один раз. Это не такты исполнения:
+# циклы и ветвления не учитываются, исполненные такты показывает machine.py
+def static_ticks(program: list[Instruction]) -> int:
+    return sum(INSTRUCTION_TICKS[i.opcode, ArgType.IMMEDIATE if i.arg is None else i.arg_type] for i in program)
+
+
+def _fits(value: int) -> bool:
+    return WORD_MIN <= value <= WORD_MAX
+
+
+class _Optimizer:
+    def __init__(self, translated) -> None:
+        self.translated = translated
+        self.code: list[Instruction] = translated.program
+        self.report = Report(self.code)
+        self.label_cells: set[int] = set(translated.marks.values())
+        # индекс инструкции, на которую попадает переход по ячейке метки (-1 - маркер program)
+        self.targets: dict[int, int] = {cell: translated.data[cell] - 1 for cell in self.label_cells}
+        self.removed: set[int] = set()
+
+    # Индекс инструкции, на которую ведет переход
+    def target(self, instr: Instruction) -> int:
+        if instr.arg_type == ArgType.IMMEDIATE:
+            return instr.arg - 1
+        return self.targets[instr.arg]
+
+    # --анализ--
+    def static_layout(self) -> bool:
+        for instr in self.code:
+            if instr.opcode in _INTERRUPTS:
+                return False
+            if instr.opcode in _JUMPS:
+                if instr.arg_type == ArgType.IMMEDIATE:
+                    if not -1 <= instr.arg - 1 < len(self.code):
+                        return False
+                elif instr.arg_type != ArgType.DIRECT or instr.arg not in self.label_cells:
+                    return False
+            elif instr.arg in self.label_cells:
+                return False
+            if instr.arg_type == ArgType.INDIRECT or (instr.opcode == Opcode.ST and instr.arg_type == ArgType.DIRECT):
+                return False
+        return all(-1 <= target < len(self.code) for target in self.targets.values())
+
+    def constants(self) -> dict[int, int]:
+        written: set[int] = set()
+        for instr in self.code:
+            if instr.opcode == Opcode.ST:
+                if instr.arg_type != ArgType.IMMEDIATE:
+                    return {}
+                written.add(instr.arg)
+        return {
+            addr: value for addr, value in self.translated.data.items()
+            if addr not in written and addr not in self.label_cells
+        }
+
+    # Адреса, куда приходят переходы, и начало программы
+    def entries(self) -> set[int]:
+        return {0} | {self.target(instr) for instr in self.code if instr.opcode in _JUMPS}
+
+    # Начала базовых блоков: точки входа и инструкции после переходов
+    def leaders(self) -> set[int]:
+        return self.entries() | {i + 1 for i, instr in enumerate(self.code) if instr.opcode in _JUMPS}
+
+    def remove(self, index: int, kind: str):
+        self.removed.add(index)
+        self.report.counts[kind] += 1
+
+    # Удаление отмеченных инструкций и пересчет целей переходов, True если что-то удалено
+    def compact(self) -> bool:
+        if not self.removed:
+            return False
+        survivors_before: list[int] = []
+        count = 0
+        for i in range(len(self.code) + 1):
+            survivors_before.append(count)
+            if i < len(self.code) and i not in self.removed:
+                count += 1
+        for cell, target in self.targets.items():
+            if target >= 0:
+                self.targets[cell] = survivors_before[target]
+        for instr in self.code:
+            if instr.opcode in _JUMPS and instr.arg_type == ArgType.IMMEDIATE and instr.arg >= 1:
+                instr.arg = survivors_before[instr.arg - 1] + 1
+        keep = [i for i in range(len(self.code)) if i not in self.removed]
+        self.code[:] = [self.code[i] for i in keep]
+        self.translated.labels[:] = [self.translated.labels[i] for i in keep]
+        self.removed.clear()
+        return True
+
+    # --замены на месте--
+    def operandless(self) -> bool:
+        changed = False
+        for instr in self.code:
+            if instr.opcode in _NO_OPERAND and instr.arg_type == ArgType.DIRECT and instr.arg not in _IO:
+                instr.arg_type, instr.arg = ArgType.IMMEDIATE, 0
+                self.report.counts['operandless'] += 1
+                changed = True
+        return changed
+
+    def fold_operands(self, constants: dict[int, int]) -> bool:
+        changed = False
+        for instr in self.code:
+            if instr.opcode not in _VALUE_OPERAND:
+                continue
+            # косвенное обращение через указатель на устройство ввод не выполняет,
+            # а прямое выполнило бы - такой указатель не сворачивается
+            if instr.arg_type == ArgType.INDIRECT and instr.arg in constants and constants[instr.arg] not in _IO:
+                instr.arg_type, instr.arg = ArgType.DIRECT, constants[instr.arg]
+                self.report.counts['folded_operands'] += 1
+                changed = True
+            if instr.arg_type == ArgType.DIRECT and instr.arg in constants:
+                instr.arg_type, instr.arg = ArgType.IMMEDIATE, constants[instr.arg]
+                self.report.counts['folded_operands'] += 1
+                changed = True
+        return changed
+
+    # --удаление инструкций (только при статическом потоке управления)--
+    # LD IMMEDIATE a; <op> IMMEDIATE b -> LD IMMEDIATE (a op b)
+    def fold_alu(self, leaders: set[int]):
+        prev: int | None = None
+        for i, instr in enumerate(self.code):
+            if i in leaders:
+                prev = None
+            if prev is not None and instr.arg_type == ArgType.IMMEDIATE and instr.opcode in ALU_OPERATIONS:
+                first = self.code[prev]
+                if instr.opcode == Opcode.LD:
+                    self.remove(prev, 'folded_alu')
+                    prev = i
+                    continue
+                # как в ControlUnit.alu: операнды - слова, свертка только без переполнения
+                arg = sign_extend(instr.arg)
+                if instr.opcode not in (Opcode.DIV, Opcode.REM) or arg != 0:
+                    value = int(ALU_OPERATIONS[instr.opcode](sign_extend(first.arg), arg))
+                    if _fits(value):
+                        first.arg = value
+                        self.remove(i, 'folded_alu')
+                        continue
+            prev = i if instr.opcode == Opcode.LD and instr.arg_type == ArgType.IMMEDIATE else None
+
+    # ST IMMEDIATE x; LD DIRECT x -> ST IMMEDIATE x и LD DIRECT x; ST IMMEDIATE x -> LD DIRECT x
+    def redundant_memory(self, leaders: set[int]):
+        equal: set[int] = set()
+        flags_match_acc = False
+        for i, instr in enumerate(self.code):
+            if i in leaders:
+                equal, flags_match_acc = set(), False
+            op, arg = instr.opcode, instr.arg
+            if op in _JUMPS or op == Opcode.HLT:
+                equal, flags_match_acc = set(), False
+            elif op == Opcode.LD and instr.arg_type == ArgType.DIRECT and arg not in _IO:
+                if arg in equal and flags_match_acc:
+                    self.remove(i, 'redundant_loads')
+                    continue
+                equal, flags_match_acc = {arg}, True
+            elif op == Opcode.ST:
+                if arg in _IO:
+                    continue
+                if arg in equal:
+                    self.remove(i, 'redundant_stores')
+                    continue
+                equal.add(arg)
+            elif op == Opcode.CMP:
+                flags_match_acc = False
+            else:
+                equal, flags_match_acc = set(), True
+
+    # Запись, которую до чтения перезапишут или которую никто не читает.
+    # Анализ обратный: после перехода состояние неизвестно, начало блока на него не влияет
+    def dead_stores(self):
+        never_read = set(self.translated.data) - self.label_cells
+        for instr in self.code:
+            if instr.opcode != Opcode.ST and instr.arg_type == ArgType.DIRECT:
+                never_read.discard(instr.arg)
+        overwritten = set(never_read)
+        for i in range(len(self.code) - 1, -1, -1):
+            instr = self.code[i]
+            if instr.opcode in _JUMPS or instr.opcode == Opcode.HLT:
+                overwritten = set(never_read)
+            if instr.opcode == Opcode.ST:
+                if instr.arg not in _IO:
+                    if instr.arg in overwritten:
+                        self.remove(i, 'dead_stores')
+                    else:
+                        overwritten.add(instr.arg)
+            elif instr.arg_type == ArgType.DIRECT:
+                overwritten.discard(instr.arg)
+
+    # Переход на безусловный переход (или на такой же условный) ведет сразу к его цели
+    def thread_jumps(self) -> bool:
+        changed = False
+        for instr in self.code:
+            if instr.opcode not in _JUMPS:
+                continue
+            seen = {self.target(instr)}
+            while True:
+                target = self.target(instr)
+                if target < 0:
+                    break
+                landing = self.code[target]
+                if landing.opcode not in (Opcode.JMP, instr.opcode):
+                    break
+                new_target = self.target(landing)
+                if new_target in seen:
+                    break
+                if instr.arg_type == ArgType.IMMEDIATE:
+                    instr.arg = new_target + 1
+                elif landing.arg_type == ArgType.DIRECT:
+                    instr.arg = landing.arg
+                else:
+                    break
+                seen.add(new_target)
+                self.report.counts['threaded_jumps'] += 1
+                changed = True
+        return changed
+
+    # Переход на следующую инструкцию и код после JMP/HLT, на который нет переходов
+    def jumps_and_unreachable(self):
+        entries = self.entries()
+        reachable = True
+        for i, instr in enumerate(self.code):
+            if i in entries:
+                reachable = True
+            if not reachable:
+                self.remove(i, 'unreachable')
+                continue
+            if instr.opcode in _JUMPS and self.target(instr) == i + 1:
+                self.remove(i, 'removed_jumps')
+                continue
+            if instr.opcode in (Opcode.JMP, Opcode.HLT):
+                reachable = False
+
+    def run(self) -> Report:
+        movable = self.static_layout()
+        self.report.fixed_layout = not movable
+        constants = self.constants()
+        for _ in range(16):
+            changed = self.operandless()
+            changed = self.fold_operands(constants) or changed
+            if movable:
+                changed = self.thread_jumps() or changed
+                self.jumps_and_unreachable()
+                changed = self.compact() or changed
+                self.fold_alu(self.leaders())
+                changed = self.compact() or changed
+                self.redundant_memory(self.leaders())
+                changed = self.compact() or changed
+                self.dead_stores()
+                changed = self.compact() or changed
+            if not changed:
+                break
+        self.write_targets()
+        self.report.instructions_after = len(self.code)
+        self.report.static_ticks_after = static_ticks(self.code)
+        return self.report
+
+    # Новые адреса переходов в образ данных и в пары LD/ST секции preload
+    def write_targets(self):
+        translated = self.translated
+        for cell, target in self.targets.items():
+            translated.data[cell] = target + 1
+        preload = translated.preload
+        if not preload:
+            return
+        # программа начинается с ACC и флагами от последней загрузки preload
+        initial_acc = preload[-2].arg
+        for i in range(0, len(preload) - 1, 2):
+            if preload[i + 1].arg in self.targets:
+                preload[i].arg = self.targets[preload[i + 1].arg] + 1
+        if preload[-2].arg != initial_acc:
+            preload.append(Instruction(opcode=Opcode.LD, arg=initial_acc, arg_type=ArgType.IMMEDIATE))
+
+
+# Оптимизация Translated_data на месте, возвращает отчет
+def optimize(translated) -> Report:
+    return _Optimizer(translated).run()
@@ -0,0 +1,123 @@
+import io
+
+import pytest
+
+import translator
+from isa import ArgType, Opcode, data_runs
+from control_unit import ControlUnit
+from datapath import DataPath
+from machine import simulate
+
+# Оптимизатор не меняет вывод и завершение программы, отчет считает выполненные замены
+
+
+def run(source: str, stdin: str, optimize: bool) -> tuple:
+    translated = translator.translate(source)
+    report = translator.optimize(translated) if optimize else None
+    program = translator.machine_code(translated)
+    control_unit = ControlUnit(io.StringIO(stdin), program, data_runs(translated.data), io.StringIO())
+    status = simulate(control_unit, 'instr')
+    return status, "".join(control_unit.datapath.output.output_buffer), program, report
+
+
+def check(source: str, inputs: tuple[str, ...] = ('',)):
+    for stdin in inputs:
+        status, output, _, _ = run(source, stdin, False)
+        optimized_status, optimized_output, program, report = run(source, stdin, True)
+        assert (optimized_status, optimized_output) == (status, output), stdin
+    return program[1:], report
+
+
+def text(program) -> list[str]:
+    return [str(instr).strip() for instr in program]
+
+
+def test_fold_alu():
+    program, report = check("section .text:\n LD IMMEDIATE 6\n MUL IMMEDIATE 7\n SUB IMMEDIATE 6\n"
+                            " ST IMMEDIATE #STDOUT\n HLT")
+    assert text(program) == ['LD   [IMMEDIATE] 36', 'ST   [IMMEDIATE] 268435457', 'HLT  [IMMEDIATE] 0']
+    assert report.counts['folded_alu'] == 2
+    assert (report.instructions_before, report.instructions_after) == (5, 3)
+    # по 2 такта на инструкцию, HLT без операнды после замены на IMMEDIATE - 1
+    assert (report.static_ticks_before, report.static_ticks_after) == (10, 5)
+    assert "static ticks 10 -> 5" in str(report)
+
+
+def test_fold_operands():
+    program, report = check("section .text:\n LD DIRECT a\n ADD DIRECT b\n ST IMMEDIATE #STDOUT\n HLT\n"
+                            "section .data:\n a: 40\n b: 8")
+    assert text(program)[0] == 'LD   [IMMEDIATE] 48'
+    assert report.counts['folded_operands'] == 2
+
+
+def test_redundant_load():
+    program, report = check("section .text:\n LD DIRECT #STDIN\n ST IMMEDIATE x\n LD DIRECT x\n"
+                            " ST IMMEDIATE #STDOUT\n HLT\nsection .data:\n x: 0", ('a', ''))
+    assert report.counts['redundant_loads'] == 1
+    # после удаления загрузки x больше не читается, запись в x тоже удаляется
+    assert report.counts['dead_stores'] == 1
+    assert text(program) == ['LD   [DIRECT]    268435456', 'ST   [IMMEDIATE] 268435457', 'HLT  [IMMEDIATE] 0']
+
+
+def test_dead_store():
+    program, report = check("section .text:\n LD DIRECT #STDIN\n ST IMMEDIATE x\n LD DIRECT #STDIN\n"
+                            " ST IMMEDIATE x\n ADD DIRECT x\n ST IMMEDIATE #STDOUT\n HLT\n"
+                            "section .data:\n x: 0", ('ab', '01'))
+    assert report.counts['dead_stores'] == 1
+    assert [instr.opcode for instr in program].count(Opcode.ST) == 2
+
+
+# JNZ на JMP ведет сразу к цели JMP, код после HLT становится недостижимым
+JUMPS = """section .text:
+    .loop
+    LD DIRECT #STDIN
+    ST IMMEDIATE #STDOUT
+    CMP IMMEDIATE 10
+    JNZ DIRECT .again
+    HLT
+    LD IMMEDIATE 'x'
+    ST IMMEDIATE #STDOUT
+    .again
+    JMP DIRECT .loop
+"""
+
+
+def test_jump_threading():
+    program, report = check(JUMPS, ('ab\n', 'x\n', '\n', 'abc'))
+    assert report.counts['threaded_jumps'] == 1
+    assert report.counts['unreachable'] == 3
+    assert [instr.opcode for instr in program] == [Opcode.LD, Opcode.ST, Opcode.CMP, Opcode.JNZ, Opcode.HLT]
+    assert not report.fixed_layout
+
+
+# Поток управления или данные, которые не видны статически: инструкции не удаляются
+@pytest.mark.parametrize('body', [
+    " LD IMMEDIATE 'a'\n ST DIRECT p\n",
+    " LD INDIRECT p\n ST IMMEDIATE #STDOUT\n",
+    " LD DIRECT .loop\n ST IMMEDIATE t\n",
+], ids=['store through pointer', 'indirect', 'label as data'])
+def test_static_layout_guard(body: str):
+    source = ("section .text:\n .loop\n LD IMMEDIATE 1\n ADD IMMEDIATE 1\n" + body + " HLT\n JMP DIRECT .loop\n"
+              "section .data:\n p: 536870913\n t: 0")
+    program, report = check(source)
+    assert report.fixed_layout
+    assert report.instructions_after == report.instructions_before
+    assert report.counts['folded_alu'] == report.counts['unreachable'] == 0
+
+
+# указатель на устройство: косвенное обращение ввод не читает, прямое - читает
+IO_POINTER = f"""section .text:
+    LD INDIRECT in
+    SUB IMMEDIATE {DataPath.INPUT_ADDR - ord('0')}
+    ST IMMEDIATE #STDOUT
+    LD DIRECT #STDIN
+    ST IMMEDIATE #STDOUT
+    HLT
+section .data:
+    in: {DataPath.INPUT_ADDR}
+"""
+
+
+def test_io_pointer_not_folded():
+    program, _ = check(IO_POINTER, ('a', ''))
+    assert any(instr.arg_type == ArgType.INDIRECT for instr in program)
@@ -0,0 +1,215 @@
+from __future__ import annotations
+
+from typing import Callable
+
+from isa import ArgType, Opcode
+from control_unit import ARG_FETCH_TICKS, ControlUnit
+from datapath import RAM, DataPath, EndOfInput
+
+# Модель конвейерного исполнения поверх поинструкционного моделирования.
+#
+# Архитектурно инструкции исполняются обычным ControlUnit.step, поэтому вывод,
+# память, ACC и флаги совпадают с последовательным устройством. Модель по
+# каждой исполненной инструкции считает, когда она прошла бы трехступенчатый
+# конвейер F (выборка, 1 такт) -> A (выборка операнды, ARG_FETCH_TICKS тактов,
+# без операнды - без задержки) -> E (исполнение, 1 такт), если выборка
+# следующей инструкции совмещается с выборкой операнды и исполнением текущей.
+# В каждой ступени одна инструкция, порядок не меняется.
+#
+# Конфликты:
+# - по данным: операнда читается в A, а ST предыдущей инструкции пишет память
+#   в E того же такта. Если ST пишет ячейку, которую A читает (операнда или
+#   указатель INDIRECT), A ждет окончания E;
+# - структурные: A косвенной адресации занимает ступень два такта;
+# - по управлению: переход определяется в E. predictor задает политику:
+#   stall - после перехода выборка ждет его исполнения, not-taken - выборка
+#   продолжается со следующего адреса, bimodal - двухбитные счетчики и адрес
+#   последнего перехода по PC. При ошибке предсказания выбранные после перехода
+#   инструкции сбрасываются, выборка начинается после E перехода.
+#
+# Такты конвейера - начало E последней инструкции (HLT в E не засчитывается,
+# как в последовательном устройстве) или начало A инструкции, которой не
+# хватило ввода. Пузыри в E (такты без завершения инструкции) делятся по
+# причинам: каждая причина убирается по очереди и смотрится, насколько раньше
+# инструкция попала бы в E.
+
+PREDICTORS = ('stall', 'not-taken', 'bimodal')
+_JUMPS = (Opcode.JMP, Opcode.JZ, Opcode.JNZ)
+
+
+class Pipeline:
+    def __init__(self, control_unit: ControlUnit, predictor: str = 'bimodal') -> None:
+        assert predictor in PREDICTORS, f"Неизвестная политика переходов: {predictor}"
+        assert control_unit.datapath.cache is None, "Модель конвейера не учитывает кэш данных"
+        assert control_unit.events is None, "Модель конвейера не учитывает ввод по расписанию"
+        self.control_unit = control_unit
+        self.predictor = predictor
+        self._step: Callable[[], None] | None = None
+
+        # времена предыдущей инструкции: начало A, начало и конец E
+        self.a_start = 0
+        self.e_start = 0
+        self.e_end = 0
+        # адрес записи предыдущей инструкции (ST), None - не пишет
+        self.store_addr: int | None = None
+        # выборка следующей инструкции не раньше этого такта (переход)
+        self.redirect = 0
+        # bimodal: PC -> счетчик 0..3 (>= 2 - переход), PC -> адрес перехода
+        self.counters: dict[int, int] = {}
+        self.targets: dict[int, int] = {}
+
+        self.instructions = 0
+        self.ticks = 0
+        self.fill = 0
+        self.data_stalls = 0
+        self.structural_stalls = 0
+        self.control_stalls = 0
+        self.branches = 0
+        self.taken = 0
+        self.mispredictions = 0
+        self.flushed = 0
+
+    # Подмена ControlUnit.step оберткой, которая считает такты конвейера
+    def attach(self):
+        assert self._step is None, "Модель конвейера уже подключена"
+        cu = self.control_unit
+        step = cu.step
+
+        def pipelined_step():
+            if cu.stage != ControlUnit.Stage.INSTR_FETCH:
+                step()
+                return
+            pc = cu.next_pc()
+            instr = cu.program[pc] if isinstance(pc, int) and 0 <= pc < len(cu.program) else None
+            reads = self.reads(instr)
+            try:
+                step()
+            except StopIteration:
+                self.issue(pc, instr, reads, halted=True)
+                raise
+            except EndOfInput:
+                self.issue(pc, instr, reads, starved=True)
+                raise
+            self.issue(pc, instr, reads)
+
+        self._step = step
+        cu.step = pipelined_step
+
+    def detach(self):
+        assert self._step is not None, "Модель конвейера не подключена"
+        del self.control_unit.step
+        self._step = None
+
+    # Адреса, читаемые в A: (первый такт, второй такт); None - нет чтения.
+    # Указатель INDIRECT читается из памяти без сигналов, ввод не трогается
+    def reads(self, instr) -> tuple[int | None, int | None]:
+        if instr is None or instr.arg is None or instr.arg_type == ArgType.IMMEDIATE:
+            return None, None
+        addr = int(instr.arg)
+        if instr.arg_type == ArgType.DIRECT:
+            return addr, None
+        if addr == DataPath.INPUT_ADDR or addr == DataPath.OUTPUT_ADDR:
+            return addr, None
+        return addr, RAM.read(self.control_unit.datapath.mem, addr)
+
+    # Начало E инструкции при заданных ограничениях выборки и данных
+    def _schedule(self, a_len: int, redirect: int, data_ready: int) -> tuple[int, int]:
+        f_start = max(self.a_start, redirect)
+        a_start = max(f_start + 1, self.e_start, data_ready)
+        return a_start, max(a_start + a_len, self.e_end)
+
+    def issue(self, pc: int, instr, reads: tuple[int | None, int | None], halted: bool = False, starved: bool = False):
+        cu = self.control_unit
+        arg_type = ArgType.IMMEDIATE if instr is None or instr.arg is None else instr.arg_type
+        a_len = ARG_FETCH_TICKS[arg_type]
+
+        data_ready = 0
+        if self.store_addr is not None:
+            if reads[0] == self.store_addr:
+                data_ready = self.e_end
+            elif reads[1] == self.store_addr:
+                # второе чтение - на такт позже начала A
+                data_ready = self.e_end - 1
+
+        # пузыри по причинам: без конфликтов по данным и управлению, затем с данными, затем все
+        _, e_free = self._schedule(a_len, 0, 0)
+        _, e_data = self._schedule(a_len, 0, data_ready)
+        a_start, e_start = self._schedule(a_len, self.redirect, data_ready)
+        if self.instructions == 0:
+            self.fill = e_start
+        else:
+            self.structural_stalls += e_free - self.e_end
+            self.data_stalls += e_data - e_free
+            self.control_stalls += e_start - e_data
+        self.instructions += 1
+
+        if starved:
+            self.ticks = a_start
+            return
+        if halted:
+            self.ticks = e_start
+            return
+        self.a_start, self.e_start, self.e_end = a_start, e_start, e_start + 1
+        self.ticks = self.e_end
+        self.store_addr = None
+        if instr is not None and instr.opcode == Opcode.ST:
+            self.store_addr = cu.datapath.data_address
+
+        self.redirect = 0
+        if instr is None or instr.opcode not in _JUMPS:
+            return
+        # переход: следующая инструкция уже исполнена архитектурно, ее адрес известен
+        actual = cu.next_pc()
+        taken = cu.sel_next == ControlUnit.PCMux.ARG
+        self.branches += 1
+        self.taken += taken
+        if self.predictor == 'stall':
+            self.redirect = self.e_end
+            return
+        predicted = pc + 1
+        if self.predictor == 'bimodal':
+            counter = self.counters.get(pc, 1)
+            if counter >= 2 and pc in self.targets:
+                predicted = self.targets[pc]
+            self.counters[pc] = min(counter + 1, 3) if taken else max(counter - 1, 0)
+            if taken:
+                self.targets[pc] = actual
+        if predicted != actual:
+            self.mispredictions += 1
+            # в конвейер успели попасть одна или две инструкции ложного пути
+            self.flushed += 1 + (max(a_start + 1, e_start) < self.e_end)
+            self.redirect = self.e_end
+
+    @property
+    def stalls(self) -> int:
+        return self.data_stalls + self.structural_stalls + self.control_stalls
+
+    def to_json(self) -> dict:
+        cu = self.control_unit
+        return {
+            'predictor': self.predictor,
+            'instructions': self.instructions,
+            'ticks': self.ticks,
+            'cpi': self.ticks / self.instructions if self.instructions else 0.0,
+            'sequential_ticks': cu.tick_cnt,
+            'sequential_cpi': cu.tick_cnt / cu.instr_cnt if cu.instr_cnt else 0.0,
+            'fill': self.fill,
+            'stalls': self.stalls,
+            'data_stalls': self.data_stalls,
+            'structural_stalls': self.structural_stalls,
+            'control_stalls': self.control_stalls,
+            'branches': self.branches,
+            'taken': self.taken,
+            'mispredictions': self.mispredictions,
+            'flushed': self.flushed,
+        }
+
+    def report(self) -> str:
+        res = self.to_json()
+        return "\n".join([
+            f"pipeline ({res['predictor']}): {res['instructions']} instructions, {res['ticks']} ticks, CPI {res['cpi']:.3f} "
+            f"(последовательно {res['sequential_ticks']} ticks, CPI {res['sequential_cpi']:.3f})",
+            f"stalls {res['stalls']}: data {res['data_stalls']}, structural {res['structural_stalls']}, "
+            f"control {res['control_stalls']}; fill {res['fill']}",
+            f"branches {res['branches']}, taken {res['taken']}, mispredicted {res['mispredictions']}, flushed {res['flushed']}",
+        ])
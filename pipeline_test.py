@@ -0,0 +1,117 @@
+import io
+
+import pytest
+
+import translator
+from control_unit import ControlUnit
+from isa import data_runs
+from machine import simulate
+from pipeline import PREDICTORS, Pipeline
+
+# Модель конвейера: такты, CPI и пузыри по причинам на коротких программах
+
+DATA = "section .data:\n x: 0\n y: 0\n p: 536870912\n"
+
+
+# Трансляция с --preload: маркер program выбирается до начала счета тактов
+def control_unit(source: str, stdin: str = "") -> ControlUnit:
+    translated = translator.translate(source, True)
+    return ControlUnit(io.StringIO(stdin), translator.machine_code(translated), data_runs(translated.data),
+                       io.StringIO())
+
+
+def pipeline(source: str, predictor: str = 'bimodal', stdin: str = "") -> Pipeline:
+    model = Pipeline(control_unit(source, stdin), predictor)
+    model.attach()
+    if simulate(model.control_unit, 'instr') == 'eof':
+        return model
+    res = model.to_json()
+    # такты = заполнение + по такту на каждую следующую инструкцию + пузыри
+    assert res['ticks'] == res['fill'] + res['instructions'] - 1 + res['stalls']
+    return model
+
+
+def stalls(model: Pipeline) -> tuple[int, int, int]:
+    return model.data_stalls, model.structural_stalls, model.control_stalls
+
+
+def test_straight_line():
+    model = pipeline("section .text:\n LD IMMEDIATE 1\n ADD IMMEDIATE 2\n SUB IMMEDIATE 3\n MUL IMMEDIATE 4\n"
+                     " HLT IMMEDIATE 0\n" + DATA)
+    res = model.to_json()
+    assert (res['instructions'], res['fill'], res['ticks'], res['cpi']) == (5, 1, 5, 1.0)
+    assert stalls(model) == (0, 0, 0)
+    assert res['sequential_cpi'] > res['cpi']
+
+
+# выборка операнды DIRECT (такт в A) совмещается с E предыдущей инструкции,
+# второй такт A у INDIRECT - пузырь
+def test_operand_fetch():
+    model = pipeline("section .text:\n LD DIRECT x\n ADD DIRECT y\n ADD INDIRECT p\n ADD IMMEDIATE 1\n"
+                     " HLT IMMEDIATE 0\n" + DATA)
+    assert (model.fill, model.instructions, model.ticks) == (2, 5, 7)
+    assert stalls(model) == (0, 1, 0)
+
+
+# ST пишет в E, следующая инструкция читает ту же ячейку в A. Если E записи
+# задержан (перед ней LD INDIRECT), A чтения ждет окончания записи
+@pytest.mark.parametrize('first, load, data_stalls', [
+    ("LD IMMEDIATE 1", "ST IMMEDIATE x\n LD DIRECT x", 0),
+    ("LD INDIRECT p", "ST IMMEDIATE x\n LD DIRECT x", 1),
+    ("LD INDIRECT p", "ST IMMEDIATE y\n LD DIRECT x", 0),
+    # INDIRECT после записи: указатель читается в первый такт A, ячейка - во второй
+    ("LD INDIRECT p", "ST IMMEDIATE p\n LD INDIRECT p", 1),
+    ("LD INDIRECT p", "ST IMMEDIATE x\n LD INDIRECT p", 0),
+    ("LD INDIRECT p", "ST IMMEDIATE y\n LD INDIRECT p", 0),
+])
+def test_data_hazards(first: str, load: str, data_stalls: int):
+    model = pipeline(f"section .text:\n {first}\n {load}\n HLT IMMEDIATE 0\n" + DATA)
+    assert model.data_stalls == data_stalls
+    assert model.control_stalls == 0
+
+
+# 4 прохода цикла: 3 перехода выполнены, последний нет
+LOOP = "section .text:\n .start\n LD IMMEDIATE 4\n .loop\n DEC\n JNZ DIRECT .loop\n HLT IMMEDIATE 0\n"
+
+
+@pytest.mark.parametrize('predictor, mispredictions, flushed, control_stalls', [
+    # выборка после каждого перехода ждет его E: 2 такта, перед HLT без операнды - 1
+    ('stall', 0, 0, 7),
+    # ошибка на каждом выполненном переходе, сбрасываются 2 инструкции ложного пути
+    ('not-taken', 3, 6, 6),
+    # счетчик 1 - первый переход ошибочен, последний предсказан выполненным
+    ('bimodal', 2, 4, 3),
+])
+def test_branches(predictor: str, mispredictions: int, flushed: int, control_stalls: int):
+    model = pipeline(LOOP, predictor)
+    assert (model.branches, model.taken) == (4, 3)
+    assert (model.mispredictions, model.flushed, model.control_stalls) == (mispredictions, flushed, control_stalls)
+    assert model.data_stalls == 0
+
+
+CAT = "section .text:\n .start\n .loop\n LD DIRECT #STDIN\n ST IMMEDIATE x\n LD DIRECT x\n ST IMMEDIATE #STDOUT\n" \
+      " JNZ DIRECT .loop\n HLT IMMEDIATE 0\n" + DATA
+
+
+# Архитектурно модель - обычный step: вывод, счетчики, ACC и память совпадают
+@pytest.mark.parametrize('predictor', PREDICTORS)
+def test_same_as_step(predictor: str):
+    reference = control_unit(CAT, "abc\0")
+    status = simulate(reference, 'instr')
+    model = pipeline(CAT, predictor, "abc\0")
+    cu = model.control_unit
+    assert status == 'halt'
+    assert cu.datapath.output.output_buffer == reference.datapath.output.output_buffer == list("abc\0")
+    assert (cu.tick_cnt, cu.instr_cnt, cu.datapath.acc) == (reference.tick_cnt, reference.instr_cnt, reference.datapath.acc)
+    assert cu.datapath.mem.read(536870912) == reference.datapath.mem.read(536870912) == 0
+    assert model.to_json()['sequential_ticks'] == reference.tick_cnt
+    model.detach()
+    assert 'step' not in vars(cu)
+
+
+def test_end_of_input():
+    model = pipeline("section .text:\n .start\n .loop\n LD DIRECT #STDIN\n ST IMMEDIATE #STDOUT\n JMP DIRECT .loop\n",
+                     'bimodal', "ab")
+    # такты - до начала A инструкции, которой не хватило ввода
+    assert (model.instructions, model.ticks, model.mispredictions) == (7, 9, 1)
+    assert model.control_unit.datapath.output.output_buffer == ['a', 'b']
@@ -0,0 +1,141 @@
+from __future__ import annotations
+
+import json
+from typing import Callable
+
+from isa import ArgType, Instruction, Opcode
+from control_unit import ARG_FETCH_TICKS, ControlUnit
+
+# Профилировщик исполнения по адресам команд (PC) и по парам opcode/тип адресации.
+#
+# Профилировщик подменяет ControlUnit.step у конкретного экземпляра на
+# обертку, которая после каждой инструкции засчитывает ей исполнение и
+# потраченные такты. Пока профилировщик не подключен, ControlUnit не выполняет
+# никакой лишней работы. Обращения к памяти (чтения при выборке операнды,
+# запись командой ST, включая адреса ввода-вывода) постоянны для каждой
+# команды и считаются при построении отчета.
+# Карта исходного кода (translator.py --source-map) связывает PC со строками .asm.
+
+
+class Profiler:
+    def __init__(self, control_unit: ControlUnit, source_map: list[dict] | None = None) -> None:
+        self.control_unit = control_unit
+        self.program: list[Instruction] = control_unit.program
+        self.executions: list[int] = [0] * len(self.program)
+        self.ticks: list[int] = [0] * len(self.program)
+        # исполнения по адресам вне программы (переход мимо кода)
+        self.outside = 0
+        self.source: dict[int, dict] = {entry['pc']: entry for entry in source_map or []}
+        self._step: Callable[[], None] | None = None
+
+    # Подмена ControlUnit.step профилирующей оберткой
+    def attach(self):
+        assert self._step is None, "Профилировщик уже подключен"
+        cu = self.control_unit
+        step = cu.step
+        executions, ticks = self.executions, self.ticks
+        size = len(self.program)
+
+        def profiled_step():
+            if cu.stage != ControlUnit.Stage.INSTR_FETCH:
+                step()
+                return
+            start = cu.tick_cnt
+            try:
+                step()
+            finally:
+                pc = cu.program_counter
+                if isinstance(pc, int) and 0 <= pc < size:
+                    executions[pc] += 1
+                    ticks[pc] += cu.tick_cnt - start
+                else:
+                    self.outside += 1
+
+        self._step = step
+        cu.step = profiled_step
+
+    def detach(self):
+        assert self._step is not None, "Профилировщик не подключен"
+        del self.control_unit.step
+        self._step = None
+
+    @staticmethod
+    def memory_accesses(instr: Instruction) -> tuple[int, int]:
+        reads = 0 if instr.arg is None else ARG_FETCH_TICKS[instr.arg_type]
+        writes = 1 if instr.opcode == Opcode.ST else 0
+        return reads, writes
+
+    def _location(self, pc: int) -> dict:
+        entry = self.source.get(pc)
+        if entry is None:
+            return {'line': None, 'text': str(self.program[pc]).strip(), 'label': None, 'offset': None}
+        return {'line': entry['line'], 'text': entry['text'], 'label': entry['label'], 'offset': entry['offset']}
+
+    def by_pc(self) -> list[dict]:
+        rows: list[dict] = []
+        for pc, count in enumerate(self.executions):
+            if count == 0:
+                continue
+            reads, writes = self.memory_accesses(self.program[pc])
+            rows.append({
+                'pc': pc,
+                **self._location(pc),
+                'executions': count,
+                'ticks': self.ticks[pc],
+                'reads': reads * count,
+                'writes': writes * count,
+            })
+        rows.sort(key=lambda row: (-row['ticks'], row['pc']))
+        return rows
+
+    def by_opcode(self) -> list[dict]:
+        stats: dict[tuple[Opcode, ArgType | None], dict] = {}
+        for pc, count in enumerate(self.executions):
+            if count == 0:
+                continue
+            instr = self.program[pc]
+            key = (instr.opcode, None if instr.arg is None else instr.arg_type)
+            row = stats.setdefault(key, {
+                'opcode': instr.opcode.value,
+                'arg_type': None if key[1] is None else key[1].value,
+                'executions': 0, 'ticks': 0, 'reads': 0, 'writes': 0,
+            })
+            reads, writes = self.memory_accesses(instr)
+            row['executions'] += count
+            row['ticks'] += self.ticks[pc]
+            row['reads'] += reads * count
+            row['writes'] += writes * count
+        return sorted(stats.values(), key=lambda row: (-row['ticks'], row['opcode']))
+
+    def to_json(self) -> dict:
+        return {
+            'ticks': sum(self.ticks),
+            'instructions': sum(self.executions),
+            'outside': self.outside,
+            'pcs': self.by_pc(),
+            'opcodes': self.by_opcode(),
+        }
+
+    def report(self, top: int = 20) -> str:
+        total = sum(self.ticks) or 1
+        lines = [f"{'pc':>5} {'line':>5} {'location':<16} {'instruction':<24} {'count':>10} {'ticks':>10} {'%':>6} {'reads':>10} {'writes':>10}"]
+        for row in self.by_pc()[:top]:
+            location = '' if row['label'] is None else f"{row['label']}+{row['offset']}"
+            line = '' if row['line'] is None else row['line']
+            lines.append(
+                f"{row['pc']:>5} {line:>5} {location:<16} {row['text']:<24} {row['executions']:>10} "
+                f"{row['ticks']:>10} {100 * row['ticks'] / total:>6.1f} {row['reads']:>10} {row['writes']:>10}"
+            )
+        lines.append("")
+        lines.append(f"{'opcode':<6} {'arg_type':<10} {'count':>10} {'ticks':>10} {'%':>6} {'reads':>10} {'writes':>10}")
+        for row in self.by_opcode():
+            lines.append(
+                f"{row['opcode']:<6} {row['arg_type'] or '-':<10} {row['executions']:>10} {row['ticks']:>10} "
+                f"{100 * row['ticks'] / total:>6.1f} {row['reads']:>10} {row['writes']:>10}"
+            )
+        return "\n".join(lines)
+
+
+def load_source_map(path: str) -> list[dict]:
+    with open(path, encoding='utf-8') as file:
+        return json.load(file)['instructions']
@@ -0,0 +1,77 @@
+import io
+
+import translator
+from control_unit import INSTRUCTION_TICKS, ControlUnit
+from machine import simulate
+from profiler import Profiler
+
+# Профиль счетчика с трансляцией --preload: 3 прохода цикла от .loop
+SOURCE = """section .text:
+    .start
+    LD IMMEDIATE 3
+    ST IMMEDIATE n
+    .loop
+    LD DIRECT n
+    DEC
+    ST IMMEDIATE n
+    JNZ DIRECT .loop
+    HLT
+section .data:
+    n: 0
+"""
+
+
+def profile(source_map: bool = True) -> tuple[Profiler, ControlUnit]:
+    translated = translator.translate(SOURCE, True)
+    control_unit = ControlUnit(io.StringIO(), translator.machine_code(translated), {}, io.StringIO())
+    profiler = Profiler(control_unit, translator.source_map(translated, SOURCE) if source_map else None)
+    profiler.attach()
+    assert simulate(control_unit, 'instr') == 'halt'
+    return profiler, control_unit
+
+
+def test_by_pc():
+    profiler, control_unit = profile()
+    rows = {row['pc']: row for row in profiler.by_pc()}
+    assert sorted(rows) == list(range(1, 8))
+    assert [rows[pc]['executions'] for pc in range(1, 8)] == [1, 1, 3, 3, 3, 3, 1]
+    for pc, row in rows.items():
+        instr = control_unit.program[pc]
+        assert row['ticks'] == row['executions'] * INSTRUCTION_TICKS[instr.opcode, instr.arg_type]
+    assert sum(row['ticks'] for row in rows.values()) == profiler.to_json()['ticks']
+    # LD DIRECT n: операнда из памяти, ST IMMEDIATE n: запись без чтения
+    assert (rows[3]['reads'], rows[3]['writes']) == (3, 0)
+    assert (rows[5]['reads'], rows[5]['writes']) == (0, 3)
+    assert profiler.outside == 0
+
+
+def test_locations():
+    profiler, _ = profile()
+    rows = {row['pc']: row for row in profiler.by_pc()}
+    assert [(rows[pc]['label'], rows[pc]['offset']) for pc in range(1, 8)] == [
+        ('.start', 0), ('.start', 1), ('.loop', 0), ('.loop', 1), ('.loop', 2), ('.loop', 3), ('.loop', 4)]
+    assert (rows[4]['line'], rows[4]['text']) == (7, 'DEC')
+    assert "    4     7 .loop+1          DEC" in profiler.report()
+
+
+def test_without_source_map():
+    profiler, _ = profile(source_map=False)
+    row = next(row for row in profiler.by_pc() if row['pc'] == 4)
+    assert (row['line'], row['label'], row['text']) == (None, None, 'DEC  [DIRECT]    0')
+
+
+def test_by_opcode():
+    profiler, _ = profile()
+    rows = {(row['opcode'], row['arg_type']): row for row in profiler.by_opcode()}
+    assert rows['ST', 'IMMEDIATE']['executions'] == 4
+    assert (rows['ST', 'IMMEDIATE']['reads'], rows['ST', 'IMMEDIATE']['writes']) == (0, 4)
+    assert rows['LD', 'DIRECT']['executions'] == 3
+    assert rows['LD', 'IMMEDIATE']['executions'] == 1
+    assert sum(row['executions'] for row in rows.values()) == sum(profiler.executions)
+    assert sum(row['ticks'] for row in rows.values()) == sum(profiler.ticks)
+
+
+def test_detach():
+    profiler, control_unit = profile()
+    profiler.detach()
+    assert 'step' not in vars(control_unit)
@@ -0,0 +1,197 @@
+from __future__ import annotations
+
+import argparse
+import hashlib
+import marshal
+import os
+import sys
+
+from isa import BINARY_VERSION, ArgType, Instruction, Opcode
+from config import WORD_SIZE
+
+# Кэш оттранслированных и декодированных программ на диске.
+#
+# Запись - файл <isa>-<ключ>.bin в каталоге кэша, ключ - sha256 содержимого
+# (исходного кода с параметрами трансляции или машинного кода). Внутри - marshal
+# кортежа (версия формата, отпечаток ISA, данные). Инструкции хранятся как
+# кортежи (номер opcode, номер типа аргумента, аргумент, строка), поэтому
+# загрузка не разбирает текст.
+#
+# Отпечаток ISA строится по спискам Opcode и ArgType, WORD_SIZE и версии
+# бинарного формата. При изменении isa.py записи со старым отпечатком не
+# находятся и удаляются командой prune (или вытесняются по размеру).
+# Размер кэша ограничен: после записи удаляются давно не использованные записи
+# (время последнего обращения - mtime файла, обновляется при чтении).
+
+CACHE_VERSION = 1
+DEFAULT_LIMIT = 64 << 20
+# каталог кэша по умолчанию для translator.py, machine.py и batch.py
+CACHE_DIR_ENV = 'CSA_CACHE_DIR'
+
+_OPCODES: list[Opcode] = list(Opcode)
+_ARG_TYPES: list[ArgType] = list(ArgType)
+_OPCODE_INDEX: dict[Opcode, int] = {op: i for i, op in enumerate(_OPCODES)}
+_ARG_TYPE_INDEX: dict[ArgType, int] = {t: i for i, t in enumerate(_ARG_TYPES)}
+
+
+def isa_fingerprint() -> str:
+    digest = hashlib.sha256()
+    digest.update(repr(([op.value for op in _OPCODES], [t.value for t in _ARG_TYPES], WORD_SIZE, BINARY_VERSION)).encode())
+    return digest.hexdigest()[:12]
+
+
+def encode_program(instructions: list[Instruction]) -> list[tuple]:
+    return [
+        (_OPCODE_INDEX[i.opcode], _ARG_TYPE_INDEX[i.arg_type], i.arg, i.line)
+        for i in instructions
+    ]
+
+
+def decode_program(records: list[tuple]) -> list[Instruction]:
+    return [
+        Instruction(opcode=_OPCODES[opcode], arg=arg, arg_type=_ARG_TYPES[arg_type], line=line)
+        for opcode, arg_type, arg, line in records
+    ]
+
+
+class ProgramCache:
+    def __init__(self, path: str, limit: int = DEFAULT_LIMIT) -> None:
+        self.path = path
+        self.limit = limit
+        self.isa = isa_fingerprint()
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(path, exist_ok=True)
+
+    # Ключ по типу записи и ее исходным данным
+    @staticmethod
+    def key(kind: str, *parts: bytes | str) -> str:
+        digest = hashlib.sha256(kind.encode())
+        for part in parts:
+            part = part.encode() if isinstance(part, str) else part
+            digest.update(len(part).to_bytes(8, 'little'))
+            digest.update(part)
+        return digest.hexdigest()
+
+    def _file(self, key: str) -> str:
+        return os.path.join(self.path, f"{self.isa}-{key}.bin")
+
+    def get(self, key: str):
+        path = self._file(key)
+        try:
+            # marshal.load из файла читает мелкими порциями, loads от всего файла быстрее
+            with open(path, 'rb') as file:
+                version, isa, payload = marshal.loads(file.read())
+        except (OSError, EOFError, ValueError, TypeError):
+            self.misses += 1
+            return None
+        if version != CACHE_VERSION or isa != self.isa:
+            self.misses += 1
+            return None
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        self.hits += 1
+        return payload
+
+    def __contains__(self, key: str) -> bool:
+        return os.path.exists(self._file(key))
+
+    def put(self, key: str, payload):
+        path = self._file(key)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, 'wb') as file:
+            file.write(marshal.dumps((CACHE_VERSION, self.isa, payload)))
+        os.replace(tmp, path)
+        self.evict()
+
+    # --загрузка программы: (инструкции, образ данных)--
+    def get_program(self, key: str) -> tuple[list[Instruction], dict[int, list[int]]] | None:
+        payload = self.get(key)
+        if payload is None:
+            return None
+        return decode_program(payload['instructions']), payload['data']
+
+    def put_program(self, key: str, instructions: list[Instruction], data: dict[int, list[int]], **extra):
+        self.put(key, {'instructions': encode_program(instructions), 'data': data, **extra})
+
+    # --обслуживание--
+    def entries(self) -> list[os.DirEntry]:
+        with os.scandir(self.path) as it:
+            return [entry for entry in it if entry.is_file() and entry.name.endswith('.bin')]
+
+    # Удаление давно не использованных записей, пока кэш больше limit
+    def evict(self) -> int:
+        entries = [(entry.stat().st_mtime, entry.stat().st_size, entry.path) for entry in self.entries()]
+        total = sum(size for _, size, _ in entries)
+        removed = 0
+        for _, size, path in sorted(entries):
+            if total <= self.limit:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            removed += 1
+        return removed
+
+    # Удаление записей, сделанных для другой версии ISA
+    def prune(self) -> int:
+        removed = 0
+        for entry in self.entries():
+            if not entry.name.startswith(self.isa + '-'):
+                os.remove(entry.path)
+                removed += 1
+        return removed
+
+    def clear(self) -> int:
+        entries = self.entries()
+        for entry in entries:
+            os.remove(entry.path)
+        return len(entries)
+
+    def stats(self) -> dict:
+        entries = self.entries()
+        current = [entry for entry in entries if entry.name.startswith(self.isa + '-')]
+        return {
+            'path': self.path,
+            'isa': self.isa,
+            'entries': len(entries),
+            'stale': len(entries) - len(current),
+            'bytes': sum(entry.stat().st_size for entry in entries),
+            'limit': self.limit,
+        }
+
+
+# Кэш из флага командной строки или переменной окружения CSA_CACHE_DIR, None если не задан
+def open_cache(path: str | None = None, limit: int = DEFAULT_LIMIT) -> ProgramCache | None:
+    path = path or os.environ.get(CACHE_DIR_ENV)
+    if not path:
+        return None
+    return ProgramCache(path, limit)
+
+
+def main(args: list[str]):
+    parser = argparse.ArgumentParser(prog="program_cache.py")
+    parser.add_argument("cache_dir", nargs='?', help=f"каталог кэша, по умолчанию ${CACHE_DIR_ENV}")
+    parser.add_argument("--limit", type=int, default=DEFAULT_LIMIT, help="размер кэша в байтах")
+    action = parser.add_mutually_exclusive_group()
+    action.add_argument("--prune", action="store_true", help="удалить записи другой версии ISA и лишнее по размеру")
+    action.add_argument("--clear", action="store_true", help="удалить все записи")
+    options = parser.parse_args(args)
+
+    cache = open_cache(options.cache_dir, options.limit)
+    assert cache is not None, f"Не задан каталог кэша (аргумент или ${CACHE_DIR_ENV})"
+    if options.clear:
+        print(f"removed {cache.clear()}")
+    elif options.prune:
+        print(f"removed {cache.prune() + cache.evict()}")
+    else:
+        for name, value in cache.stats().items():
+            print(f"{name}: {value}")
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
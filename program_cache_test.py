@@ -0,0 +1,106 @@
+import os
+
+import pytest
+
+import program_cache
+import translator
+from isa import ArgType, Instruction, Opcode
+from machine import load_program
+from program_cache import ProgramCache
+
+# Кэш программ в каталоге tmp_path: попадания и промахи, вытеснение давно не
+# использованных записей по размеру, отпечатки ISA и реализации транслятора
+
+SOURCE = "section .text:\n .loop\n LD DIRECT #STDIN\n ST IMMEDIATE #STDOUT\n CMP IMMEDIATE 10\n JNZ DIRECT .loop\n HLT\n"
+
+
+def test_hit_and_miss(tmp_path):
+    cache = ProgramCache(str(tmp_path))
+    key = cache.key('asm', SOURCE, 'settings')
+    assert key != cache.key('asm', SOURCE, 'other settings')
+    assert key not in cache and cache.get(key) is None
+    cache.put(key, {'answer': 42})
+    assert key in cache and cache.get(key) == {'answer': 42}
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_program_round_trip(tmp_path):
+    cache = ProgramCache(str(tmp_path))
+    program = [Instruction(Opcode.program), Instruction(Opcode.LD, -5, ArgType.IMMEDIATE, line=3),
+               Instruction(Opcode.HLT, 0, ArgType.DIRECT)]
+    cache.put_program('k', program, {0x20000000: [1, 2]})
+    loaded, data = cache.get_program('k')
+    assert [(i.opcode, i.arg, i.arg_type, i.line) for i in loaded] == [(i.opcode, i.arg, i.arg_type, i.line) for i in program]
+    assert data == {0x20000000: [1, 2]}
+    assert cache.get_program('missing') is None
+
+
+def entry_size(tmp_path) -> int:
+    probe = ProgramCache(str(tmp_path / 'probe'))
+    probe.put('0', b'x' * 1000)
+    return os.path.getsize(probe._file('0'))
+
+
+def test_size_limit(tmp_path):
+    size = entry_size(tmp_path)
+    cache = ProgramCache(str(tmp_path / 'cache'), limit=3 * size)
+    for number in range(5):
+        cache.put(str(number), b'x' * 1000)
+        assert cache.stats()['bytes'] <= cache.limit
+    assert cache.stats()['entries'] == 3
+
+
+def test_lru_eviction(tmp_path):
+    size = entry_size(tmp_path)
+    cache = ProgramCache(str(tmp_path / 'cache'), limit=3 * size)
+    for age, key in enumerate('abc'):
+        cache.put(key, b'x' * 1000)
+        os.utime(cache._file(key), (1000 + age, 1000 + age))
+    # чтение обновляет время обращения: самой старой становится b
+    assert cache.get('a') is not None
+    cache.put('d', b'x' * 1000)
+    assert [key in cache for key in 'abcd'] == [True, False, True, True]
+    cache.put('e', b'x' * 1000)
+    assert [key in cache for key in 'abcde'] == [True, False, False, True, True]
+
+
+# Изменение isa.py (порядок opcode) меняет отпечаток: старые записи не находятся и удаляются prune
+def test_isa_change(tmp_path, monkeypatch):
+    cache = ProgramCache(str(tmp_path))
+    cache.put_program('k', [Instruction(Opcode.HLT, 0, ArgType.DIRECT)], {})
+    monkeypatch.setattr(program_cache, '_OPCODES', program_cache._OPCODES[::-1])
+    changed = ProgramCache(str(tmp_path))
+    assert changed.isa != cache.isa
+    assert changed.get_program('k') is None
+    assert changed.stats()['stale'] == 1
+    assert changed.prune() == 1 and changed.entries() == []
+
+
+def translate_file(tmp_path) -> str:
+    source, target = tmp_path / 'cat.asm', tmp_path / 'cat.code'
+    source.write_text(SOURCE, encoding='utf-8')
+    translator.main([str(source), str(target), '--cache', str(tmp_path / 'cache')])
+    return target.read_text(encoding='utf-8')
+
+
+# Запись трансляции находится по исходному коду, параметрам и отпечатку реализации транслятора
+def test_translator_cache(tmp_path, monkeypatch):
+    calls = []
+    translate = translator.translate
+    monkeypatch.setattr(translator, 'translate', lambda *args: calls.append(args) or translate(*args))
+    text = translate_file(tmp_path)
+    assert translate_file(tmp_path) == text
+    assert len(calls) == 1
+    monkeypatch.setattr(translator, 'implementation_fingerprint', lambda: 'changed')
+    assert translate_file(tmp_path) == text
+    assert len(calls) == 2
+
+
+def test_load_program(tmp_path):
+    translate_file(tmp_path)
+    cache = ProgramCache(str(tmp_path / 'cache'))
+    program, data = load_program(str(tmp_path / 'cat.code'), cache)
+    assert cache.hits == 1
+    assert [str(instr) for instr in program] == [str(instr) for instr in load_program(str(tmp_path / 'cat.code'))[0]]
+    with pytest.raises(OSError):
+        load_program(str(tmp_path / 'missing.code'), cache)
@@ -0,0 +1,227 @@
+from __future__ import annotations
+
+import argparse
+import asyncio
+import codecs
+import itertools
+import logging
+import sys
+
+from isa import Instruction
+from control_unit import OVERFLOW_MODES, ControlUnit
+from jit import BlockCompiler
+from machine import load_program, run_slice
+from program_cache import open_cache
+
+# Сервер интерактивных сессий моделирования на asyncio.
+#
+# Каждое подключение (TCP или Unix-сокет) - отдельная машина с одной и той же
+# программой: принятые от клиента байты (UTF-8) идут в устройство ввода, вывод
+# отправляется клиенту после каждой порции моделирования. Машины исполняются в
+# одном потоке по очереди порциями по slice тактов (run_slice), после порции
+# управление возвращается циклу событий. Машина, которой нужен ввод, а в буфере
+# его нет, не исполняется, пока клиент не пришлет данные, поэтому простаивающие
+# сессии не занимают процессор. Закрытие клиентом передачи - конец ввода.
+
+DEFAULT_SLICE = 10_000
+READ_SIZE = 1 << 12
+# сколько секунд после остановки машины ждать, пока клиент закроет передачу
+LINGER = 5.0
+# instr - поинструкционно, jit - по базовым блокам (такты и вывод совпадают)
+SESSION_ENGINES = ('instr', 'jit')
+
+Program = tuple[list[Instruction], dict[int, list[int]]]
+
+
+# Источник для InputDevice: текст, уже принятый из сокета
+class StreamInput:
+    def __init__(self) -> None:
+        self.buffer: list[str] = []
+        self.size = 0
+        self.closed = False
+
+    def feed(self, text: str):
+        if text:
+            self.buffer.append(text)
+            self.size += len(text)
+
+    def close(self):
+        self.closed = True
+
+    def read(self, size: int = -1) -> str:
+        text = "".join(self.buffer)
+        if 0 <= size < len(text):
+            self.buffer = [text[size:]]
+            self.size = len(text) - size
+            return text[:size]
+        self.buffer.clear()
+        self.size = 0
+        return text
+
+
+# sink для OutputDevice: запись в StreamWriter, отправка - в Session.flush
+class StreamOutput:
+    def __init__(self, writer: asyncio.StreamWriter) -> None:
+        self.writer = writer
+
+    def write(self, text: str):
+        self.writer.write(text.encode())
+
+    def flush(self):
+        pass
+
+
+class Session:
+    def __init__(self, number: int, program: Program, reader: asyncio.StreamReader, writer: asyncio.StreamWriter,
+                 slice_ticks: int = DEFAULT_SLICE, max_ticks: int | None = None, overflow: str | None = None,
+                 engine: str = 'jit') -> None:
+        assert engine in SESSION_ENGINES, f"Неизвестный режим моделирования сессии: {engine}"
+        self.number = number
+        self.reader = reader
+        self.writer = writer
+        self.slice_ticks = slice_ticks
+        self.max_ticks = max_ticks
+        self.source = StreamInput()
+        self.decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+        instructions, data = program
+        self.control_unit = ControlUnit(self.source, instructions, data, StreamOutput(writer), overflow=overflow)
+        self.device = self.control_unit.datapath.input
+        self.blocks = BlockCompiler(self.control_unit) if engine == 'jit' else None
+
+    # число принятых и еще не прочитанных машиной символов
+    def input_available(self) -> int:
+        return len(self.device.input_buffer) + self.source.size
+
+    async def receive(self):
+        chunk = await self.reader.read(READ_SIZE)
+        if chunk:
+            self.source.feed(self.decoder.decode(chunk))
+        else:
+            self.source.feed(self.decoder.decode(b'', final=True))
+            self.source.close()
+
+    async def flush(self):
+        output = self.control_unit.datapath.output
+        if output.output_buffer:
+            output.flush()
+            await self.writer.drain()
+
+    # Моделирование до остановки машины, возвращает причину остановки
+    async def run(self) -> str:
+        control_unit = self.control_unit
+        while True:
+            budget = self.slice_ticks
+            if self.max_ticks is not None:
+                if control_unit.tick_cnt >= self.max_ticks:
+                    return 'tick_limit'
+                budget = min(budget, self.max_ticks - control_unit.tick_cnt)
+            # после конца ввода машина читает его как обычный файл
+            available = None if self.source.closed else self.input_available
+            status = run_slice(control_unit, budget, available, self.blocks)
+            await self.flush()
+            if status == 'input':
+                await self.receive()
+            elif status == 'budget':
+                await asyncio.sleep(0)
+            else:
+                return status
+
+
+class SimulationServer:
+    def __init__(self, program: Program, slice_ticks: int = DEFAULT_SLICE,
+                 max_ticks: int | None = None, overflow: str | None = None, engine: str = 'jit') -> None:
+        assert slice_ticks > 0, "Порция моделирования должна быть положительной"
+        self.program = program
+        self.slice_ticks = slice_ticks
+        self.max_ticks = max_ticks
+        self.overflow = overflow
+        self.engine = engine
+        self.numbers = itertools.count()
+        self.active = 0
+        self.results: dict[str, int] = {}
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        session = Session(next(self.numbers), self.program, reader, writer,
+                          self.slice_ticks, self.max_ticks, self.overflow, self.engine)
+        self.active += 1
+        try:
+            status = await session.run()
+        except ConnectionError:
+            status = 'disconnected'
+        except Exception as e:
+            status = 'error'
+            logging.warning("session %d: %s: %s", session.number, type(e).__name__, e)
+            try:
+                await session.flush()
+            except ConnectionError:
+                pass
+        finally:
+            self.active -= 1
+        self.results[status] = self.results.get(status, 0) + 1
+        logging.info("session %d: %s, ticks %d, instructions %d", session.number, status,
+                     session.control_unit.tick_cnt, session.control_unit.instr_cnt)
+        await self.close(reader, writer)
+
+    # Машина остановилась, а клиент может еще передавать ввод: закрытие сокета с
+    # непрочитанными данными сбросило бы соединение вместе с неполученным выводом.
+    # Поэтому сначала закрывается передача, остаток ввода отбрасывается до EOF от клиента
+    async def close(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            if writer.can_write_eof():
+                writer.write_eof()
+            await asyncio.wait_for(self.discard(reader), LINGER)
+        except (ConnectionError, asyncio.TimeoutError):
+            pass
+        writer.close()
+        try:
+            await writer.wait_closed()
+        except ConnectionError:
+            pass
+
+    @staticmethod
+    async def discard(reader: asyncio.StreamReader):
+        while await reader.read(READ_SIZE):
+            pass
+
+    async def start(self, host: str | None = None, port: int | None = None,
+                    unix: str | None = None) -> asyncio.AbstractServer:
+        if unix is not None:
+            return await asyncio.start_unix_server(self.handle, unix)
+        return await asyncio.start_server(self.handle, host, port)
+
+
+async def serve(server: SimulationServer, host: str | None, port: int | None, unix: str | None):
+    listener = await server.start(host, port, unix)
+    for sock in listener.sockets:
+        print(f"listening on {sock.getsockname()}", file=sys.stderr, flush=True)
+    async with listener:
+        await listener.serve_forever()
+
+
+def main(args: list[str]):
+    parser = argparse.ArgumentParser(prog="server.py")
+    parser.add_argument("code_file")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--unix", metavar="PATH", help="слушать Unix-сокет вместо TCP")
+    parser.add_argument("--slice", type=int, default=DEFAULT_SLICE, metavar="N",
+                        help="такты моделирования одной сессии до передачи управления другим")
+    parser.add_argument("--engine", choices=SESSION_ENGINES, default='jit')
+    parser.add_argument("--max-ticks", type=int, default=None, help="лимит тактов на сессию")
+    parser.add_argument("--overflow", choices=OVERFLOW_MODES, default=None)
+    parser.add_argument("--cache", metavar="DIR", help="каталог кэша декодированных программ (по умолчанию $CSA_CACHE_DIR)")
+    parser.add_argument("-v", "--verbose", action="store_true", help="выводить итог каждой сессии в stderr")
+    options = parser.parse_args(args)
+    if options.verbose:
+        logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+    program = load_program(options.code_file, open_cache(options.cache))
+    server = SimulationServer(program, options.slice, options.max_ticks, options.overflow, options.engine)
+    try:
+        asyncio.run(serve(server, options.host, options.port, options.unix))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
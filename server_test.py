@@ -0,0 +1,146 @@
+import asyncio
+import io
+
+import pytest
+
+import server
+import translator
+from control_unit import ControlUnit
+from datapath import DataPath
+from isa import data_runs
+from jit import BlockCompiler
+from machine import run_slice
+from server import SimulationServer
+
+# Сервер на TCP-порту 0: одновременные сессии cat, порции моделирования и ожидание ввода
+
+CAT = """section .text:
+    .loop
+    LD DIRECT #STDIN
+    ST IMMEDIATE #STDOUT
+    CMP IMMEDIATE 10
+    JNZ DIRECT .loop
+    HLT
+"""
+
+# долгий счет без ввода, затем вывод символа
+COUNT = """section .text:
+    LD IMMEDIATE 300
+    .loop
+    DEC
+    JNZ DIRECT .loop
+    LD IMMEDIATE '!'
+    ST IMMEDIATE #STDOUT
+    HLT
+"""
+
+
+def program(source: str) -> server.Program:
+    translated = translator.translate(source)
+    return translator.machine_code(translated), data_runs(translated.data)
+
+
+# Запуск сервера, клиенты - корутины от порта, возвращает их результаты
+def serve(simulation: SimulationServer, *clients) -> list:
+    async def main():
+        listener = await simulation.start('127.0.0.1', 0)
+        port = listener.sockets[0].getsockname()[1]
+        async with listener:
+            return await asyncio.gather(*(client(port) for client in clients))
+    return asyncio.run(asyncio.wait_for(main(), 30))
+
+
+def cat_client(chunks: list[str], delay: float = 0.01):
+    async def client(port: int) -> str:
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        for chunk in chunks:
+            writer.write(chunk.encode())
+            await writer.drain()
+            await asyncio.sleep(delay)
+        writer.write_eof()
+        output = await reader.read()
+        writer.close()
+        return output.decode()
+    return client
+
+
+# Записывает порции моделирования: номер машины, бюджет, такты и результат
+@pytest.fixture
+def slices(monkeypatch):
+    calls = []
+    machines: dict[int, int] = {}
+
+    def recorded(control_unit, budget, *args):
+        ticks = control_unit.tick_cnt
+        status = run_slice(control_unit, budget, *args)
+        number = machines.setdefault(id(control_unit), len(machines))
+        calls.append((number, budget, control_unit.tick_cnt - ticks, status))
+        return status
+    monkeypatch.setattr(server, 'run_slice', recorded)
+    return calls
+
+
+@pytest.mark.parametrize('engine', server.SESSION_ENGINES)
+def test_concurrent_clients(engine: str):
+    simulation = SimulationServer(program(CAT), slice_ticks=20, engine=engine)
+    inputs = [["hello", " world\n"], ["a", "b", "c", "\n"], ["\n"], ["ab\ncd"], ["привет\n"]]
+    outputs = serve(simulation, *(cat_client(chunks) for chunks in inputs))
+    assert outputs == ["hello world\n", "abc\n", "\n", "ab\n", "привет\n"]
+    assert simulation.results == {'halt': len(inputs)}
+    assert simulation.active == 0
+
+
+def test_slice_scheduling(slices):
+    simulation = SimulationServer(program(COUNT), slice_ticks=50, max_ticks=5000, engine='instr')
+    outputs = serve(simulation, cat_client([]), cat_client([]))
+    assert outputs == ["!", "!"]
+    assert simulation.results == {'halt': 2}
+    # бюджет порции не больше slice, инструкция в конце порции доводится до конца
+    assert all(budget <= 50 for _, budget, _, _ in slices)
+    assert all(ticks < budget + 10 for _, budget, ticks, status in slices if status == 'budget')
+    # машины исполняются по очереди, а не одна до остановки, затем другая
+    order = [number for number, _, _, _ in slices]
+    assert order.count(0) > 3 and order.count(1) > 3
+    assert order.index(1) < len(order) - 1 - order[::-1].index(0)
+    assert [status for _, _, _, status in slices].count('halt') == 2
+
+
+def test_tick_limit(slices):
+    simulation = SimulationServer(program(COUNT), slice_ticks=50, max_ticks=120, engine='instr')
+    assert serve(simulation, cat_client([])) == [""]
+    assert simulation.results == {'tick_limit': 1}
+    assert [budget for _, budget, _, _ in slices][:2] == [50, 50]
+    assert sum(ticks for _, _, ticks, _ in slices) >= 120
+
+
+# Машина без ввода не исполняется: одна порция до ожидания, следующая - после данных
+@pytest.mark.parametrize('engine', server.SESSION_ENGINES)
+def test_input_wait(slices, engine: str):
+    simulation = SimulationServer(program(CAT), slice_ticks=1000, engine=engine)
+
+    async def client(port: int) -> tuple[int, str]:
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        await asyncio.sleep(0.2)
+        waiting = len(slices)
+        writer.write(b"ok\n")
+        output = await reader.read()
+        writer.close()
+        return waiting, output.decode()
+
+    [(waiting, output)] = serve(simulation, client)
+    assert output == "ok\n"
+    assert waiting == 1 and slices[0][3] == 'input'
+    assert slices[-1][3] == 'halt'
+
+
+# Указатель на #STDIN: косвенная операнда ввод не читает, ждать ввода не нужно
+@pytest.mark.parametrize('jit', [False, True])
+def test_indirect_input_pointer(jit: bool):
+    translated = translator.translate(f"section .text:\n LD INDIRECT in\n LD DIRECT x\n ST IMMEDIATE #STDOUT\n HLT\n"
+                                      f"section .data:\n in: {DataPath.INPUT_ADDR}\n x: 'a'")
+    control_unit = ControlUnit(io.StringIO(), translator.machine_code(translated), data_runs(translated.data),
+                               io.StringIO())
+    assert not control_unit.next_reads_input()
+    blocks = BlockCompiler(control_unit) if jit else None
+    assert run_slice(control_unit, 1000, lambda: 0, blocks) == 'halt'
+    assert control_unit.datapath.output.output_buffer == ['a']
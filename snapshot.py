@@ -0,0 +1,205 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import struct
+import zlib
+from array import array
+
+from isa import Instruction
+from control_unit import ControlUnit
+from datapath import RAM
+from interrupts import InputSchedule
+from microcode import MicroControlUnit
+
+# Снимок состояния машины для продолжения долгих прогонов.
+#
+# Снимок содержит состояние ControlUnit (PC, этап, шаг этапа, флаги,
+# мультиплексоры, счетчики, прерывания), DataPath (аккумулятор, шина, выборка
+# устройств), позиции потоков ввода и вывода (для ввода по расписанию - еще не
+# пришедшие события), состояние кэша данных (теги, грязные строки, счетчики) и
+# страницы памяти, отличающиеся от образа данных программы. Восстановление
+# выполняется в ControlUnit, созданный из той же программы и того же файла
+# ввода, неизмененные страницы берутся из образа данных.
+#
+# Формат файла: сигнатура, версия, длина заголовка, затем сжатые zlib
+# JSON-заголовок и содержимое страниц подряд (номера страниц в заголовке).
+
+SNAPSHOT_MAGIC = b'CSAS'
+SNAPSHOT_VERSION = 1
+_HEADER = struct.Struct('<4sBI')
+
+
+def program_fingerprint(program: list[Instruction]) -> str:
+    digest = hashlib.sha1()
+    for instr in program:
+        digest.update(str(instr).encode())
+        digest.update(b'\n')
+    return digest.hexdigest()
+
+
+# Номера страниц памяти, отличающихся от образа данных base
+def dirty_pages(mem: RAM, base: RAM) -> list[int]:
+    res: list[int] = []
+    for page_no, page in mem.pages.items():
+        base_page = base.pages.get(page_no)
+        if base_page is None:
+            if any(page):
+                res.append(page_no)
+        elif page != base_page:
+            res.append(page_no)
+    return sorted(res)
+
+
+def capture(control_unit: ControlUnit, data: dict[int, list[int]] | None = None) -> bytes:
+    datapath = control_unit.datapath
+    # вывод до снимка должен оказаться в sink, чтобы позиция вывода была точной
+    datapath.output.flush()
+
+    base = RAM(datapath.databus)
+    if data is not None:
+        base.load(data)
+    pages = dirty_pages(datapath.mem, base)
+
+    source = datapath.input.source
+    header = {
+        'program': program_fingerprint(control_unit.program),
+        'control_unit': {
+            'program_counter': control_unit.program_counter,
+            'stage': control_unit.stage.value,
+            'step_cnt': control_unit.step_cnt,
+            'sel_arg': control_unit.sel_arg.value,
+            'sel_next': control_unit.sel_next.value,
+            'tick_cnt': control_unit.tick_cnt,
+            'instr_cnt': control_unit.instr_cnt,
+            'N': control_unit.N,
+            'Z': control_unit.Z,
+            'V': control_unit.V,
+            'C': control_unit.C,
+            'ie': control_unit.ie,
+            'waiting': control_unit.waiting,
+            'saved': control_unit.saved,
+            'int_addr': control_unit.int_addr,
+        },
+        'datapath': {
+            'acc': datapath.acc,
+            'acc_in': datapath.acc_in,
+            'acc_out': datapath.acc_out,
+            'data_address': datapath.data_address,
+            'databus': datapath.databus.value,
+        },
+        'input': {
+            'cs': datapath.input.CS,
+            'position': 0 if isinstance(source, InputSchedule) else source.tell(),
+            'buffer': "".join(datapath.input.input_buffer),
+            'schedule': source.state() if isinstance(source, InputSchedule) else None,
+        },
+        'output': {
+            'cs': datapath.output.CS,
+            'written': datapath.output.written,
+            'buffer': "".join(datapath.output.output_buffer),
+        },
+        'mem': {
+            'cs': datapath.mem.CS,
+            'oe': datapath.mem.OE,
+            'data_address': datapath.mem.data_address,
+            'page_faults': datapath.mem.page_faults,
+            'wide': [[addr, value] for addr, value in datapath.mem.wide.items()],
+            'pages': pages,
+        },
+        'dcache': datapath.cache.state() if datapath.cache is not None else None,
+    }
+    payload = json.dumps(header, ensure_ascii=False).encode()
+    body = payload + b"".join(datapath.mem.pages[page_no].tobytes() for page_no in pages)
+    return _HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, len(payload)) + zlib.compress(body)
+
+
+def apply(control_unit: ControlUnit, snapshot: bytes, data: dict[int, list[int]] | None = None):
+    magic, version, length = _HEADER.unpack_from(snapshot)
+    assert magic == SNAPSHOT_MAGIC, "Файл не является снимком состояния"
+    assert version == SNAPSHOT_VERSION, f"Неподдерживаемая версия снимка: {version}"
+    body = zlib.decompress(snapshot[_HEADER.size:])
+    header = json.loads(body[:length])
+    assert header['program'] == program_fingerprint(control_unit.program), "Снимок сделан для другой программы"
+
+    state = header['control_unit']
+    control_unit.program_counter = state['program_counter']
+    control_unit.stage = ControlUnit.Stage(state['stage'])
+    control_unit.step_cnt = state['step_cnt']
+    control_unit.sel_arg = ControlUnit.ArgMux(state['sel_arg'])
+    control_unit.sel_next = ControlUnit.PCMux(state['sel_next'])
+    control_unit.tick_cnt = state['tick_cnt']
+    control_unit.instr_cnt = state['instr_cnt']
+    control_unit.N = state['N']
+    control_unit.Z = state['Z']
+    # флагов V и C и состояния прерываний нет в снимках, сделанных до их появления
+    control_unit.V = state.get('V', False)
+    control_unit.C = state.get('C', False)
+    control_unit.ie = state.get('ie', False)
+    control_unit.waiting = state.get('waiting', False)
+    control_unit.saved = tuple(state['saved']) if state.get('saved') is not None else None
+    control_unit.int_addr = state.get('int_addr', 0)
+    # микропрограммное устройство продолжает с микрокоманды восстановленного этапа
+    if isinstance(control_unit, MicroControlUnit):
+        control_unit.sync()
+
+    datapath = control_unit.datapath
+    state = header['datapath']
+    datapath.acc = state['acc']
+    datapath.acc_in = state['acc_in']
+    datapath.acc_out = state['acc_out']
+    datapath.data_address = state['data_address']
+    datapath.databus.value = state['databus']
+
+    state = header['input']
+    datapath.input.CS = state['cs']
+    if state.get('schedule') is not None:
+        datapath.input.source.load_state(state['schedule'])
+    else:
+        datapath.input.source.seek(state['position'])
+    datapath.input.input_buffer = list(state['buffer'])
+
+    state = header['output']
+    datapath.output.CS = state['cs']
+    datapath.output.written = state['written']
+    datapath.output.output_buffer = list(state['buffer'])
+
+    # кэш продолжает с теми же тегами, иначе такты разойдутся с непрерывным прогоном
+    state = header.get('dcache')
+    assert (state is None) == (datapath.cache is None), "Снимок сделан с другой настройкой кэша данных"
+    if state is not None:
+        datapath.cache.load_state(state)
+
+    state = header['mem']
+    mem = datapath.mem
+    # память заново собирается из образа данных и страниц снимка
+    mem.pages = {}
+    mem.wide = {}
+    if data is not None:
+        mem.load(data)
+    mem.CS = state['cs']
+    mem.OE = state['oe']
+    mem.data_address = state['data_address']
+    mem.page_faults = state['page_faults']
+    mem.wide = {addr: value for addr, value in state['wide']}
+    offset = length
+    page_bytes = RAM.PAGE_SIZE * array(RAM.CELL_TYPE).itemsize
+    for page_no in state['pages']:
+        page = array(RAM.CELL_TYPE)
+        page.frombytes(body[offset:offset + page_bytes])
+        mem.pages[page_no] = page
+        offset += page_bytes
+
+
+# Запись через временный файл, чтобы прерванная запись не портила прошлый снимок
+def save(control_unit: ControlUnit, path: str, data: dict[int, list[int]] | None = None):
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as file:
+        file.write(capture(control_unit, data))
+    os.replace(tmp, path)
+
+
+def restore(control_unit: ControlUnit, path: str, data: dict[int, list[int]] | None = None):
+    with open(path, 'rb') as file:
+        apply(control_unit, file.read(), data)
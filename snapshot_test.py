@@ -0,0 +1,84 @@
+import io
+
+import pytest
+
+import snapshot
+import translator
+from dcache import parse_spec
+from machine import load_program, simulate
+from microcode import CONTROL_UNITS
+
+# Продолжение со снимка должно совпадать с непрерывным прогоном: такты, вывод
+# и статистика кэша данных
+
+# сумма слов строки по указателю, много обращений к памяти
+SOURCE = """section .text:
+    .start
+    LD IMMEDIATE buf
+    ST IMMEDIATE p
+    .loop
+    LD INDIRECT p
+    ADD DIRECT sum
+    ST IMMEDIATE sum
+    LD DIRECT p
+    INC
+    ST IMMEDIATE p
+    LD INDIRECT p
+    JNZ DIRECT .loop
+    LD DIRECT sum
+    REM IMMEDIATE 26
+    ADD IMMEDIATE 97
+    ST IMMEDIATE #STDOUT
+    HLT
+section .data:
+    sum: 0
+    p: 0
+    buf:"the quick brown fox jumps over the lazy dog the quick brown fox jumps over the lazy dog"
+"""
+SPEC = 'size=16,line=4,ways=2,penalty=7'
+
+
+def translate(tmp_path) -> tuple:
+    source_path, code_path = tmp_path / 'sum.asm', tmp_path / 'sum.code'
+    source_path.write_text(SOURCE, encoding='utf-8')
+    translator.main([str(source_path), str(code_path)])
+    return load_program(str(code_path))
+
+
+def make(code: tuple, control: str, spec: str | None):
+    program, data = code
+    cache = parse_spec(spec) if spec is not None else None
+    return CONTROL_UNITS[control](io.StringIO(''), program, data, io.StringIO(), cache=cache), data
+
+
+def result(control_unit) -> tuple:
+    cache = control_unit.datapath.cache
+    return (control_unit.tick_cnt, control_unit.instr_cnt, "".join(control_unit.datapath.output.output_buffer),
+            cache.to_json() if cache is not None else None)
+
+
+@pytest.mark.parametrize('spec', [None, SPEC], ids=['no-cache', 'dcache'])
+@pytest.mark.parametrize('engine', ['tick', 'instr'])
+@pytest.mark.parametrize('control', list(CONTROL_UNITS))
+def test_resume(control: str, engine: str, spec: str | None, tmp_path):
+    code = translate(tmp_path)
+    whole, _ = make(code, control, spec)
+    assert simulate(whole, engine) == 'halt'
+
+    first, data = make(code, control, spec)
+    assert simulate(first, engine, max_ticks=whole.tick_cnt // 2) == 'tick_limit'
+    image = snapshot.capture(first, data)
+    resumed, _ = make(code, control, spec)
+    snapshot.apply(resumed, image, data)
+    assert simulate(resumed, engine) == 'halt'
+    assert result(resumed) == result(whole)
+
+
+def test_cache_mismatch(tmp_path):
+    code = translate(tmp_path)
+    first, data = make(code, 'hardwired', SPEC)
+    simulate(first, 'instr', max_ticks=200)
+    image = snapshot.capture(first, data)
+    for spec in (None, 'size=32,line=4,ways=2,penalty=7'):
+        with pytest.raises(AssertionError):
+            snapshot.apply(make(code, 'hardwired', spec)[0], image, data)
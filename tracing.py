@@ -0,0 +1,327 @@
+from __future__ import annotations
+
+import argparse
+import collections
+import json
+import logging
+import struct
+import sys
+from typing import IO, Iterable, Iterator
+
+# Трассировка потактового моделирования.
+#
+# ControlUnit и устройства ввода-вывода сообщают трассировщику о каждом такте,
+# выборке инструкции, пропуске выборки операнды и обмене с устройствами.
+# LoggingTracer пишет прежний текстовый лог через logging. Остальные
+# трассировщики сохраняют записи компактно (NDJSON или бинарно), умеют
+# прореживать такты и держать в памяти записи только последних N тактов.
+# to_text() восстанавливает из сохраненной трассы текстовый лог.
+#
+# Записи - кортежи:
+#   (TICK, tick, stage, acc, pc, data_addr, arg, bus, n, z), n и z равны None,
+#       если флаги еще не выставлялись (в текстовом логе такой такт не выводится)
+#   (FETCH, text) - выбрана инструкция
+#   (SKIP,)       - пропуск выборки операнды
+#   (INPUT, char) / (OUTPUT, char) - обмен с устройствами
+#   (INPUT_BUFFER, text) - содержимое буфера устройства ввода перед чтением (в
+#       порядке input_buffer, следующий символ последний): пишется, когда буфер
+#       заполнен заново или трасса начата с непрочитанным остатком
+#   (OUTPUT_BUFFER, text) - содержимое буфера устройства вывода перед выводом,
+#       если оно не следует из предыдущих записей (буфер сброшен в sink)
+# При выгрузке кольцевого буфера оба буфера к началу окна пишутся первыми записями
+
+TICK = 'tick'
+FETCH = 'fetch'
+SKIP = 'skip'
+INPUT = 'in'
+OUTPUT = 'out'
+INPUT_BUFFER = 'in_buffer'
+OUTPUT_BUFFER = 'out_buffer'
+
+STAGES = ('INSTR_FETCH', 'ARG_FETCH', 'EXECUTION')
+
+
+class Tracer:
+    def tick(self, control_unit):
+        pass
+
+    def fetched(self, instr):
+        pass
+
+    def arg_skipped(self):
+        pass
+
+    def input(self, buffer: list[str], char: str):
+        pass
+
+    def output(self, buffer: list[str], char: str):
+        pass
+
+    def close(self):
+        pass
+
+
+# Прежний текстовый лог через logging.debug, строки строятся лениво
+class LoggingTracer(Tracer):
+    def tick(self, control_unit):
+        # до выставления флагов строка такта не форматируется, logging ее отбрасывал
+        if hasattr(control_unit, 'N'):
+            logging.debug("%s", control_unit)
+
+    def fetched(self, instr):
+        logging.debug("")
+        logging.debug("Fetched: %s", instr)
+
+    def arg_skipped(self):
+        logging.debug("Arg fetch stage skipped")
+
+    def input(self, buffer: list[str], char: str):
+        logging.debug("input: %s --> '%s'", buffer, char)
+
+    def output(self, buffer: list[str], char: str):
+        logging.debug("output: %s <-- '%s'", buffer, char)
+
+
+def tick_record(control_unit) -> tuple:
+    datapath = control_unit.datapath
+    n, z = getattr(control_unit, 'N', None), getattr(control_unit, 'Z', None)
+    return (
+        TICK,
+        control_unit.tick_cnt,
+        control_unit.stage.value,
+        int(datapath.acc),
+        control_unit.program_counter,
+        datapath.data_address,
+        int(control_unit.get_arg()),
+        int(datapath.databus.value),
+        None if n is None else bool(n),
+        None if z is None else bool(z),
+    )
+
+
+# Запись трассы в поток. every - сохранять каждый N-й такт (события при
+# прореживании не сохраняются)
+class RecordTracer(Tracer):
+    def __init__(self, every: int = 1) -> None:
+        assert every >= 1, "Шаг прореживания должен быть положительным"
+        self.every = every
+        self.ticks = 0
+        # символов в буфере ввода после последнего чтения, None - чтений не было
+        self.unread: int | None = None
+        # символов в буфере вывода после последнего вывода
+        self.printed = 0
+
+    def write(self, record: tuple):
+        raise NotImplementedError()
+
+    def tick(self, control_unit):
+        self.ticks += 1
+        if self.every == 1 or self.ticks % self.every == 1:
+            self.write(tick_record(control_unit))
+
+    def fetched(self, instr):
+        if self.every == 1:
+            self.write((FETCH, str(instr)))
+
+    def arg_skipped(self):
+        if self.every == 1:
+            self.write((SKIP,))
+
+    def input(self, buffer: list[str], char: str):
+        if self.every == 1:
+            if not self.unread:
+                # буфер был пуст: устройство прочитало новую порцию
+                self.write((INPUT_BUFFER, "".join(buffer) + char))
+            self.unread = len(buffer)
+            self.write((INPUT, char))
+
+    def output(self, buffer: list[str], char: str):
+        if self.every == 1:
+            if len(buffer) != self.printed:
+                self.write((OUTPUT_BUFFER, "".join(buffer)))
+            self.printed = len(buffer) + 1
+            self.write((OUTPUT, char))
+
+
+class NDJSONTracer(RecordTracer):
+    def __init__(self, stream: IO[str], every: int = 1) -> None:
+        super().__init__(every)
+        self.stream = stream
+
+    def write(self, record: tuple):
+        self.stream.write(json.dumps(record, ensure_ascii=False, separators=(',', ':')) + '\n')
+
+    def close(self):
+        self.stream.close()
+
+
+# --бинарный формат трассы--
+# Сигнатура, затем записи: байт вида записи и данные.
+# Такт: tick, stage, acc, pc, data_addr, arg, bus и байт флагов (бит 0 - N, бит 1 - Z,
+# бит 2 - флаги не выставлены). Если значение не помещается в 64 бита,
+# такт пишется как JSON с префиксом длины
+TRACE_MAGIC = b'CSAT'
+_KINDS = {TICK: 1, FETCH: 2, SKIP: 3, INPUT: 4, OUTPUT: 5, INPUT_BUFFER: 7, OUTPUT_BUFFER: 8}
+_WIDE_TICK = 6
+_TICK = struct.Struct('<qBqqqqqB')
+_LENGTH = struct.Struct('<I')
+_CHAR = struct.Struct('<I')
+
+
+class BinaryTracer(RecordTracer):
+    def __init__(self, stream: IO[bytes], every: int = 1) -> None:
+        super().__init__(every)
+        self.stream = stream
+        self.stream.write(TRACE_MAGIC)
+
+    def write(self, record: tuple):
+        kind = record[0]
+        if kind == TICK:
+            n, z = record[8], record[9]
+            flags = 4 if n is None else int(n) | int(z) << 1
+            try:
+                payload = _TICK.pack(*record[1:8], flags)
+            except struct.error:
+                text = json.dumps(record).encode()
+                self.stream.write(bytes((_WIDE_TICK,)) + _LENGTH.pack(len(text)) + text)
+                return
+            self.stream.write(bytes((_KINDS[TICK],)) + payload)
+        elif kind in (FETCH, INPUT_BUFFER, OUTPUT_BUFFER):
+            text = record[1].encode()
+            self.stream.write(bytes((_KINDS[kind],)) + _LENGTH.pack(len(text)) + text)
+        elif kind == SKIP:
+            self.stream.write(bytes((_KINDS[SKIP],)))
+        else:
+            self.stream.write(bytes((_KINDS[kind],)) + _CHAR.pack(ord(record[1])))
+
+    def close(self):
+        self.stream.close()
+
+
+# Кольцевой буфер записей последних capacity тактов (по номеру такта
+# control_unit.tick_cnt, а не по числу записей), выгружается в другой трассировщик
+class RingTracer(RecordTracer):
+    def __init__(self, capacity: int, every: int = 1) -> None:
+        assert capacity >= 1, "Размер кольцевого буфера трассы должен быть положительным"
+        super().__init__(every)
+        self.capacity = capacity
+        self.tick_cnt = 0
+        # (такт, запись); события относятся к такту последнего вызова tick
+        self.records: collections.deque[tuple[int, tuple]] = collections.deque()
+        # буферы ввода и вывода к началу окна, None - до окна обмена не было
+        self.head_input: str | None = None
+        self.head_output: str | None = None
+
+    def write(self, record: tuple):
+        self.records.append((self.tick_cnt, record))
+
+    def tick(self, control_unit):
+        self.tick_cnt = control_unit.tick_cnt
+        super().tick(control_unit)
+        records = self.records
+        while records and records[0][0] <= self.tick_cnt - self.capacity:
+            record = records.popleft()[1]
+            kind = record[0]
+            if kind == INPUT_BUFFER:
+                self.head_input = record[1]
+            elif kind == INPUT:
+                self.head_input = self.head_input[:-1]
+            elif kind == OUTPUT_BUFFER:
+                self.head_output = record[1]
+            elif kind == OUTPUT:
+                self.head_output = (self.head_output or "") + record[1]
+
+    def dump(self, target: RecordTracer):
+        if self.head_input is not None:
+            target.write((INPUT_BUFFER, self.head_input))
+        if self.head_output is not None:
+            target.write((OUTPUT_BUFFER, self.head_output))
+        for _, record in self.records:
+            target.write(record)
+        target.close()
+
+
+# Трассировщик, пишущий в файл path в формате 'ndjson' или 'binary'
+def open_trace(path: str, trace_format: str = 'binary', every: int = 1) -> RecordTracer:
+    assert trace_format in ('ndjson', 'binary'), f"Неизвестный формат трассы: {trace_format}"
+    if trace_format == 'ndjson':
+        return NDJSONTracer(open(path, 'w', encoding='utf-8'), every)
+    return BinaryTracer(open(path, 'wb'), every)
+
+
+def read_records(stream: IO[bytes]) -> Iterator[tuple]:
+    if stream.read(len(TRACE_MAGIC)) != TRACE_MAGIC:
+        stream.seek(0)
+        for line in stream:
+            if line.strip():
+                yield tuple(json.loads(line))
+        return
+    kinds = {v: k for k, v in _KINDS.items()}
+    while True:
+        kind = stream.read(1)
+        if not kind:
+            return
+        kind = kind[0]
+        if kind == _KINDS[TICK]:
+            *values, flags = _TICK.unpack(stream.read(_TICK.size))
+            n, z = (None, None) if flags & 4 else (bool(flags & 1), bool(flags & 2))
+            yield (TICK, *values, n, z)
+        elif kind == _WIDE_TICK:
+            (length,) = _LENGTH.unpack(stream.read(_LENGTH.size))
+            yield tuple(json.loads(stream.read(length)))
+        elif kind in (_KINDS[FETCH], _KINDS[INPUT_BUFFER], _KINDS[OUTPUT_BUFFER]):
+            (length,) = _LENGTH.unpack(stream.read(_LENGTH.size))
+            yield (kinds[kind], stream.read(length).decode())
+        elif kind == _KINDS[SKIP]:
+            yield (SKIP,)
+        else:
+            (code,) = _CHAR.unpack(stream.read(_CHAR.size))
+            yield (kinds[kind], chr(code))
+
+
+def format_tick(record: tuple) -> str:
+    _, tick, stage, acc, pc, data_addr, arg, bus, n, z = record
+    return "TICK: {:5} STAGE: {:11} ACC: {:10} PC: {:3} DATA_ADDR: {:10} ARG: {:10} DATA_BUS: {:10} N|Z: {}|{}".format(
+        tick, STAGES[stage] if isinstance(stage, int) else stage, acc, pc, data_addr, arg, bus, int(n), int(z)
+    )
+
+
+# Текстовый лог в формате LoggingTracer. Буферы устройств - по записям *_BUFFER
+def to_text(records: Iterable[tuple], prefix: str = "DEBUG:root:") -> Iterator[str]:
+    pending_input: list[str] = []
+    output: list[str] = []
+    for record in records:
+        kind = record[0]
+        if kind == TICK:
+            if record[8] is None:
+                continue
+            yield prefix + format_tick(record)
+        elif kind == FETCH:
+            yield prefix
+            yield prefix + "Fetched: " + record[1]
+        elif kind == SKIP:
+            yield prefix + "Arg fetch stage skipped"
+        elif kind == INPUT_BUFFER:
+            pending_input = list(record[1])
+        elif kind == OUTPUT_BUFFER:
+            output = list(record[1])
+        elif kind == INPUT:
+            pending_input.pop()
+            yield prefix + f"input: {pending_input} --> '{record[1]}'"
+        elif kind == OUTPUT:
+            yield prefix + f"output: {output} <-- '{record[1]}'"
+            output.append(record[1])
+
+
+def main(args: list[str]):
+    parser = argparse.ArgumentParser(prog="tracing.py", description="Преобразование трассы в текстовый лог")
+    parser.add_argument("trace_file")
+    parser.add_argument("--prefix", default="DEBUG:root:")
+    options = parser.parse_args(args)
+    with open(options.trace_file, 'rb') as stream:
+        for line in to_text(read_records(stream), options.prefix):
+            sys.stdout.write(line + '\n')
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,117 @@
+import io
+import logging
+
+import pytest
+
+import translator
+from control_unit import ControlUnit
+from datapath import InputDevice, OutputDevice
+from isa import data_runs
+from machine import simulate
+from tracing import INPUT, INPUT_BUFFER, OUTPUT_BUFFER, TICK, LoggingTracer, RingTracer, open_trace, read_records, to_text
+
+# Трассы NDJSON и бинарная против текстового лога LoggingTracer, прореживание и кольцевой буфер
+
+# эхо до перевода строки: остаток ввода после него не читается
+SOURCE = """section .text:
+    .loop
+    LD DIRECT #STDIN
+    ST IMMEDIATE #STDOUT
+    CMP IMMEDIATE 10
+    JNZ DIRECT .loop
+    HLT
+"""
+STDIN = "ab\ncd"
+
+
+def run(tracer, preload: bool = False, stdin: str = STDIN) -> ControlUnit:
+    translated = translator.translate(SOURCE, preload)
+    control_unit = ControlUnit(io.StringIO(stdin), translator.machine_code(translated), data_runs(translated.data),
+                               io.StringIO(), tracer)
+    assert simulate(control_unit, 'tick') == 'halt'
+    return control_unit
+
+
+# Строки лога LoggingTracer; строка такта строится из ControlUnit при выводе записи
+class Lines(logging.Handler):
+    def __init__(self) -> None:
+        super().__init__()
+        self.lines: list[str] = []
+
+    def emit(self, record: logging.LogRecord):
+        self.lines.append(record.getMessage())
+
+
+def logged(caplog, preload: bool = False) -> list[str]:
+    lines = Lines()
+    logging.getLogger().addHandler(lines)
+    try:
+        with caplog.at_level(logging.DEBUG):
+            run(LoggingTracer(), preload)
+    finally:
+        logging.getLogger().removeHandler(lines)
+    return lines.lines
+
+
+def saved(path: str) -> list[tuple]:
+    with open(path, 'rb') as stream:
+        return list(read_records(stream))
+
+
+@pytest.mark.parametrize('preload', [False, True], ids=['image', 'preload'])
+@pytest.mark.parametrize('trace_format', ['ndjson', 'binary'])
+def test_round_trip(trace_format: str, preload: bool, tmp_path, caplog):
+    path = str(tmp_path / 'trace')
+    tracer = open_trace(path, trace_format)
+    run(tracer, preload)
+    tracer.close()
+    records = saved(path)
+    # непрочитанный остаток "cd" есть только в буфере устройства
+    assert records[[record[0] for record in records].index(INPUT_BUFFER)] == (INPUT_BUFFER, "dc\nba")
+    assert list(to_text(records, "")) == logged(caplog, preload)
+
+
+# ввод читается порциями по 2 символа, вывод сбрасывается в sink по 2 символа
+def test_small_buffers(tmp_path, caplog, monkeypatch):
+    monkeypatch.setattr(InputDevice, 'CHUNK_SIZE', 2)
+    monkeypatch.setattr(OutputDevice, 'BUFFER_SIZE', 2)
+    path = str(tmp_path / 'trace')
+    tracer = open_trace(path, 'binary')
+    run(tracer)
+    tracer.close()
+    records = saved(path)
+    assert [record for record in records if record[0] == INPUT_BUFFER] == [(INPUT_BUFFER, "ba"), (INPUT_BUFFER, "c\n")]
+    assert (OUTPUT_BUFFER, "") in records
+    assert list(to_text(records, "")) == logged(caplog)
+
+
+def trace(tmp_path, every: int = 1) -> list[tuple]:
+    path = str(tmp_path / f'trace{every}')
+    tracer = open_trace(path, 'ndjson', every)
+    run(tracer)
+    tracer.close()
+    return saved(path)
+
+
+# каждая N-я запись такта, события не сохраняются
+def test_every(tmp_path):
+    ticks = [record for record in trace(tmp_path) if record[0] == TICK]
+    assert trace(tmp_path, 4) == ticks[::4]
+
+
+@pytest.mark.parametrize('capacity', [1, 7, 20, 1000])
+def test_ring(capacity: int, tmp_path, caplog):
+    ring = RingTracer(capacity)
+    last = run(ring).tick_cnt
+    path = str(tmp_path / 'trace')
+    ring.dump(open_trace(path, 'binary'))
+    records = saved(path)
+    # записи тактов с номерами из последних capacity
+    window = [record for record in trace(tmp_path) if record[0] == TICK and record[1] > last - capacity]
+    assert [record for record in records if record[0] == TICK] == window
+    # до первого чтения в окне - содержимое буфера ввода
+    events = [record[0] for record in records if record[0] in (INPUT_BUFFER, INPUT)]
+    assert events[:1] in ([], [INPUT_BUFFER])
+    # окно лога - конец полного лога
+    text = list(to_text(records, ""))
+    assert text == logged(caplog)[-len(text):]
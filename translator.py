@@ -1,148 +1,416 @@
+import argparse
+import hashlib
+import json
 import re
 import sys
+from typing import Iterable, Iterator, NamedTuple
 
-from isa import Instruction, Opcode, ArgType
+from optimizer import optimize
+from isa import DATA_SECTION, Instruction, Opcode, ArgType, data_runs, format_data_run, write_binary
+from program_cache import decode_program, encode_program, open_cache
 
-# --предобработка ввода--
-def preprocessing(sorce: str) -> str: # основная функция подраздела
-    lines: list[str] = sorce.splitlines()
-    strip_lines = map(str.strip, lines)
-    remove_empty_lines = filter(bool, strip_lines)
-    remove_commas = map(lambda s: s.replace("','", str(ord(','))).replace(',', ' '), remove_empty_lines)
-    remove_space = map(lambda s: re.sub(r'\s+', ' ', s), remove_commas)
-    return '\n'.join(remove_space)
+# --лексический анализ--
+# Исходный код читается построчно за один проход. Запятые и пробелы -
+# разделители, ; начинает комментарий до конца строки, строковые и символьные
+# литералы сохраняются как есть.
+# tokenize выдает токены с позицией (в конце каждой строки - токен EOL),
+# разбор использует более дешевый split_line и строит токены только для
+# сообщений об ошибках
+class Token(NamedTuple):
+    kind: str
+    text: str
+    line: int
+    column: int
+
+    def where(self) -> str:
+        return f"{self.line}:{self.column}"
+
+_TOKEN_RE = re.compile(r"""
+    (?P<SPACE>[\s,]+)
+  | (?P<STRING>"[^"]*")
+  | (?P<CHAR>'.')
+  | (?P<COMMENT>;.*)
+  | (?P<COLON>:)
+  | (?P<WORD>[^\s,:"';]+)
+""", re.VERBOSE)
+
+def token_kind(text: str) -> str:
+    if text[0] == '"':
+        return 'STRING'
+    if text[0] == "'":
+        return 'CHAR'
+    if text == ':':
+        return 'COLON'
+    if text.isdecimal() or (text[0] in '+-' and text[1:].isdecimal()):
+        return 'INT'
+    return 'WORD'
+
+def tokenize_line(number: int, line: str) -> list[Token]:
+    tokens: list[Token] = []
+    pos, end = 0, len(line)
+    while pos < end:
+        match = _TOKEN_RE.match(line, pos)
+        assert match is not None, f"{number}:{pos + 1}: неожиданный символ {line[pos]!r}"
+        if match.lastgroup not in ('SPACE', 'COMMENT'):
+            tokens.append(Token(token_kind(match.group()), match.group(), number, pos + 1))
+        pos = match.end()
+    return tokens
+
+def tokenize(lines: Iterable[str]) -> Iterator[Token]:
+    for number, line in enumerate(lines, 1):
+        yield from tokenize_line(number, line)
+        yield Token('EOL', '', number, len(line) + 1)
+
+# Тексты токенов строки, те же, что у tokenize_line
+def split_line(number: int, line: str) -> list[str]:
+    if '"' in line or "'" in line:
+        return [token.text for token in tokenize_line(number, line)]
+    if ';' in line:
+        line = line[:line.index(';')]
+    if ',' in line:
+        line = line.replace(',', ' ')
+    if ':' in line:
+        return line.replace(':', ' : ').split()
+    return line.split()
+
+# --синтаксический анализ--
+# Секции "section .text:" и "section .data:" могут идти в любом порядке и повторяться.
+# Данные: <имя>:<значение>. Код: .метка или <команда> [<тип адресации> <аргумент>]
+class Statement(NamedTuple):
+    line: int
+    source: str
+    words: list[str]
+
+    # позиция index-го токена строки для сообщения об ошибке
+    def where(self, index: int = 0) -> str:
+        tokens = tokenize_line(self.line, self.source)
+        return tokens[index].where() if index < len(tokens) else f"{self.line}:{len(self.source) + 1}"
+
+    @property
+    def is_label(self) -> bool:
+        return self.words[0][0] == '.'
+
+def parse(lines: Iterable[str]) -> tuple[list[Statement], list[Statement]]:
+    data: list[Statement] = []
+    text: list[Statement] = []
+    section: str | None = None
+    has_text = False
+    for number, line in enumerate(lines, 1):
+        words = split_line(number, line)
+        if not words:
+            continue
+        statement = Statement(number, line, words)
+        if words[0] == 'section':
+            assert len(words) == 3 and words[1] in ('.text', '.data') and words[2] == ':', \
+                f"{statement.where()}: у секции формат section .text: или section .data:"
+            section = words[1]
+            has_text = has_text or section == '.text'
+            continue
+        assert section is not None, f"{statement.where()}: код вне секции"
+        if section == '.data':
+            assert len(words) == 3 and token_kind(words[0]) == 'WORD' and words[1] == ':' \
+                and token_kind(words[2]) in ('INT', 'STRING', 'CHAR'), \
+                f"{statement.where()}: у декларирования данных формат <varname>:<value>"
+            data.append(statement)
+        else:
+            # имена команд, типов адресации и аргументы проверяются в process
+            assert len(words) in (1, 3) and (len(words) == 1 or words[0][0] != '.'), \
+                f"{statement.where()}: у команд формат <comand> [optional]<arg> или .name если это метка"
+            text.append(statement)
+    assert has_text, "Должна быть обязательно cекция .text"
+    return data, text
 
 class Translated_data:
-    def __init__(self) -> None:
+    # preload=True - режим совместимости: данные и метки записываются в память
+    # парами LD/ST в секции preload, а не образом сегмента данных.
+    # label_cells=True - адреса всех меток хранятся в ячейках памяти и переходы
+    # читают их оттуда (JMP DIRECT <ячейка>), как раньше; по умолчанию включено
+    # только вместе с preload, чтобы такты совпадали с golden-тестами
+    def __init__(self, preload: bool = False, label_cells: bool | None = None) -> None:
         self.input_addr = 0x10000000
         self.output_addr = 0x10000001
+        # ячейка адреса обработчика прерывания, заполняется по метке INTERRUPT_LABEL
+        self.vector_addr = 0x10000002
 
         self.data_start = 0x20000000
         self.data_end = 0x2FFFFFFF
         self.free_data = self.data_start
 
+        self.use_preload = preload
+        self.use_label_cells = preload if label_cells is None else label_cells
+
         self.mem_start = 0
         self.mem_end = 0x0FFFFFFF
-        self.mem_cur = self.mem_start
-
+        # адрес метки - адрес следующей за ней инструкции: маркер program (адрес 0)
+        # плюс число инструкций до метки. С label_cells остается прежний счет, в
+        # котором адрес занимает каждая метка, а маркер нет: по нему записаны golden-логи
+        self.mem_cur = self.mem_start if self.use_label_cells else self.mem_start + 1
         self.preload: list[Instruction] = []
         self.program: list[Instruction] = []
+        # образ сегмента данных: адрес -> слово
+        self.data: dict[int, int] = {}
 
         self.var_table: dict[str, int] = {}
         self.var_table['#STDOUT'] = self.output_addr
         self.var_table['#STDIN'] = self.input_addr
+        self.var_table['#VECTOR'] = self.vector_addr
+        # ячейки памяти с адресами меток: имя метки -> адрес ячейки
+        self.marks: dict[str, int] = {}
+        # метки без ячеек, разрешенные при трансляции: имя метки -> адрес перехода
+        self.code_labels: dict[str, int] = {}
+        # последняя встреченная метка и индекс инструкции после нее
+        self.cur_label: tuple[str, int] | None = None
+        # для каждой инструкции program: (имя метки, смещение от метки) или None
+        self.labels: list[tuple[str, int] | None] = []
         pass
 
+    def _store_word(self, value: int) -> int:
+        addr = self.free_data
+        self.data[addr] = value
+        if self.use_preload:
+            self.preload.append(Instruction(opcode=Opcode.LD, arg=value, arg_type=ArgType.IMMEDIATE))
+            self.preload.append(Instruction(opcode=Opcode.ST, arg=addr, arg_type=ArgType.IMMEDIATE))
+        self.free_data += 1
+        return addr
+
     def _input_data_string(self, varname: str, value: str):
         assert value[0] == '"' and value[-1] == '"' and value.count('"') == 2, 'неправильный формат значения, значение строго: "val"'
         assert self.free_data + len(value) + 1 < self.data_end, 'Закончилась память'
         value = value[1:-1]
         self.var_table[varname] = self.free_data
         for i in value:
-            self.preload.append(Instruction(opcode=Opcode.LD, arg=ord(i), arg_type=ArgType.IMMEDIATE))
-            self.preload.append(Instruction(opcode=Opcode.ST, arg=self.free_data, arg_type=ArgType.IMMEDIATE))
-            self.free_data += 1
-        self.preload.append(Instruction(opcode=Opcode.LD, arg=0, arg_type=ArgType.IMMEDIATE))
-        self.preload.append(Instruction(opcode=Opcode.ST, arg=self.free_data, arg_type=ArgType.IMMEDIATE))
-        self.free_data += 1
+            self._store_word(ord(i))
+        self._store_word(0)
 
     def _input_data_int(self, varname: str, value: int):
         assert self.free_data + 1 < self.data_end, 'Закончилась память'
-        self.var_table[varname] = self.free_data
-        self.preload.append(Instruction(opcode=Opcode.LD, arg=value, arg_type=ArgType.IMMEDIATE))
-        self.preload.append(Instruction(opcode=Opcode.ST, arg=self.free_data, arg_type=ArgType.IMMEDIATE))
-        self.free_data += 1
+        self.var_table[varname] = self._store_word(value)
 
     def _input_data_char(self, varname: str, value: str):
-        assert value.find("'") == 2 and len(value) == 3, 'Неправильный формат char у переменной' + varname
-        value = value[1]
-        assert self.free_data + len(value) + 1 < self.data_end, 'Закончилась память'
-        self.var_table.append(varname, self.free_data)
-        self.preload.append(Instruction(opcode=Opcode.LD, arg=ord(value), arg_type=ArgType.IMMEDIATE))
-        self.preload.append(Instruction(opcode=Opcode.ST, arg=self.free_data, arg_type=ArgType.IMMEDIATE))
-        self.free_data += 2
+        assert len(value) == 3 and value[0] == "'" and value[2] == "'", 'Неправильный формат char у переменной ' + varname
+        assert self.free_data + 1 < self.data_end, 'Закончилась память'
+        self.var_table[varname] = self._store_word(ord(value[1]))
 
-    def _input_comand(self, op: str, arg_type: str | None=None, arg: str | None=None):
+    def _input_comand(self, op: Opcode, arg_type: ArgType | None = None, arg: int | None = None, line: int | None = None):
         if (arg_type == None):
-            self.program.append(Instruction(opcode=Opcode(op), arg=0, arg_type=ArgType.DIRECT, line=self.mem_cur))
+            self.program.append(Instruction(opcode=op, arg=0, arg_type=ArgType.DIRECT, line=line))
         else:
-            if (arg.isnumeric()):
-                self.program.append(Instruction(opcode=Opcode(op), arg=arg, arg_type=ArgType(arg_type), line=self.mem_cur))
-            else:
-                self.program.append(Instruction(opcode=Opcode(op), arg=self.var_table[arg], arg_type=ArgType(arg_type), line=self.mem_cur))
-        self.mem_cur += 1
+            self.program.append(Instruction(opcode=op, arg=arg, arg_type=arg_type, line=line))
+        if self.cur_label is None:
+            self.labels.append(None)
+        else:
+            self.labels.append((self.cur_label[0], len(self.program) - 1 - self.cur_label[1]))
 
-    def _input_mark(self, markname: str):
-        self.preload.append(Instruction(opcode=Opcode.LD, arg=self.mem_cur, arg_type=ArgType.IMMEDIATE))
-        self.preload.append(Instruction(opcode=Opcode.ST, arg=self.free_data, arg_type=ArgType.IMMEDIATE))
-        self.var_table[markname] = self.free_data
-        self.free_data += 1
-        self.mem_cur += 1
+    def _input_mark(self, markname: str, stored: bool = True):
+        if stored:
+            self.var_table[markname] = self.marks[markname] = self._store_word(self.mem_cur)
+        else:
+            self.code_labels[markname] = self.mem_cur
+        if markname == INTERRUPT_LABEL:
+            self._set_vector(self.mem_cur)
+        if self.use_label_cells:
+            self.mem_cur += 1
+
+    def _set_vector(self, value: int):
+        self.data[self.vector_addr] = value
+        if self.use_preload:
+            self.preload.append(Instruction(opcode=Opcode.LD, arg=value, arg_type=ArgType.IMMEDIATE))
+            self.preload.append(Instruction(opcode=Opcode.ST, arg=self.vector_addr, arg_type=ArgType.IMMEDIATE))
+
+    # Значение аргумента команды: число, символ или имя переменной/метки
+    def _resolve(self, statement: Statement) -> int:
+        arg = statement.words[2]
+        if arg in self.var_table:
+            return self.var_table[arg]
+        kind = token_kind(arg)
+        if kind == 'INT':
+            return int(arg)
+        if kind == 'CHAR':
+            return ord(arg[1])
+        assert False, f"{statement.where(2)}: неизвестное имя {arg}"
+
+# метка обработчика прерывания: ее адрес записывается в ячейку #VECTOR
+INTERRUPT_LABEL = '.interrupt'
+
+# команды и типы адресации, допустимые в исходном коде
+_OPCODES: dict[str, Opcode] = {op.value: op for op in Opcode if op not in (Opcode.preload, Opcode.program)}
+_ARG_TYPES: dict[str, ArgType] = {t.value: t for t in ArgType}
+_JUMPS = (Opcode.JMP.value, Opcode.JZ.value, Opcode.JNZ.value)
+
+# Метки, которым нужна ячейка памяти: все в режиме label_cells, иначе только те,
+# что используются не как цель перехода JMP/JZ/JNZ DIRECT (адрес метки как
+# значение, косвенный переход, запись в ячейку)
+def stored_labels(text: list[Statement], label_cells: bool) -> set[str]:
+    labels = {statement.words[0] for statement in text if statement.is_label}
+    if label_cells:
+        return labels
+    return {
+        words[2] for words in (statement.words for statement in text)
+        if len(words) == 3 and words[2] in labels and not (words[0] in _JUMPS and words[1] == ArgType.DIRECT.value)
+    }
 
 # --Основная функция--
-def process(code: str, text_start: int, text_end: int, data_start: int, data_end: int) -> Translated_data:
-    out_data: Translated_data = Translated_data()
-    if (data_start != None):
-        assert data_end != None, "Что-то пошло не так, data_start не None, но data_end да"
-        
-        for i in code[data_start:data_end].split("\n"):
-            assert len(i.split(':')) == 2, 'У декларирования данных формат <varname>:<value>' 
-            varname, value = i.split(':')
-            
-            if value[0] == '"':
-                out_data._input_data_string(varname, value)
-            elif value[0] == "'":
-                out_data._input_data_char(varname, value)
-            else:
-                out_data._input_data_int(varname, int(value))
-
-    for i in code[text_start:text_end].split("\n"):
-        assert i[0] == '.' or len(i.split(' ')) == 1 or len(i.split(' ')) == 3, "У команд формат <comand> [optional]<arg> или .name если это метка"
-        if (i[0] == '.'):
-            out_data._input_mark(i)
-        elif (len(i.split(' ')) == 1):
-            out_data._input_comand(i)
+# Сначала размещаются данные, затем метки в порядке следования (поэтому метки
+# можно использовать до объявления), затем генерируются команды. Переход
+# JMP/JZ/JNZ DIRECT на метку без ячейки становится переходом IMMEDIATE на тот же
+# адрес: без такта чтения операнды и без ячейки в памяти
+def process(data: list[Statement], text: list[Statement], preload: bool = False,
+            label_cells: bool | None = None) -> Translated_data:
+    out_data: Translated_data = Translated_data(preload, label_cells)
+    for statement in data:
+        name, _, value = statement.words
+        if value[0] == '"':
+            out_data._input_data_string(name, value)
+        elif value[0] == "'":
+            out_data._input_data_char(name, value)
+        else:
+            out_data._input_data_int(name, int(value))
+
+    stored = stored_labels(text, out_data.use_label_cells)
+    for statement in text:
+        if statement.is_label:
+            out_data._input_mark(statement.words[0], statement.words[0] in stored)
+        else:
+            out_data.mem_cur += 1
+
+    for statement in text:
+        words = statement.words
+        if statement.is_label:
+            out_data.cur_label = (words[0], len(out_data.program))
+            continue
+        op = _OPCODES.get(words[0])
+        assert op is not None, f"{statement.where()}: неизвестная команда {words[0]}"
+        if len(words) == 1:
+            out_data._input_comand(op, line=statement.line)
         else:
-            out_data._input_comand(i.split(' ')[0], i.split(' ')[1], i.split(' ')[2])
+            arg_type = _ARG_TYPES.get(words[1])
+            assert arg_type is not None, f"{statement.where(1)}: неизвестный тип адресации {words[1]}"
+            if words[2] in out_data.code_labels:
+                out_data._input_comand(op, ArgType.IMMEDIATE, out_data.code_labels[words[2]], statement.line)
+            else:
+                out_data._input_comand(op, arg_type, out_data._resolve(statement), statement.line)
 
     return out_data
 
+# Машинный код в порядке записи в файл, вместе с маркерами секций preload/program
+def machine_code(translated: Translated_data) -> list[Instruction]:
+    res: list[Instruction] = []
+    if (len(translated.preload) != 0):
+        res.append(Instruction(opcode=Opcode.preload))
+        res.extend(translated.preload)
+    res.append(Instruction(opcode=Opcode.program))
+    res.extend(translated.program)
+    return res
+
+def translate(source: str | Iterable[str], preload: bool = False, label_cells: bool | None = None) -> Translated_data:
+    lines = source.splitlines() if isinstance(source, str) else source
+    data, text = parse(lines)
+    return process(data, text, preload, label_cells)
+
+# Карта исходного кода: для каждой инструкции адрес (PC), строка и текст
+# исходного кода, ближайшая предшествующая метка и смещение от нее.
+# PC считается от маркера program, который всегда имеет адрес 0
+def source_map(translated: Translated_data, source: str) -> list[dict]:
+    source_text = source.splitlines()
+    res: list[dict] = []
+    for index, instr in enumerate(translated.program):
+        label = translated.labels[index]
+        res.append({
+            'pc': index + 1,
+            'line': instr.line,
+            'text': source_text[instr.line - 1].strip() if instr.line is not None else str(instr),
+            'label': label[0] if label is not None else None,
+            'offset': label[1] if label is not None else index,
+        })
+    return res
+
+# Текст машинного кода: секция образа данных, затем инструкции с маркерами preload/program
+def code_text(instructions: list[Instruction], data: dict[int, list[int]]) -> str:
+    lines: list[str] = []
+    if (len(data) != 0):
+        lines.append(DATA_SECTION)
+        for addr, words in data.items():
+            lines.append(format_data_run(addr, words))
+    for i in instructions:
+        if i.opcode in (Opcode.preload, Opcode.program):
+            lines.append(i.opcode + ':')
+        else:
+            lines.append(i.__str__())
+    return "".join(line + '\n' for line in lines)
+
+# Отпечаток реализации транслятора для ключа кэша: при изменении кода
+# транслятора или оптимизатора старые записи не используются
+def implementation_fingerprint() -> str:
+    digest = hashlib.sha256()
+    for path in (__file__, sys.modules[optimize.__module__].__file__):
+        with open(path, 'rb') as file:
+            digest.update(file.read())
+    return digest.hexdigest()
+
 def main(args):
-    source_path, target_path = args
+    parser = argparse.ArgumentParser(prog="translator.py")
+    parser.add_argument("source_path")
+    parser.add_argument("target_path")
+    parser.add_argument("--binary", metavar="PATH", help="дополнительно записать машинный код в бинарном формате")
+    parser.add_argument("--preload", action="store_true",
+                        help="режим совместимости: загружать данные парами LD/ST вместо образа памяти")
+    parser.add_argument("--label-cells", action="store_true",
+                        help="хранить адреса меток в памяти и переходить через них (как раньше, включено с --preload)")
+    parser.add_argument("--source-map", metavar="PATH", help="записать карту PC -> строка исходного кода в JSON")
+    parser.add_argument("--optimize", action="store_true", help="оптимизация окном (peephole), отчет в stderr")
+    parser.add_argument("--cache", metavar="DIR", help="каталог кэша трансляции (по умолчанию $CSA_CACHE_DIR)")
+    options = parser.parse_args(args)
+    source_path, target_path = options.source_path, options.target_path
 
     with open(source_path, "rt", encoding="utf-8") as file:
         source = file.read()
 
-    code = preprocessing(source)
-    text_index = code.find('section .text:')
-
-    # получение индексов для считываний
-    assert text_index != -1, "Должна быть обязательно cекция .text"
-    text_start, text_end = text_index + len('section .text:') + 1, None
-    data_start, data_end = None, None
-
-    data_index = code.find('section .data:')
-    if (data_index == -1):
-        text_end = len(source)
+    # в кэше по исходному коду и параметрам хранится весь результат трансляции
+    cache = open_cache(options.cache)
+    key = None
+    cached = None
+    if cache is not None:
+        settings = repr((options.preload, options.label_cells, options.optimize))
+        key = cache.key('asm', source, settings, implementation_fingerprint())
+        cached = cache.get(key)
+    # инструкции из кэша декодируются, только если нужен бинарный файл
+    instructions: list[Instruction] | None = None
+    if cached is not None:
+        records, data = cached['instructions'], cached['data']
+        report, instruction_map, text = cached['report'], cached['source_map'], cached['text']
+        symbols = cached['symbols']
     else:
-        data_start = data_index + len('section .data:') + 1
-        if (data_index < text_index):
-            data_end = text_end - 1
-            text_end = len(source)
-        else:
-            data_end = len(source)
-            text_end = data_index - 1
-    
-    translated: Translated_data = process(code, text_start, text_end, data_start, data_end)
+        translated: Translated_data = translate(source, options.preload, options.label_cells or None)
+        report = str(optimize(translated)) if options.optimize else None
+        instructions = machine_code(translated)
+        data = {} if translated.use_preload else data_runs(translated.data)
+        instruction_map = None
+        if cache is not None or options.source_map is not None:
+            instruction_map = source_map(translated, source)
+        symbols = translated.var_table
+        text = code_text(instructions, data)
+        if cache is not None:
+            records = encode_program(instructions)
+            cache.put(key, {
+                'instructions': records, 'data': data, 'text': text,
+                'report': report, 'source_map': instruction_map, 'symbols': symbols,
+            })
+    if report is not None:
+        print(report, file=sys.stderr)
+
     with open(target_path, 'w+', encoding="utf-8") as file:
-        if (len(translated.preload) != 0):
-            file.write('preload:\n')
-            for i in translated.preload:
-                file.write(i.__str__() + '\n')
-        file.write('program:\n')
-        for i in translated.program:
-            file.write(i.__str__() + '\n')
+        file.write(text)
+    if cache is not None:
+        # machine.py найдет декодированную программу по содержимому target_path
+        code_key = cache.key('code', text.encode('utf-8'))
+        if code_key not in cache:
+            cache.put(code_key, {'instructions': records, 'data': data})
+    if options.binary is not None:
+        write_binary(options.binary, instructions or decode_program(records), data)
+    if options.source_map is not None:
+        with open(options.source_map, 'w', encoding="utf-8") as file:
+            json.dump({'source': source_path, 'instructions': instruction_map, 'symbols': symbols},
+                      file, ensure_ascii=False, indent=1)
 
 if __name__ == '__main__':
-    assert len(sys.argv[1:]) == 2,  "Ожидаемый формат: translation.py <source_path> <target_path>"    
     main(sys.argv[1:])
\ No newline at end of file
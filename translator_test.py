@@ -0,0 +1,148 @@
+import io
+
+import pytest
+
+import translator
+from control_unit import ControlUnit
+from isa import data_runs
+from machine import simulate
+from translator import split_line, tokenize, tokenize_line
+
+# Лексический и синтаксический анализ транслятора
+
+
+def code(source: str, preload: bool = False) -> list[str]:
+    translated = translator.translate(source, preload)
+    return [str(instr) for instr in translator.machine_code(translated)]
+
+
+def error(source: str) -> str:
+    with pytest.raises(AssertionError) as info:
+        translator.translate(source)
+    return str(info.value)
+
+
+def test_tokens():
+    tokens = list(tokenize(['section .data:', '  s: "a, b:  c"', "\tc:',' n:-5"]))
+    assert [(t.kind, t.text, t.line, t.column) for t in tokens] == [
+        ('WORD', 'section', 1, 1), ('WORD', '.data', 1, 9), ('COLON', ':', 1, 14), ('EOL', '', 1, 15),
+        ('WORD', 's', 2, 3), ('COLON', ':', 2, 4), ('STRING', '"a, b:  c"', 2, 6), ('EOL', '', 2, 16),
+        ('WORD', 'c', 3, 2), ('COLON', ':', 3, 3), ('CHAR', "','", 3, 4), ('WORD', 'n', 3, 8),
+        ('COLON', ':', 3, 9), ('INT', '-5', 3, 10), ('EOL', '', 3, 12),
+    ]
+
+
+# split_line - быстрый путь разбора, должен совпадать с tokenize_line
+@pytest.mark.parametrize('line', [
+    '', '   ', 'section .text:', 'section .text :', '  LD DIRECT x', 'LD,DIRECT,,x', '\tJNZ  DIRECT\t.loop ',
+    'x:5', 'x : -5', 'x:+5', 'HLT', '.loop', 's: "a, b:  c"', "c: ','", "c:':'", "c: ' '", 'LD IMMEDIATE \'"\'',
+    's:"x" ', 'ST IMMEDIATE #STDOUT,', '; комментарий', 'HLT ; стоп', 'x:5;', "c: ';' ; точка с запятой",
+    's: "a;b" ;c', 'LD DIRECT x;;y',
+])
+def test_split_line(line: str):
+    assert split_line(1, line) == [token.text for token in tokenize_line(1, line)]
+
+
+SOURCE = """section .text:
+    LD DIRECT hello
+    ST IMMEDIATE #STDOUT
+    HLT
+section .data:
+    hello: 'h'
+"""
+
+
+def test_sections_in_any_order():
+    reference = code(SOURCE)
+    data_first = "section .data:\n    hello: 'h'\nsection .text:\n    LD DIRECT hello\n    ST IMMEDIATE #STDOUT\n    HLT\n"
+    split = "section .text:\n LD DIRECT hello\nsection .data:\n hello: 'h'\nsection .text:\n ST IMMEDIATE #STDOUT\n HLT\n"
+    assert code(data_first) == reference
+    assert code(split) == reference
+    assert code(data_first, True) == code(SOURCE, True)
+
+
+def test_whitespace():
+    spaced = "\n\n  section   .text :\n\tLD ,DIRECT, hello  \n\n ST IMMEDIATE #STDOUT,\nHLT\nsection .data:\nhello:'h'"
+    assert code(spaced) == code(SOURCE)
+
+
+def test_comments():
+    commented = ("; вывод символа\nsection .text: ; код\n    LD DIRECT hello ;загрузка\n    ST IMMEDIATE #STDOUT\n"
+                 "    ;HLT DIRECT 1\n    HLT\nsection .data:\n    hello: 'h' ; 'x'\n")
+    assert code(commented) == code(SOURCE)
+    tokens = tokenize_line(1, "c: ';' ; 'x'")
+    assert [token.text for token in tokens] == ['c', ':', "';'"]
+    translated = translator.translate('section .data:\n s: "a;b"\n c: \';\'\nsection .text:\n HLT')
+    assert list(translated.data.values()) == [*map(ord, "a;b"), 0, ord(';')]
+
+
+def test_labels_before_declaration():
+    source = "section .text:\n JMP DIRECT .end\n .back\n HLT\n .end\n JMP DIRECT .back\n"
+    translated = translator.translate(source, True)
+    assert [instr.arg for instr in translated.program] == [translated.var_table['.end'], 0, translated.var_table['.back']]
+
+
+def run(source: str) -> tuple[str, int]:
+    translated = translator.translate(source)
+    control_unit = ControlUnit(io.StringIO(), translator.machine_code(translated), data_runs(translated.data),
+                               io.StringIO())
+    assert simulate(control_unit, 'instr') == 'halt'
+    return "".join(control_unit.datapath.output.output_buffer), control_unit.instr_cnt
+
+
+# Адрес метки - адрес следующей инструкции: маркер program (0) плюс инструкции до метки
+def test_leading_label():
+    translated = translator.translate("section .text:\n .loop\n LD DIRECT #STDIN\n JNZ DIRECT .loop\n HLT")
+    assert translated.code_labels == {'.loop': 1}
+    assert translated.program[1].arg == 1
+
+
+def test_backward_jump():
+    source = ("section .text:\n LD IMMEDIATE 3\n .loop\n DEC\n ST IMMEDIATE n\n JNZ DIRECT .loop\n"
+              " LD DIRECT n\n ADD IMMEDIATE 'A'\n ST IMMEDIATE #STDOUT\n HLT\nsection .data:\n n: 9")
+    assert translator.translate(source).code_labels == {'.loop': 2}
+    # LD, по три DEC/ST/JNZ, LD/ADD/ST и HLT
+    assert run(source) == ("A", 14)
+
+
+def test_forward_references():
+    source = ("section .text:\n JMP DIRECT .print\n .skip\n LD IMMEDIATE 'x'\n ST IMMEDIATE #STDOUT\n"
+              " .print\n LD IMMEDIATE 'y'\n ST IMMEDIATE #STDOUT\n JZ DIRECT .end\n HLT\n .end\n JMP DIRECT .skip")
+    assert translator.translate(source).code_labels == {'.skip': 2, '.print': 4, '.end': 8}
+    assert run(source) == ("y", 5)
+
+
+# несколько меток подряд указывают на одну инструкцию
+@pytest.mark.parametrize('target', ['.a', '.b', '.c'])
+def test_chained_labels(target: str):
+    source = ("section .text:\n LD IMMEDIATE 'A'\n .a\n .b\n .c\n ST IMMEDIATE #STDOUT\n INC\n CMP IMMEDIATE 'C'\n"
+              f" JNZ DIRECT {target}\n HLT")
+    assert translator.translate(source).code_labels == {'.a': 2, '.b': 2, '.c': 2}
+    assert run(source)[0] == "AB"
+
+
+# с ячейками меток прежний счет, по нему записаны golden-логи
+def test_label_cells():
+    translated = translator.translate("section .text:\n .start\n LD IMMEDIATE 1\n .a\n .b\n HLT", label_cells=True)
+    assert [translated.data[translated.marks[label]] for label in ('.start', '.a', '.b')] == [0, 2, 3]
+
+
+def test_literals():
+    translated = translator.translate('section .data:\n s: "a, b:  c"\n c: \',\'\n n: -5\nsection .text:\n HLT')
+    assert list(translated.data.values()) == [*map(ord, "a, b:  c"), 0, ord(','), -5]
+
+
+@pytest.mark.parametrize('source, message', [
+    ("LD DIRECT x", "1:1: код вне секции"),
+    ("section .code:\n HLT", "1:1: у секции формат"),
+    ("section .text:\n HLT\n  FOO DIRECT 1", "3:3: неизвестная команда FOO"),
+    ("section .text:\n  LD INDIRECTLY 1", "2:6: неизвестный тип адресации INDIRECTLY"),
+    ("section .text:\n LD   DIRECT missing", "2:14: неизвестное имя missing"),
+    ("section .text:\n LD DIRECT", "2:2: у команд формат"),
+    ("section .text:\n HLT\nsection .data:\n  x 5", "4:3: у декларирования данных формат"),
+    ("section .text:\n HLT\nsection .data:\n x: y", "4:2: у декларирования данных формат"),
+    ('section .text:\n HLT\nsection .data:\n s: "abc', '4:5: неожиданный символ \'"\''),
+    ("section .data:\n x: 1", "Должна быть обязательно cекция .text"),
+])
+def test_errors(source: str, message: str):
+    assert error(source).startswith(message)